@@ -36,7 +36,7 @@ from sys import stderr, argv
 import os.path
 
 
-REVISION = 2021042400
+REVISION = 2026101900
 
 
 def get_widget_base_units():
@@ -339,18 +339,35 @@ def flush_gtk_events():
         Gtk.main_iteration()
 
 
-def get_resource_loader():
+# загрузчик ресурсов (см. get_resource_loader())
+resourceLoader = None
+
+
+def get_resource_loader(cacheDir=None):
     """Возвращает экземпляр класса FileResourceLoader
     или ZipFileResourceLoader, в зависимости от того, как запущена
-    программа - из обычного файла, или из архива ZIP."""
+    программа - из обычного файла, или из архива ZIP.
+    Экземпляр создаётся при первом вызове, последующие вызовы
+    возвращают тот же экземпляр (с уже загруженными ресурсами).
+
+    cacheDir - если не None - путь к каталогу для кэша растеризованных
+    изображений (см. FileResourceLoader.load_pixbuf())."""
+
+    global resourceLoader
+
+    if resourceLoader is None:
+        # получаем путь к главному модулю (приложению)
+        appFilePath = os.path.abspath(argv[0])
+
+        # мы в жо... в зипе?
+        appIsZIP = zipfile.is_zipfile(appFilePath)
 
-    # получаем путь к главному модулю (приложению)
-    appFilePath = os.path.abspath(argv[0])
+        resourceLoader = ZipFileResourceLoader(appFilePath) if appIsZIP else FileResourceLoader(appFilePath)
 
-    # мы в жо... в зипе?
-    appIsZIP = zipfile.is_zipfile(appFilePath)
+    if cacheDir is not None:
+        resourceLoader.cacheDir = cacheDir
 
-    return ZipFileResourceLoader(appFilePath) if appIsZIP else FileResourceLoader(appFilePath);
+    return resourceLoader
 
 
 class FileResourceLoader():
@@ -367,6 +384,13 @@ class FileResourceLoader():
         self.appFilePath = appFilePath
         self.appDir = os.path.split(appFilePath)[0]
 
+        # None или путь к каталогу, где хранятся растеризованные
+        # векторные изображения (см. load_pixbuf())
+        self.cacheDir = None
+
+        # загруженные изображения; ключи - кортежи (filename, width, height)
+        self.pixbufs = {}
+
     def load(self, filename):
         """Загружает файл filename в память и возвращает в виде
         bytestring.
@@ -386,6 +410,12 @@ class FileResourceLoader():
             # для более внятных сообщений
             self.error = 'Не удалось загрузить файл "%s" - %s' % (filename, str(ex))
 
+    def get_mtime(self, filename):
+        """Возвращает время изменения файла filename
+        (как os.stat().st_mtime)."""
+
+        return os.stat(os.path.join(self.appDir, filename)).st_mtime
+
     def load_bytes(self, filename):
         """Загружает файл filename в память и возвращает в виде
         экземпляра GLib.Bytes.
@@ -423,6 +453,37 @@ class FileResourceLoader():
 
         return self.load_pixbuf(filename, size, size, fallback)
 
+    def __get_cached_pixbuf_path(self, filename, width, height):
+        # растеризуются при загрузке только векторные изображения,
+        # прочие и так загружаются быстро
+        if not self.cacheDir or not filename.lower().endswith('.svg'):
+            return None
+
+        if not isinstance(width, int) or width <= 0:
+            width = height = 0
+
+        return os.path.join(self.cacheDir, '%s-%dx%d.png' % (os.path.splitext(os.path.basename(filename))[0],
+            width, height))
+
+    def __load_cached_pixbuf(self, filename, cachePath):
+        try:
+            if os.stat(cachePath).st_mtime < self.get_mtime(filename):
+                return None
+
+            return Pixbuf.new_from_file(cachePath)
+        except Exception:
+            return None
+
+    def __save_cached_pixbuf(self, pixbuf, cachePath):
+        tmpPath = cachePath + '.tmp'
+
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            pixbuf.savev(tmpPath, 'png', [], [])
+            os.replace(tmpPath, cachePath)
+        except Exception as ex:
+            print('Can not save image "%s" - %s' % (cachePath, str(ex)), file=stderr)
+
     def load_pixbuf(self, filename, width, height, fallback=None):
         """Загружает файл в память и возвращает экземпляр Gdk.Pixbuf.
 
@@ -433,11 +494,34 @@ class FileResourceLoader():
                           <=0 или None.
         fallback        - имя стандартной иконки, которая будет загружена,
                           если не удалось загрузить файл filename;
-                          если fallback=None - генерируется исключение."""
+                          если fallback=None - генерируется исключение.
+
+        Загруженные изображения запоминаются (повторные вызовы с теми же
+        параметрами возвращают тот же экземпляр Gdk.Pixbuf), а векторные,
+        если задан self.cacheDir, ещё и сохраняются в нём в формате PNG -
+        дабы не растеризовать их при каждом запуске программы."""
+
+        key = (filename, width, height)
+
+        pixbuf = self.pixbufs.get(key)
+        if pixbuf is not None:
+            return pixbuf
 
         try:
-            return self.pixbuf_from_bytes(self.load_bytes(filename),
-                width, height)
+            cachePath = self.__get_cached_pixbuf_path(filename, width, height)
+
+            pixbuf = self.__load_cached_pixbuf(filename, cachePath) if cachePath else None
+
+            if pixbuf is None:
+                pixbuf = self.pixbuf_from_bytes(self.load_bytes(filename),
+                    width, height)
+
+                if cachePath:
+                    self.__save_cached_pixbuf(pixbuf, cachePath)
+
+            self.pixbufs[key] = pixbuf
+
+            return pixbuf
         except Exception as ex:
             print('Can not load image "%s" - %s' % (filename, str(ex)), file=stderr)
             if fallback is None:
@@ -463,7 +547,22 @@ class FileResourceLoader():
 class ZipFileResourceLoader(FileResourceLoader):
     """Загрузчик файлов ресурсов из архива ZIP.
     Архив - сам файл приложения в случае, когда он
-    представляет собой python zip application."""
+    представляет собой python zip application.
+
+    Архив открывается (и его оглавление читается) один раз,
+    при загрузке первого файла, загруженные файлы запоминаются."""
+
+    def __init__(self, appFilePath):
+        super().__init__(appFilePath)
+
+        self.zfile = None
+
+        # ключи - имена файлов, значения - bytestring
+        self.files = {}
+
+    def get_mtime(self, filename):
+        # файлы внутри архива меняются только вместе с ним
+        return os.stat(self.appFilePath).st_mtime
 
     def load(self, filename):
         """Аналогично FileResourceLoader.load(), загружает файл
@@ -471,15 +570,28 @@ class ZipFileResourceLoader(FileResourceLoader):
 
         filename - путь к файлу внутри архива."""
 
-        if not zipfile.is_zipfile(self.appFilePath):
-            raise TypeError('Файл "%s" не является архивом ZIP' % self.appFilePath)
+        data = self.files.get(filename)
+        if data is not None:
+            return data
+
+        try:
+            if self.zfile is None:
+                self.zfile = zipfile.ZipFile(self.appFilePath, allowZip64=True)
+
+            data = self.zfile.read(filename)
+        except Exception as ex:
+            raise Exception('Не удалось загрузить файл "%s" - %s' % (filename, str(ex)))
+
+        self.files[filename] = data
+
+        return data
+
+    def close(self):
+        """Закрытие архива (загруженные файлы остаются в памяти)."""
 
-        with zipfile.ZipFile(self.appFilePath, allowZip64=True) as zfile:
-            try:
-                with zfile.open(filename, 'r') as f:
-                    return f.read()
-            except Exception as ex:
-                raise Exception('Не удалось загрузить файл "%s" - %s' % (filename, str(ex)))
+        if self.zfile is not None:
+            self.zfile.close()
+            self.zfile = None
 
 
 class TreeViewShell():
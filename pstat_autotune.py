@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_autotune.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Подбор количества рабочих процессов извлечения метаданных во время
+# сбора статистики. Наилучшее значение сильно зависит от хранилища:
+# для локального SSD упирается в количество ядер, для USB-диска -
+# один-два процесса, для NFS - десятки одновременных чтений.
+#
+# Используется "восхождение к вершине": количество процессов меняется
+# шагами в одну сторону, пока скорость обработки (файлов в секунду)
+# растёт; когда перестаёт - пробуется другая сторона от лучшего
+# значения, после второй неудачи выбирается лучшее из измеренных.
+
+
+from time import monotonic
+
+
+class WorkerTuner():
+    """Подбор количества рабочих процессов pstat_extract.ExtractorPool
+    по измеренной скорости обработки файлов."""
+
+    # минимальная продолжительность одного измерения в секундах
+    WINDOW = 2.0
+
+    # минимальный прирост скорости, считающийся улучшением
+    IMPROVEMENT = 0.05
+
+    def __init__(self, maxWorkers, minWorkers=1):
+        self.minWorkers = max(1, minWorkers)
+        self.maxWorkers = max(self.minWorkers, maxWorkers)
+
+        self.reset(self.minWorkers)
+
+    def reset(self, nworkers):
+        """Начало подбора с nworkers рабочих процессов."""
+
+        self.nworkers = min(max(nworkers, self.minWorkers), self.maxWorkers)
+
+        # направление изменения количества процессов (1 или -1)
+        # и количество смен направления
+        self.direction = 1
+        self.reversals = 0
+
+        # подбор закончен
+        self.settled = False
+
+        # результаты измерений: ключи - количество процессов, значения -
+        # скорость обработки (файлов в секунду) и среднее время
+        # обработки файла в секундах
+        self.rates = {}
+        self.latencies = {}
+
+        # скорость, с которой сравнивается очередное измерение
+        self.prevRate = None
+
+        self.__start_window()
+
+    def __start_window(self):
+        # первые результаты после изменения количества процессов не учитываем -
+        # новые процессы ещё запускаются, а старые могут доделывать файлы
+        self.skip = self.nworkers
+
+        self.windowStart = None
+        self.windowFiles = 0
+        self.windowLatency = 0.0
+
+    def get_best(self):
+        """Возвращает количество процессов с наибольшей измеренной
+        скоростью или None, если измерений ещё нет."""
+
+        return max(self.rates, key=self.rates.get) if self.rates else None
+
+    def get_result(self):
+        """Возвращает подобранное количество процессов или None, если
+        для выбора недостаточно измерений (напр. файлов было мало)."""
+
+        return self.get_best() if len(self.rates) >= 2 else None
+
+    def add_result(self, seconds):
+        """Учёт очередного обработанного файла; seconds - время
+        его обработки. Возвращает количество процессов, которое
+        следует использовать дальше."""
+
+        if self.settled:
+            return self.nworkers
+
+        if self.skip > 0:
+            self.skip -= 1
+
+            if self.skip == 0:
+                self.windowStart = monotonic()
+
+            return self.nworkers
+
+        self.windowFiles += 1
+        self.windowLatency += seconds
+
+        elapsed = monotonic() - self.windowStart
+
+        # для достоверности - и не слишком быстро, и не слишком мало файлов
+        if elapsed < self.WINDOW or self.windowFiles < self.nworkers * 2:
+            return self.nworkers
+
+        self.latencies[self.nworkers] = self.windowLatency / self.windowFiles
+        self.__step(self.windowFiles / elapsed)
+
+        self.__start_window()
+
+        return self.nworkers
+
+    def __step(self, rate):
+        n = self.nworkers
+        self.rates[n] = rate
+
+        if self.prevRate is not None and rate <= self.prevRate * (1.0 + self.IMPROVEMENT):
+            # лучше не стало - пробуем в другую сторону от лучшего значения
+            self.direction = -self.direction
+            self.reversals += 1
+            n = self.get_best()
+
+        self.prevRate = self.rates[n]
+
+        if self.reversals < 2:
+            # шаг - пропорционален текущему значению, дабы до десятков
+            # процессов (NFS) добираться не слишком долго
+            nnext = min(max(n + self.direction * max(1, n // 4), self.minWorkers), self.maxWorkers)
+
+            if nnext not in self.rates:
+                self.nworkers = nnext
+                return
+
+        self.nworkers = self.get_best()
+        self.settled = True
+
+    def get_summary_str(self):
+        """Возвращает строку с результатами измерений."""
+
+        return 'Подбор количества рабочих процессов: %s; выбрано - %s' % (
+            ', '.join('%d: %.1f файл/с (%.3f с/файл)' % (n, self.rates[n], self.latencies[n]) for n in sorted(self.rates)) or 'нет измерений',
+            self.get_result() or 'н/д')
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    from time import sleep
+
+    # модель хранилища: скорость растёт до 6 процессов, дальше падает
+    def model_rate(n):
+        return 100.0 * min(n, 6) / (1.0 + max(0, n - 6) * 0.2)
+
+    WorkerTuner.WINDOW = 0.05
+
+    tuner = WorkerTuner(32)
+    tuner.reset(2)
+
+    while not tuner.settled:
+        n = tuner.nworkers
+        sleep(1.0 / model_rate(n))
+        tuner.add_result(n / model_rate(n))
+
+    print(tuner.get_summary_str())
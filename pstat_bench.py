@@ -0,0 +1,789 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_bench.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Замеры производительности сбора статистики на синтетическом наборе
+# файлов.
+#
+# SyntheticCorpus создаёт воспроизводимое (при том же seed) дерево
+# каталогов с файлами JPEG, TIFF и DNG, в которых записан EXIF
+# с правдоподобными распределениями значений (ФР с перевесом в сторону
+# краёв диапазона зума, диафрагмы из стандартного ряда с перевесом
+# в сторону открытой, ISO, выдержки, даты съёмки по "съёмкам" -
+# каталогам), а также битые файлы и файлы, к снимкам не относящиеся.
+#
+# run_benchmark() отдельно замеряет время стадий:
+#   walk        - поиск файлов (DirWalker);
+#   extract     - извлечение метаданных (без учёта статистики);
+#   aggregate   - PhotoStatistics.gather_photo_statistics() по уже
+#                 найденным файлам и извлечённым метаданным (т.е. только
+#                 учёт в статистике, индексах и дереве каталогов);
+#   tables      - получение таблиц статистики в виде текста
+#                 (get_stat_table_by_focals() и прочие);
+#   ui          - заполнение таблиц в окне (PhotoStatUI.update_stats_view());
+#                 пропускается, если GTK недоступен (нет дисплея и т.п.).
+# Результаты сохраняются в JSON и могут сравниваться с ранее сохранёнными
+# (compare_results()).
+#
+# Запуск:
+#   python3 pstat_bench.py -o results.json [-b baseline.json]
+
+
+import os, os.path
+import sys
+import struct
+import json
+import platform
+import shutil
+import tempfile
+import random
+from argparse import ArgumentParser
+from time import perf_counter, process_time, time
+from statistics import median
+
+from pstat_common import *
+from pstat_config import Configuration, get_config_file_name, RAW_FILE_EXTS, IMAGE_FILE_EXTS
+from pstat_walk import DirWalker
+from pstat_extract import MetadataExtractor, ExtractorPool
+from pstat_stat import PhotoStatistics
+
+
+RESULTS_FORMAT = 1
+
+# стадии - в порядке выполнения
+STAGE_WALK, STAGE_EXTRACT, STAGE_AGGREGATE, STAGE_TABLES, STAGE_UI = STAGES = ('walk',
+    'extract', 'aggregate', 'tables', 'ui')
+
+# стадии, медиана времени которых меньше этого значения (в секундах)
+# и в текущем, и в сравниваемом результате, при сравнении не учитываются -
+# на таких временах разброс больше любого допуска
+MIN_COMPARABLE_TIME = 0.005
+
+# файл с параметрами набора в его корневом каталоге - по нему определяется,
+# что каталог создан SyntheticCorpus и его можно использовать повторно
+# (или удалить и создать заново)
+CORPUS_MANIFEST = '.pstat-bench-corpus.json'
+
+
+#
+# камеры, объективы и прочие значения для синтетических EXIF
+#
+
+# (производитель, модель, вес, объективы - кортеж индексов в LENSES)
+CAMERAS = (('NIKON CORPORATION', 'NIKON D750', 30, (0, 1, 2, 5)),
+    ('Canon', 'Canon EOS R6', 25, (0, 1, 3, 6)),
+    ('FUJIFILM', 'X-T3', 15, (4, 7)),
+    ('SONY', 'ILCE-7M3', 20, (0, 2, 3, 5)),
+    ('Apple', 'iPhone 12', 10, (8,)))
+
+# (название, мин. ФР, макс. ФР, макс. отверстие на мин. ФР, на макс. ФР)
+LENSES = (('24-70mm f/2.8', 24, 70, 2.8, 2.8),
+    ('70-200mm f/2.8', 70, 200, 2.8, 2.8),
+    ('50mm f/1.8', 50, 50, 1.8, 1.8),
+    ('35mm f/1.4', 35, 35, 1.4, 1.4),
+    ('XF18-55mmF2.8-4 R LM OIS', 18, 55, 2.8, 4.0),
+    ('100-400mm f/4.5-5.6', 100, 400, 4.5, 5.6),
+    ('RF 85mm F1.2 L USM', 85, 85, 1.2, 1.2),
+    ('XF23mmF2 R WR', 23, 23, 2.0, 2.0),
+    ('iPhone 12 back camera 4.2mm f/1.6', 4, 4, 1.6, 1.6))
+
+# значения диафрагм (третьи ступени)
+APERTURES = (1.2, 1.4, 1.6, 1.8, 2.0, 2.2, 2.5, 2.8, 3.2, 3.5, 4.0, 4.5, 5.0,
+    5.6, 6.3, 7.1, 8.0, 9.0, 10.0, 11.0, 13.0, 14.0, 16.0, 18.0, 20.0, 22.0)
+
+ISO_SPEEDS = (100, 125, 160, 200, 250, 320, 400, 500, 640, 800, 1000, 1250,
+    1600, 2000, 2500, 3200, 4000, 5000, 6400, 8000, 10000, 12800)
+
+# знаменатели выдержек 1/N
+EXPOSURE_DENOMINATORS = (8000, 4000, 2000, 1000, 500, 250, 125, 60, 30, 15, 8, 4, 2, 1)
+
+# вес месяцев при выборе даты съёмки (летом снимают больше)
+MONTH_WEIGHTS = (4, 4, 6, 8, 10, 12, 12, 12, 9, 8, 5, 6)
+
+# типы файлов-"снимков": расширение - формат контейнера
+PHOTO_TYPES = {'.jpg': 'jpeg', '.tif': 'tiff', '.dng': 'dng'}
+
+# файлы, к снимкам не относящиеся: (расширение, содержимое)
+NOISE_FILES = (('.xmp', b'<x:xmpmeta xmlns:x="adobe:ns:meta/"></x:xmpmeta>\n'),
+    ('.txt', b'notes\n'),
+    ('.json', b'{}\n'),
+    ('.db', bytes(64)))
+
+# тэги TIFF
+TAG_MAKE, TAG_MODEL, TAG_EXIF_IFD, TAG_DNG_VERSION = 0x010F, 0x0110, 0x8769, 0xC612
+TAG_EXPOSURE, TAG_FNUMBER, TAG_ISO, TAG_DATE, TAG_FOCAL, TAG_LENS = 0x829A, 0x829D, 0x8827, 0x9003, 0x920A, 0xA434
+T_BYTE, T_ASCII, T_SHORT, T_LONG, T_RATIONAL = 1, 2, 3, 4, 5
+
+
+def build_tiff(entries0, entriesExif):
+    """Возвращает bytes - TIFF (little endian) с IFD0 и Exif IFD.
+    entries0, entriesExif - списки кортежей (тэг, тип, значение);
+    значения: str для T_ASCII, кортеж (числитель, знаменатель) для
+    T_RATIONAL, кортеж байт для T_BYTE, иначе int."""
+
+    def encode_value(vtype, v):
+        if vtype == T_ASCII:
+            raw = v.encode('utf-8') + b'\x00'
+            return len(raw), raw
+        elif vtype == T_RATIONAL:
+            return 1, struct.pack('<II', *v)
+        elif vtype == T_BYTE:
+            return len(v), bytes(v)
+        elif vtype == T_SHORT:
+            return 1, struct.pack('<H', v)
+        else:
+            return 1, struct.pack('<I', v)
+
+    def encode_ifd(entries, offset):
+        # offset - смещение IFD от начала файла;
+        # данные, не влезающие в поле значения, идут сразу за IFD
+        entries = sorted(entries)
+        dataOffset = offset + 2 + len(entries) * 12 + 4
+
+        ifd = [struct.pack('<H', len(entries))]
+        data = []
+
+        for tag, vtype, v in entries:
+            count, raw = encode_value(vtype, v)
+
+            if len(raw) <= 4:
+                ifd.append(struct.pack('<HHI', tag, vtype, count) + raw.ljust(4, b'\x00'))
+            else:
+                ifd.append(struct.pack('<HHII', tag, vtype, count, dataOffset))
+                raw += bytes(len(raw) % 2)
+                data.append(raw)
+                dataOffset += len(raw)
+
+        ifd.append(struct.pack('<I', 0))
+
+        return b''.join(ifd + data)
+
+    # размер IFD0 от значения указателя на Exif IFD не зависит
+    entries0 = list(entries0) + [(TAG_EXIF_IFD, T_LONG, 0)]
+    exifOffset = 8 + len(encode_ifd(entries0, 8))
+    entries0[-1] = (TAG_EXIF_IFD, T_LONG, exifOffset)
+
+    return b'II*\x00' + struct.pack('<I', 8) + encode_ifd(entries0, 8) + encode_ifd(entriesExif, exifOffset)
+
+
+def build_jpeg(tiff, payload):
+    """Возвращает bytes - JPEG с сегментом APP1 (EXIF) и данными payload
+    в качестве "изображения"."""
+
+    app1 = b'Exif\x00\x00' + tiff
+
+    return b''.join((b'\xff\xd8',
+        b'\xff\xe0', struct.pack('>H', 16), b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00',
+        b'\xff\xe1', struct.pack('>H', len(app1) + 2), app1,
+        b'\xff\xda\x00\x02', payload,
+        b'\xff\xd9'))
+
+
+class SyntheticCorpus():
+    """Генератор синтетического набора файлов для замеров.
+
+    Дерево каталогов: на первом уровне - каталоги по годам, ниже -
+    depth - 1 уровней каталогов "съёмок" по fanout подкаталогов
+    в каждом; файлы снимков лежат в каталогах последнего уровня
+    (по filesPerDir в каждом), снимки каталога сняты одной камерой
+    в один день. Битые файлы и файлы, к снимкам не относящиеся,
+    разбросаны по всем каталогам."""
+
+    def __init__(self, seed=1, depth=3, fanout=4, filesPerDir=50,
+            mix=None, corrupt=0.02, noise=0.05, payload=2048):
+        """seed         - начальное значение генератора случайных чисел;
+        depth           - количество уровней каталогов;
+        fanout          - количество подкаталогов в каждом каталоге;
+        filesPerDir     - количество снимков в каждом каталоге последнего уровня;
+        mix             - None или словарь, где ключи - расширения
+                          из PHOTO_TYPES, значения - веса;
+        corrupt         - доля битых файлов (от количества снимков);
+        noise           - доля файлов, к снимкам не относящихся;
+        payload         - размер "изображения" в файле в байтах."""
+
+        self.seed = seed
+        self.depth = max(1, depth)
+        self.fanout = max(1, fanout)
+        self.filesPerDir = filesPerDir
+        self.mix = dict(mix) if mix else {'.jpg': 60, '.tif': 10, '.dng': 30}
+        self.corrupt = corrupt
+        self.noise = noise
+        self.payload = payload
+
+        for ext in self.mix:
+            if ext not in PHOTO_TYPES:
+                raise ValueError('Неподдерживаемый тип файла "%s"' % ext)
+
+        # заполняются generate()
+        self.nPhotos = 0
+        self.nCorrupt = 0
+        self.nNoise = 0
+        self.nDirs = 0
+
+    def get_params(self):
+        """Возвращает словарь параметров набора (для сохранения
+        в результатах и сравнения с ними)."""
+
+        return {'seed': self.seed,
+            'depth': self.depth,
+            'fanout': self.fanout,
+            'filesPerDir': self.filesPerDir,
+            'mix': self.mix,
+            'corrupt': self.corrupt,
+            'noise': self.noise,
+            'payload': self.payload}
+
+    def get_counts(self):
+        return {'dirs': self.nDirs,
+            'photos': self.nPhotos,
+            'corrupt': self.nCorrupt,
+            'noise': self.nNoise}
+
+    def __random_photo(self, rng, camera, dt):
+        """Возвращает кортеж (entries0, entriesExif) для build_tiff()."""
+
+        make, model, cweight, lensIxs = camera
+
+        lname, fmin, fmax, amin, amax = LENSES[rng.choice(lensIxs)]
+
+        if fmin == fmax:
+            focal = fmin
+        else:
+            # на зумах снимают в основном на краях диапазона
+            r = rng.random()
+            if r < 0.4:
+                focal = fmin
+            elif r < 0.7:
+                focal = fmax
+            else:
+                focal = rng.randint(fmin, fmax)
+
+        # максимальное относительное отверстие на данном ФР
+        openap = amin + (amax - amin) * (focal - fmin) / (fmax - fmin) if fmax > fmin else amin
+        stops = [a for a in APERTURES if a >= openap - 0.05]
+
+        if fmin == fmax == 4:
+            # у телефона диафрагма не меняется
+            aperture = openap
+        elif rng.random() < 0.35:
+            aperture = stops[0]
+        else:
+            aperture = stops[min(len(stops) - 1, int(rng.expovariate(0.35)))]
+
+        iso = ISO_SPEEDS[min(len(ISO_SPEEDS) - 1, int(abs(rng.gauss(0, 5))))]
+        exposure = EXPOSURE_DENOMINATORS[min(len(EXPOSURE_DENOMINATORS) - 1, int(abs(rng.gauss(5, 2.5))))]
+
+        entries0 = [(TAG_MAKE, T_ASCII, make), (TAG_MODEL, T_ASCII, model)]
+        entriesExif = [(TAG_EXPOSURE, T_RATIONAL, (1, exposure)),
+            (TAG_FNUMBER, T_RATIONAL, (int(round(aperture * 10)), 10)),
+            (TAG_ISO, T_SHORT, iso),
+            (TAG_DATE, T_ASCII, dt),
+            (TAG_FOCAL, T_RATIONAL, (focal * 10, 10)),
+            (TAG_LENS, T_ASCII, lname)]
+
+        return entries0, entriesExif
+
+    def __make_photo(self, rng, ext, camera, dt):
+        entries0, entriesExif = self.__random_photo(rng, camera, dt)
+        ctype = PHOTO_TYPES[ext]
+
+        if ctype == 'dng':
+            entries0.append((TAG_DNG_VERSION, T_BYTE, (1, 4, 0, 0)))
+
+        tiff = build_tiff(entries0, entriesExif)
+
+        if ctype == 'jpeg':
+            return build_jpeg(tiff, bytes(self.payload))
+        else:
+            return tiff + bytes(self.payload)
+
+    def __make_corrupt(self, rng, ext, camera, dt):
+        data = self.__make_photo(rng, ext, camera, dt)
+        kind = rng.randrange(4)
+
+        if kind == 0:
+            # обрезан посреди EXIF
+            return data[:rng.randint(12, 120)]
+        elif kind == 1:
+            # мусор вместо содержимого
+            return bytes(rng.getrandbits(8) for i in range(256))
+        elif kind == 2:
+            # пустой файл
+            return b''
+        else:
+            # испорчено смещение IFD0
+            if data[:4] == b'II*\x00':
+                return data[:4] + struct.pack('<I', 0x7FFFFFF0) + data[8:]
+            else:
+                return data[:30] + bytes(64) + data[94:]
+
+    def generate(self, root):
+        """Создание набора файлов в каталоге root (каталог должен быть
+        пустым или отсутствовать). Заполняет счётчики nPhotos и т.п."""
+
+        rng = random.Random(self.seed)
+
+        self.nPhotos = self.nCorrupt = self.nNoise = self.nDirs = 0
+
+        exts = sorted(self.mix)
+        extWeights = [self.mix[ext] for ext in exts]
+        camWeights = [c[2] for c in CAMERAS]
+
+        def write_file(dirpath, name, data):
+            with open(os.path.join(dirpath, name), 'wb') as f:
+                f.write(data)
+
+        def add_noise(dirpath, nfiles):
+            # битые и посторонние файлы - по доле от количества снимков,
+            # дробная часть - с соответствующей вероятностью
+            ncorrupt = int(nfiles * self.corrupt + rng.random())
+            for ix in range(ncorrupt):
+                ext = rng.choices(exts, extWeights)[0]
+                write_file(dirpath, 'broken%04d%s' % (ix, ext),
+                    self.__make_corrupt(rng, ext, rng.choices(CAMERAS, camWeights)[0], '2020:01:01 00:00:00'))
+
+            nnoise = int(nfiles * self.noise + rng.random())
+            for ix in range(nnoise):
+                ext, data = rng.choice(NOISE_FILES)
+                write_file(dirpath, 'other%04d%s' % (ix, ext), data)
+
+            self.nCorrupt += ncorrupt
+            self.nNoise += nnoise
+
+        def make_dir(dirpath, level, year):
+            os.makedirs(dirpath, exist_ok=True)
+            self.nDirs += 1
+
+            if level >= self.depth:
+                # каталог съёмки
+                camera = rng.choices(CAMERAS, camWeights)[0]
+                month = rng.choices(range(1, 13), MONTH_WEIGHTS)[0]
+                day = rng.randint(1, 28)
+                seconds = rng.randint(6 * 3600, 18 * 3600)
+
+                for ix in range(self.filesPerDir):
+                    ext = rng.choices(exts, extWeights)[0]
+                    seconds += rng.randint(1, 120)
+                    dt = '%.4d:%.2d:%.2d %.2d:%.2d:%.2d' % (year, month, day,
+                        min(23, seconds // 3600), seconds // 60 % 60, seconds % 60)
+
+                    write_file(dirpath, 'IMG_%04d%s' % (ix, ext), self.__make_photo(rng, ext, camera, dt))
+
+                self.nPhotos += self.filesPerDir
+                add_noise(dirpath, self.filesPerDir)
+            else:
+                add_noise(dirpath, self.fanout)
+
+                for ix in range(self.fanout):
+                    if level == 1:
+                        subyear = 2010 + ix
+                        name = str(subyear)
+                    else:
+                        subyear = year
+                        name = 'shoot-%02d' % (ix + 1)
+
+                    make_dir(os.path.join(dirpath, name), level + 1, subyear)
+
+        make_dir(root, 1 if self.depth > 1 else 2, 2020)
+
+        with open(os.path.join(root, CORPUS_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump({'params': self.get_params(), 'counts': self.get_counts()}, f)
+
+    def reuse(self, root):
+        """Проверка, создан ли набор в каталоге root с теми же параметрами.
+        Если да - заполняет счётчики и возвращает True."""
+
+        try:
+            with open(os.path.join(root, CORPUS_MANIFEST), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if manifest.get('params') != json.loads(json.dumps(self.get_params())):
+            return False
+
+        counts = manifest['counts']
+        self.nDirs = counts['dirs']
+        self.nPhotos = counts['photos']
+        self.nCorrupt = counts['corrupt']
+        self.nNoise = counts['noise']
+
+        return True
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+            ', '.join('%s=%s' % nv for nv in self.get_params().items()))
+
+
+class ReplayWalker():
+    """Замена DirWalker, возвращающая заранее полученные результаты
+    обхода дерева (для замера стадии aggregate без обращения к ФС)."""
+
+    def __init__(self, dirs):
+        # список кортежей, возвращённых DirWalker.walk()
+        self.dirs = dirs
+
+    def walk(self, top, ftypes):
+        return iter(self.dirs)
+
+
+class ReplayExtractor(MetadataExtractor):
+    """Замена MetadataExtractor, возвращающая заранее извлечённые
+    метаданные (для замера стадии aggregate без чтения файлов)."""
+
+    def __init__(self, results):
+        super().__init__()
+
+        # ключи - полные пути к файлам, значения - кортежи (photo_metadata или None, состояние)
+        self.results = results
+
+    def process(self, items):
+        for fileId, fpath in items:
+            md, status = self.results[fpath]
+
+            yield (fileId, md, status, 0.0)
+
+
+class StageTimer():
+    """Накопление результатов замеров стадий."""
+
+    def __init__(self):
+        # ключи - названия стадий, значения - словари с результатами
+        self.stages = {}
+
+    def run(self, stage, fn, repeats):
+        """Вызывает fn() repeats раз, учитывая время выполнения как время
+        стадии stage. Возвращает значение, возвращённое последним вызовом."""
+
+        wall = []
+        cpu = []
+
+        for ix in range(repeats):
+            t0 = perf_counter()
+            c0 = process_time()
+
+            ret = fn()
+
+            cpu.append(process_time() - c0)
+            wall.append(perf_counter() - t0)
+
+        self.stages[stage] = {'runs': wall,
+            'cpu': cpu,
+            'min': min(wall),
+            'median': median(wall)}
+
+        return ret
+
+    def skip(self, stage, reason):
+        self.stages[stage] = {'skipped': reason}
+
+
+def get_ui_populate_fn(stats, rootDir):
+    """Возвращает функцию, заполняющую таблицы в окне программы
+    статистикой stats, или строку с причиной, по которой это невозможно."""
+
+    try:
+        from gi.repository import Gtk
+
+        if not Gtk.init_check(sys.argv)[0]:
+            return 'GTK не инициализирован (нет дисплея?)'
+
+        from pstat_ui import PhotoStatUI
+
+    except Exception as ex:
+        return exception_to_str(ex)
+
+    config = Configuration(get_config_file_name())
+    config.cfgPhotoRootDir = rootDir
+    config.cfgRefreshOnStart = False
+
+    ui = PhotoStatUI(config)
+    ui.window.hide()
+
+    ui.stats = stats
+    ui.update_dir_tree_view()
+
+    return ui.update_stats_view
+
+
+def run_benchmark(root, ftypes, repeats=3, workers=0, walkThreads=1, withUI=True):
+    """Замеры времени стадий сбора статистики по файлам в каталоге root.
+
+    ftypes      - множество расширений обрабатываемых файлов;
+    repeats     - количество повторов каждой стадии;
+    workers     - количество процессов для извлечения метаданных
+                  (0 - в текущем процессе);
+    walkThreads - количество потоков поиска файлов;
+    withUI      - замерять ли заполнение таблиц в окне.
+
+    Возвращает словарь с результатами по стадиям (см. StageTimer)."""
+
+    timer = StageTimer()
+    root = os.path.normpath(root)
+
+    walker = DirWalker(walkThreads)
+
+    def walk():
+        return [(dirpath, nfiles, list(files), npaired, nlinked) for dirpath, nfiles, files, npaired, nlinked in walker.walk(root, ftypes)]
+
+    dirs = timer.run(STAGE_WALK, walk, repeats)
+
+    paths = [os.path.join(dirpath, fname) for dirpath, nfiles, files, npaired, nlinked in dirs for fname, fsize, fmtime in files]
+
+    def extract():
+        extractor = ExtractorPool(workers, 60.0) if workers > 0 else MetadataExtractor()
+
+        results = {}
+
+        try:
+            for r in extractor.process(enumerate(paths)):
+                if r is not None:
+                    fileId, md, status, seconds = r
+                    results[paths[fileId]] = (md, status)
+
+            return results
+        finally:
+            extractor.close()
+
+    results = timer.run(STAGE_EXTRACT, extract, repeats)
+
+    def aggregate():
+        stats = PhotoStatistics()
+
+        ok, em = stats.gather_photo_statistics(root, ftypes,
+            extractor=ReplayExtractor(results),
+            walker=ReplayWalker(dirs))
+
+        if em:
+            raise RuntimeError(em)
+
+        return stats
+
+    stats = timer.run(STAGE_AGGREGATE, aggregate, repeats)
+
+    timer.run(STAGE_TABLES, stats.get_stat_tables_str, repeats)
+
+    if not withUI:
+        timer.skip(STAGE_UI, 'отключено')
+    else:
+        populate = get_ui_populate_fn(stats, root)
+
+        if isinstance(populate, str):
+            timer.skip(STAGE_UI, populate)
+        else:
+            timer.run(STAGE_UI, populate, repeats)
+
+    return timer.stages
+
+
+def compare_results(results, baseline, tolerance=0.1):
+    """Сравнение результатов замеров results с ранее сохранёнными
+    baseline (словари в формате, возвращаемом make_results()).
+
+    Возвращает кортеж из двух элементов:
+    1. список строк отчёта;
+    2. список стадий, время которых выросло более чем на tolerance
+       (доля от времени в baseline)."""
+
+    report = []
+    regressions = []
+
+    if baseline.get('format') != RESULTS_FORMAT:
+        return (['Неизвестный формат файла результатов для сравнения'], regressions)
+
+    if baseline.get('corpus') != results.get('corpus'):
+        report.append('Внимание: параметры набора файлов отличаются, сравнение может быть некорректным')
+
+    for stage in STAGES:
+        new = results['stages'].get(stage, {})
+        old = baseline['stages'].get(stage, {})
+
+        if 'median' not in new or 'median' not in old:
+            report.append('  %-10s нет данных для сравнения' % stage)
+            continue
+
+        tnew = new['median']
+        told = old['median']
+
+        if tnew < MIN_COMPARABLE_TIME and told < MIN_COMPARABLE_TIME:
+            mark = ''
+        elif tnew > told * (1.0 + tolerance):
+            mark = 'МЕДЛЕННЕЕ'
+            regressions.append(stage)
+        elif tnew < told * (1.0 - tolerance):
+            mark = 'быстрее'
+        else:
+            mark = ''
+
+        report.append('  %-10s %10.4f с -> %10.4f с  %+7.1f%%  %s' % (stage,
+            told, tnew, (tnew - told) * 100.0 / told if told > 0 else 0.0, mark))
+
+    return (report, regressions)
+
+
+def make_results(corpus, stages, repeats, workers, walkThreads):
+    """Возвращает словарь с результатами замеров (для сохранения в JSON)."""
+
+    return {'format': RESULTS_FORMAT,
+        'version': APP_VERSION,
+        'timestamp': time(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'repeats': repeats,
+        'workers': workers,
+        'walkThreads': walkThreads,
+        'corpus': corpus.get_params(),
+        'counts': corpus.get_counts(),
+        'stages': stages}
+
+
+def parse_mix(s):
+    """Разбор строки вида "jpg=60,tif=10,dng=30"."""
+
+    mix = {}
+
+    for item in s.split(','):
+        ext, sep, weight = item.partition('=')
+        ext = ext.strip().lower()
+
+        if not ext.startswith('.'):
+            ext = '.' + ext
+
+        mix[ext] = float(weight) if sep else 1.0
+
+    return mix
+
+
+def main():
+    parser = ArgumentParser(description='Замеры производительности сбора статистики')
+
+    parser.add_argument('-d', '--corpus-dir', dest='corpusDir', metavar='DIR',
+        help='каталог для набора файлов (по умолчанию - временный каталог); '
+             'набор с теми же параметрами используется повторно')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--depth', type=int, default=3,
+        help='количество уровней каталогов')
+    parser.add_argument('--fanout', type=int, default=4,
+        help='количество подкаталогов в каждом каталоге')
+    parser.add_argument('--files', dest='filesPerDir', type=int, default=50,
+        help='количество снимков в каталоге последнего уровня')
+    parser.add_argument('--mix', type=parse_mix, default=None,
+        help='доли типов файлов, напр. "jpg=60,tif=10,dng=30"')
+    parser.add_argument('--corrupt', type=float, default=0.02,
+        help='доля битых файлов')
+    parser.add_argument('--noise', type=float, default=0.05,
+        help='доля файлов, к снимкам не относящихся')
+    parser.add_argument('-n', '--repeats', type=int, default=3,
+        help='количество повторов каждой стадии')
+    parser.add_argument('-w', '--workers', type=int, default=0,
+        help='количество процессов для извлечения метаданных (0 - в текущем процессе)')
+    parser.add_argument('-t', '--walk-threads', dest='walkThreads', type=int, default=1,
+        help='количество потоков поиска файлов')
+    parser.add_argument('--no-ui', dest='withUI', action='store_false',
+        help='не замерять заполнение таблиц в окне')
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help='файл для сохранения результатов в JSON')
+    parser.add_argument('-b', '--baseline', metavar='FILE',
+        help='файл с ранее сохранёнными результатами для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='допустимый рост времени стадии (доля) при сравнении')
+
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as ex:
+            print('Не удалось загрузить файл "%s" - %s' % (args.baseline, exception_to_str(ex)), file=sys.stderr)
+            return 1
+
+    try:
+        corpus = SyntheticCorpus(args.seed, args.depth, args.fanout, args.filesPerDir,
+            args.mix, args.corrupt, args.noise)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    tmpDir = None
+
+    if args.corpusDir:
+        root = os.path.abspath(args.corpusDir)
+    else:
+        tmpDir = tempfile.mkdtemp(prefix='pstat-bench-')
+        root = tmpDir
+
+    try:
+        if not corpus.reuse(root):
+            if os.path.isdir(root) and os.listdir(root):
+                if not os.path.exists(os.path.join(root, CORPUS_MANIFEST)):
+                    print('Каталог "%s" не пуст и не содержит набора файлов для замеров' % root, file=sys.stderr)
+                    return 1
+
+                shutil.rmtree(root)
+
+            print('Создание набора файлов в "%s"...' % root, file=sys.stderr)
+            corpus.generate(root)
+
+        print('Набор файлов: %s' % ', '.join('%s: %d' % nv for nv in corpus.get_counts().items()), file=sys.stderr)
+
+        stages = run_benchmark(root, RAW_FILE_EXTS | IMAGE_FILE_EXTS,
+            args.repeats, args.workers, args.walkThreads, args.withUI)
+
+    finally:
+        if tmpDir:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+    results = make_results(corpus, stages, args.repeats, args.workers, args.walkThreads)
+
+    for stage in STAGES:
+        st = stages[stage]
+
+        if 'skipped' in st:
+            print('  %-10s пропущено: %s' % (stage, st['skipped']))
+        else:
+            print('  %-10s медиана %10.4f с  мин. %10.4f с' % (stage, st['median'], st['min']))
+
+    if args.output:
+        try:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=1)
+        except OSError as ex:
+            print('Не удалось сохранить результаты в файл "%s" - %s' % (args.output, exception_to_str(ex)), file=sys.stderr)
+            return 1
+
+    if baseline is not None:
+        report, regressions = compare_results(results, baseline, args.tolerance)
+
+        print('\nСравнение с "%s":' % args.baseline)
+        print('\n'.join(report))
+
+        if regressions:
+            print('\nЗамедлились стадии: %s' % ', '.join(regressions))
+            return 2
+
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
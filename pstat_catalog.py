@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_catalog.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Метаданные снимков из баз данных каталогизаторов (darktable - library.db,
+# digiKam - digikam4.db; обе - SQLite): для файлов, известных каталогизатору,
+# метаданные берутся из базы, сами файлы не открываются.
+
+
+import os, os.path
+import sys
+import sqlite3
+import datetime
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import pathname2url
+
+from pstat_common import *
+from pstat_extract import MetadataExtractor, photo_metadata, get_camera_name
+
+
+CATALOG_DARKTABLE = 'darktable'
+CATALOG_DIGIKAM = 'digiKam'
+
+# допустимое расхождение времени изменения файла и времени из базы
+# (в секундах) - на FAT и некоторых сетевых ФС время хранится с точностью до 2 с
+MTIME_TOLERANCE = 2.0
+
+# начало отсчёта значений GTimeSpan в базах darktable 3.6+
+GTIMESPAN_ORIGIN = datetime.datetime(1, 1, 1)
+
+
+def make_metadata(focal, aperture, iso, exposure, date, camera, lens):
+    """Возвращает экземпляр photo_metadata по значениям из базы
+    (None и нули - неизвестные значения)."""
+
+    focal = int(round(focal)) if focal and focal > 0 else -1
+    aperture = float(aperture) if aperture and aperture >= 0.5 else 0.0
+    iso = int(round(iso)) if iso and iso > 0 else 0
+    exposure = float(exposure) if exposure and exposure > 0 else 0.0
+
+    if date is not None:
+        year = date.year
+        month = date.month
+    else:
+        year = None
+        month = None
+
+    return photo_metadata(focal, aperture, iso, year, month, exposure, date,
+        camera, lens.strip() if lens else '')
+
+
+def darktable_datetime(v):
+    """Преобразование значения даты/времени из базы darktable
+    в datetime.datetime (или None).
+    В версиях до 3.6 - строка "ГГГГ:ММ:ДД чч:мм:сс" (дата съёмки)
+    или время в секундах с 1970 г., начиная с 3.6 - GTimeSpan
+    (микросекунды с 0001-01-01)."""
+
+    if not v:
+        return None
+
+    try:
+        if isinstance(v, str):
+            return datetime.datetime.strptime(v[:19], '%Y:%m:%d %H:%M:%S')
+
+        if v > 10 ** 14:
+            return GTIMESPAN_ORIGIN + datetime.timedelta(microseconds=v)
+
+        return datetime.datetime.fromtimestamp(v)
+
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def iso_datetime(v):
+    """Преобразование строки даты/времени в формате ISO 8601
+    (как в базе digiKam) в datetime.datetime (или None)."""
+
+    if not v:
+        return None
+
+    try:
+        return datetime.datetime.fromisoformat(v[:19])
+    except ValueError:
+        return None
+
+
+def get_uuid_mount_point(uuid):
+    """Возвращает точку монтирования тома с UUID uuid или None
+    (только для Linux)."""
+
+    try:
+        dev = os.path.realpath(os.path.join('/dev/disk/by-uuid', uuid))
+
+        with open('/proc/mounts', 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and os.path.realpath(fields[0]) == dev:
+                    # пробелы в путях в /proc/mounts закодированы как \040
+                    return fields[1].replace('\\040', ' ')
+    except OSError:
+        pass
+
+    return None
+
+
+def digikam_album_root(identifier, specificPath):
+    """Возвращает путь к корневому каталогу коллекции digiKam по полям
+    identifier и specificPath таблицы AlbumRoots."""
+
+    query = parse_qs(urlsplit(identifier).query)
+
+    if 'path' in query:
+        # volumeid:?path=/путь - путь указан полностью
+        return query['path'][0]
+
+    if 'mountpath' in query:
+        # сетевой ресурс
+        mountPoint = query['mountpath'][0]
+    elif 'uuid' in query:
+        mountPoint = get_uuid_mount_point(query['uuid'][0])
+    else:
+        mountPoint = None
+
+    # если том не найден - считаем, что он смонтирован в корень
+    return os.path.join(mountPoint or os.sep, (specificPath or '').lstrip('/'))
+
+
+class PhotoCatalog():
+    """Метаданные снимков, загруженные из базы каталогизатора.
+
+    Поля:
+        fname   - путь к файлу базы;
+        kind    - тип каталогизатора (CATALOG_*);
+        entries - словарь, где ключи - нормализованные полные пути
+                  к файлам, а значения - кортежи из двух элементов:
+                  экземпляр photo_metadata и время (как os.stat().st_mtime),
+                  не раньше которого файл был изменён в последний раз
+                  по данным из базы, или None, если неизвестно."""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.kind = None
+        self.entries = {}
+
+    def load(self):
+        """Загрузка метаданных из базы.
+        Возвращает None или строку с сообщением об ошибке."""
+
+        self.entries.clear()
+
+        if not os.path.isfile(self.fname):
+            return 'Файл базы данных каталога "%s" не найден' % self.fname
+
+        try:
+            # только чтение - каталогизатор может работать одновременно с нами
+            db = sqlite3.connect('file:%s?mode=ro' % pathname2url(self.fname), uri=True)
+
+            try:
+                tables = set(map(lambda r: r[0].lower(),
+                    db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")))
+
+                if {'images', 'film_rolls'} <= tables:
+                    self.kind = CATALOG_DARKTABLE
+                    self.__load_darktable(db, tables)
+                elif {'images', 'albums', 'albumroots', 'imagemetadata', 'imageinformation'} <= tables:
+                    self.kind = CATALOG_DIGIKAM
+                    self.__load_digikam(db)
+                else:
+                    return 'Файл "%s" - не база данных darktable или digiKam' % self.fname
+
+            finally:
+                db.close()
+
+        except sqlite3.Error as ex:
+            self.entries.clear()
+            return 'Ошибка чтения базы данных каталога "%s" - %s' % (self.fname, exception_to_str(ex))
+
+    def __load_darktable(self, db, tables):
+        columns = set(map(lambda r: r[1].lower(), db.execute('PRAGMA table_info(images)')))
+
+        if 'maker_id' in columns and {'makers', 'models', 'lens'} <= tables:
+            # darktable 3.8+: названия камер и объективов - в отдельных таблицах
+            names = 'mk.name, md.name, ln.name'
+            joins = '''LEFT JOIN makers AS mk ON mk.id = i.maker_id
+                LEFT JOIN models AS md ON md.id = i.model_id
+                LEFT JOIN lens AS ln ON ln.id = i.lens_id'''
+        else:
+            names = 'i.maker, i.model, i.lens'
+            joins = ''
+
+        # файл не должен был изменяться после импорта в darktable
+        mtimeColumn = 'i.import_timestamp' if 'import_timestamp' in columns else 'NULL'
+
+        for folder, filename, maker, model, lens, exposure, aperture, iso, focal, taken, imported in db.execute(
+                '''SELECT f.folder, i.filename, %s,
+                    i.exposure, i.aperture, i.iso, i.focal_length, i.datetime_taken, %s
+                FROM images AS i JOIN film_rolls AS f ON f.id = i.film_id %s''' % (names, mtimeColumn, joins)):
+
+            imported = darktable_datetime(imported)
+
+            self.entries[os.path.normpath(os.path.join(folder, filename))] = (make_metadata(focal,
+                aperture, iso, exposure, darktable_datetime(taken),
+                get_camera_name(maker, model), lens),
+                imported.timestamp() if imported is not None else None)
+
+    def __load_digikam(self, db):
+        roots = {}
+
+        for rootId, identifier, specificPath in db.execute('SELECT id, identifier, specificPath FROM AlbumRoots'):
+            roots[rootId] = digikam_album_root(identifier or '', specificPath)
+
+        # Images.status: 3 - в корзине, 4 - устаревшая запись
+        for rootId, relPath, name, modified, created, make, model, lens, aperture, focal, exposure, iso in db.execute(
+                '''SELECT a.albumRoot, a.relativePath, i.name, i.modificationDate, ii.creationDate,
+                    im.make, im.model, im.lens, im.aperture, im.focalLength, im.exposureTime, im.sensitivity
+                FROM Images AS i JOIN Albums AS a ON a.id = i.album
+                LEFT JOIN ImageInformation AS ii ON ii.imageid = i.id
+                LEFT JOIN ImageMetadata AS im ON im.imageid = i.id
+                WHERE i.status NOT IN (3, 4)'''):
+
+            root = roots.get(rootId)
+            if root is None:
+                continue
+
+            modified = iso_datetime(modified)
+
+            self.entries[os.path.normpath(os.path.join(root, (relPath or '').lstrip('/'), name))] = (make_metadata(focal,
+                aperture, iso, exposure, iso_datetime(created),
+                get_camera_name(make, model), lens),
+                modified.timestamp() if modified is not None else None)
+
+    def __repr__(self):
+        return '%s(fname="%s", kind=%s, entries=%d)' % (self.__class__.__name__,
+            self.fname, self.kind, len(self.entries))
+
+
+class CatalogExtractor(MetadataExtractor):
+    """Извлечение метаданных с использованием баз каталогизаторов:
+    для файлов, известных каталогизатору (и, если checkMtime == True,
+    не изменявшихся после занесения в базу), метаданные берутся из базы,
+    остальные файлы передаются экстрактору fallback."""
+
+    # сколько результатов для файлов из баз может накопиться,
+    # пока fallback ждёт очередной файл для чтения (см. process())
+    RESULTS_BATCH = 256
+
+    def __init__(self, fallback, catalogs, checkMtime=True):
+        """fallback     - экземпляр MetadataExtractor (или ExtractorPool);
+        catalogs        - список экземпляров PhotoCatalog (загруженных);
+        checkMtime      - сравнивать ли время изменения файлов с данными из баз."""
+
+        # до вызова конструктора предка - см. свойство profiler
+        self.fallback = fallback
+
+        super().__init__(fallback.quarantine)
+
+        self.checkMtime = checkMtime
+
+        # общий словарь (см. PhotoCatalog.entries); при повторах
+        # путей в разных базах используется последняя по списку
+        self.entries = {}
+        for catalog in catalogs:
+            self.entries.update(catalog.entries)
+
+        # счётчики файлов, метаданные которых взяты из баз
+        # и переданных экстрактору fallback
+        self.nFromCatalog = 0
+        self.nFallback = 0
+
+    @property
+    def profiler(self):
+        return self.fallback.profiler
+
+    @profiler.setter
+    def profiler(self, v):
+        self.fallback.profiler = v
+
+    @property
+    def pace(self):
+        return self.fallback.pace
+
+    @pace.setter
+    def pace(self, v):
+        self.fallback.pace = v
+
+    @property
+    def fileStat(self):
+        return self.fallback.fileStat
+
+    @fileStat.setter
+    def fileStat(self, v):
+        self.fallback.fileStat = v
+
+    def __is_unchanged(self, fpath, mtime, fileMtime=0):
+        # fileMtime - время изменения файла в наносекундах, если известно
+        # по данным поиска файлов (см. MetadataExtractor.fileStat)
+        if mtime is None:
+            # проверить нечем
+            return True
+
+        if not fileMtime:
+            try:
+                fileMtime = os.stat(fpath).st_mtime_ns
+            except OSError:
+                # пусть с этим файлом разбирается fallback
+                return False
+
+        return fileMtime <= (mtime + MTIME_TOLERANCE) * 1e9
+
+    def is_cached(self, fpath):
+        entry = self.entries.get(fpath)
+
+        if entry is not None and (not self.checkMtime or self.__is_unchanged(fpath, entry[1])):
+            return True
+
+        return self.fallback.is_cached(fpath)
+
+    def process(self, items):
+        # файлы, неизвестные базам, передаются экстрактору fallback по мере
+        # перебора, одним потоком - иначе ExtractorPool не смог бы
+        # обрабатывать их параллельно, а ограничение скорости (см. pace)
+        # учитывало бы и файлы из баз; результаты для файлов из баз
+        # копятся в known и возвращаются между результатами fallback,
+        # а чтобы их не копилось много - fallback получает None
+        known = deque()
+
+        def unknown_items():
+            for item in items:
+                if item is None:
+                    yield None
+                    continue
+
+                fileId, fpath = item
+                entry = self.entries.get(fpath)
+
+                if entry is not None and (not self.checkMtime or self.__is_unchanged(fpath, entry[1],
+                        self.fileStat(fileId)[1] if self.fileStat is not None else 0)):
+                    self.nFromCatalog += 1
+                    known.append((fileId, entry[0], self.STATUS_OK, 0.0))
+
+                    if len(known) >= self.RESULTS_BATCH:
+                        yield None
+                else:
+                    self.nFallback += 1
+                    yield item
+
+        for r in self.fallback.process(unknown_items()):
+            while known:
+                yield known.popleft()
+
+            yield r
+
+        while known:
+            yield known.popleft()
+
+    def get_tuned_workers(self):
+        return self.fallback.get_tuned_workers()
+
+    def close(self):
+        self.fallback.close()
+
+
+def create_catalog_extractor(fallback, catalogFiles, checkMtime=True):
+    """Возвращает экземпляр CatalogExtractor, использующий базы
+    каталогизаторов из списка путей catalogFiles и экстрактор
+    fallback для прочих файлов.
+    Базы, которые не удалось загрузить, пропускаются (с сообщением в stderr)."""
+
+    catalogs = []
+
+    for fname in catalogFiles:
+        catalog = PhotoCatalog(fname)
+
+        e = catalog.load()
+        if e:
+            print(e, file=sys.stderr)
+        else:
+            catalogs.append(catalog)
+
+    return CatalogExtractor(fallback, catalogs, checkMtime)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    for fname in sys.argv[1:]:
+        catalog = PhotoCatalog(fname)
+        e = catalog.load()
+
+        print(e if e else catalog)
+
+        for path, (md, mtime) in list(catalog.entries.items())[:10]:
+            print(path, md, mtime)
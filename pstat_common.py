@@ -25,7 +25,7 @@ import sys
 
 
 APP_TITLE = 'Сбор статистки параметров фотографий'
-APP_VERSION = '1.4'
+APP_VERSION = '1.5'
 APP_COPYRIGHT = 'Copyright 2017-2021 MC-6312'
 APP_TITLE_VERSION = '%s v%s' % (APP_TITLE, APP_VERSION)
 APP_URL = 'http://github.com/mc6312/photostat'
@@ -38,6 +38,28 @@ def percents_str(v, total):
         return '%.1f%%' % (100.0 * v / total)
 
 
+def size_str(size):
+    if size < 1024:
+        return '%d Б' % size
+    elif size < 1024 * 1024:
+        return '%.1f КиБ' % (size / 1024)
+    elif size < 1024 * 1024 * 1024:
+        return '%.1f МиБ' % (size / (1024 * 1024))
+    else:
+        return '%.2f ГиБ' % (size / (1024 * 1024 * 1024))
+
+
+def duration_str(seconds):
+    if seconds < 1.0:
+        return '%.1f мс' % (seconds * 1000)
+    elif seconds < 60.0:
+        return '%.1f с' % seconds
+    elif seconds < 3600.0:
+        return '%d мин %d с' % divmod(int(seconds), 60)
+    else:
+        return '%d ч %d мин' % divmod(int(seconds) // 60, 60)
+
+
 def exception_to_str(ex):
     exs = str(ex)
     if not exs:
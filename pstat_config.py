@@ -46,6 +46,29 @@ class Configuration():
     CV_STAT_SAVE_FILE = 'stat_save_file'
     CV_SCAN_RAW_FILES = 'scan_raw_files'
     CV_SCAN_IMAGE_FILES = 'scan_image_files'
+    CV_SAMPLING_MODE = 'sampling_mode'
+    CV_REFRESH_ON_START = 'refresh_on_start'
+    CV_EXTRACT_WORKERS = 'extract_workers'
+    CV_EXTRACT_TIMEOUT = 'extract_timeout'
+    CV_WALK_THREADS = 'walk_threads'
+    CV_EXCLUDE_DIRS = 'exclude_dirs'
+    CV_CATALOGS = 'catalogs'
+    CV_CATALOG_CHECK_MTIME = 'catalog_check_mtime'
+    CV_METADATA_CACHE = 'metadata_cache'
+    CV_PAIR_RAW_JPEG = 'pair_raw_jpeg'
+    CV_FIND_DUPLICATES = 'find_duplicates'
+    CV_FOLLOW_SYMLINKS = 'follow_symlinks'
+    CV_MANIFEST_FILE = 'manifest_file'
+    CV_THROTTLE = 'throttle'
+    CV_THROTTLE_FILES_PER_SEC = 'throttle_files_per_sec'
+    CV_THROTTLE_MBYTES_PER_SEC = 'throttle_mbytes_per_sec'
+    CV_THROTTLE_LATENCY = 'throttle_latency'
+    CV_THROTTLE_NICE = 'throttle_nice'
+    CV_AUTOTUNE_WORKERS = 'autotune_workers'
+    CV_AUTOTUNE_MAX_WORKERS = 'autotune_max_workers'
+    CV_TUNED_WORKERS = 'tuned_workers'
+    CV_ESTIMATE_SAMPLE_SIZE = 'estimate_sample_size'
+    CV_ESTIMATE_DIR_FRACTION = 'estimate_dir_fraction'
     CV_RAW_FILE_EXTS = 'raw_file_extensions'
     CV_IMAGE_FILE_EXTENSIONS = 'image_file_extensions'
 
@@ -53,6 +76,25 @@ class Configuration():
     DEF_STAT_SAVE_DIR = os.path.expanduser('~/photo-statistics.txt')
     DEF_SCAN_RAW_FILES = True
     DEF_SCAN_IMAGE_FILES = False
+    DEF_SAMPLING_MODE = False
+    DEF_REFRESH_ON_START = False
+    DEF_EXTRACT_WORKERS = min(4, os.cpu_count() or 1)
+    DEF_EXTRACT_TIMEOUT = 30.0
+    DEF_WALK_THREADS = 8
+    DEF_EXCLUDE_DIRS = ('.thumbnails', '@eaDir', '.@__thumb')
+    DEF_CATALOG_CHECK_MTIME = True
+    DEF_PAIR_RAW_JPEG = True
+    DEF_FIND_DUPLICATES = False
+    DEF_FOLLOW_SYMLINKS = False
+    DEF_THROTTLE = False
+    DEF_THROTTLE_FILES_PER_SEC = 20.0
+    DEF_THROTTLE_MBYTES_PER_SEC = 20.0
+    DEF_THROTTLE_LATENCY = 0.5
+    DEF_THROTTLE_NICE = 10
+    DEF_AUTOTUNE_WORKERS = True
+    DEF_AUTOTUNE_MAX_WORKERS = max(16, 4 * (os.cpu_count() or 1))
+    DEF_ESTIMATE_SAMPLE_SIZE = 20
+    DEF_ESTIMATE_DIR_FRACTION = 1.0
 
     def __init__(self, fname):
         """Первоначальная инициализация настроек значениями по умолчанию.
@@ -67,21 +109,151 @@ class Configuration():
         self.cfgScanRAWFiles = self.DEF_SCAN_RAW_FILES
         self.cfgScanImageFiles = self.DEF_SCAN_IMAGE_FILES
 
+        # сбор приблизительной статистики по случайной выборке файлов
+        self.cfgSamplingMode = self.DEF_SAMPLING_MODE
+
+        # обновление статистики, восстановленной при запуске
+        # из снимка (см. pstat_snapshot), в фоновом режиме
+        self.cfgRefreshOnStart = self.DEF_REFRESH_ON_START
+
+        # количество рабочих процессов для извлечения метаданных
+        # (0 - извлекать в основном процессе) и максимальное время
+        # обработки одного файла (в секундах), см. pstat_extract
+        self.cfgExtractWorkers = self.DEF_EXTRACT_WORKERS
+        self.cfgExtractTimeout = self.DEF_EXTRACT_TIMEOUT
+
+        # количество потоков для поиска файлов (1 - без доп. потоков)
+        # и шаблоны имён каталогов, которые не следует просматривать
+        # (см. pstat_walk)
+        self.cfgWalkThreads = self.DEF_WALK_THREADS
+        self.cfgExcludeDirs = list(self.DEF_EXCLUDE_DIRS)
+
+        # обход каталогов, на которые указывают символические ссылки
+        # (с защитой от циклов, см. pstat_walk)
+        self.cfgFollowSymlinks = self.DEF_FOLLOW_SYMLINKS
+
+        # путь к файлу со списком файлов архива (см. pstat_manifest),
+        # используемому вместо просмотра каталогов; пустая строка -
+        # каталоги просматриваются
+        self.cfgManifestFile = ''
+
+        # пути к базам данных каталогизаторов (darktable, digiKam),
+        # из которых берутся метаданные известных им файлов, и проверка
+        # времени изменения файлов по данным из баз (см. pstat_catalog)
+        self.cfgCatalogs = []
+        self.cfgCatalogCheckMtime = self.DEF_CATALOG_CHECK_MTIME
+
+        # путь к каталогу общего кэша метаданных (см. pstat_mdcache);
+        # пустая строка - кэш не используется
+        self.cfgMetadataCache = ''
+
+        # при обработке и RAW, и прочих файлов: RAW-файлы, образующие
+        # пары RAW+JPEG, не обрабатывать (см. pstat_walk)
+        self.cfgPairRawJpeg = self.DEF_PAIR_RAW_JPEG
+
+        # поиск копий файлов перед обработкой метаданных - копии
+        # не обрабатываются и не учитываются (см. pstat_dedup)
+        self.cfgFindDuplicates = self.DEF_FIND_DUPLICATES
+
+        # ограничение скорости обработки файлов (см. pstat_throttle):
+        # файлов и мегабайт в секунду (0 - без ограничения), порог
+        # времени обработки файла в секундах, при превышении которого
+        # скорость снижается (0 - не снижать), и увеличение значения
+        # nice рабочих процессов
+        self.cfgThrottle = self.DEF_THROTTLE
+        self.cfgThrottleFilesPerSec = self.DEF_THROTTLE_FILES_PER_SEC
+        self.cfgThrottleMBytesPerSec = self.DEF_THROTTLE_MBYTES_PER_SEC
+        self.cfgThrottleLatency = self.DEF_THROTTLE_LATENCY
+        self.cfgThrottleNice = self.DEF_THROTTLE_NICE
+
+        # подбор количества рабочих процессов во время сбора статистики
+        # (см. pstat_autotune), максимальное количество и подобранные
+        # значения: ключи - пути к каталогам с фотографиями, значения -
+        # количество процессов (см. get_extract_workers())
+        self.cfgAutotuneWorkers = self.DEF_AUTOTUNE_WORKERS
+        self.cfgAutotuneMaxWorkers = self.DEF_AUTOTUNE_MAX_WORKERS
+        self.cfgTunedWorkers = {}
+
+        # оценка сбора статистики (см. pstat_estimate): размер выборки
+        # (файлов на расширение) и доля просматриваемых подкаталогов
+        self.cfgEstimateSampleSize = self.DEF_ESTIMATE_SAMPLE_SIZE
+        self.cfgEstimateDirFraction = self.DEF_ESTIMATE_DIR_FRACTION
+
         self.cfgRAWFileExtensions = RAW_FILE_EXTS
         self.cfgImageFileExtensions = IMAGE_FILE_EXTS
 
+        #
+        # параметры командной строки (в файле настроек не сохраняются)
+        #
+
+        # профилирование сбора статистики (см. pstat_profile)
+        self.cfgProfileScan = False
+
+        # профилирование расхода памяти при сборе статистики (см. pstat_memprof)
+        self.cfgMemProfile = False
+
+        # None или путь к периодически перезаписываемому файлу
+        # с метриками сбора статистики (см. pstat_metrics)
+        self.cfgMetricsFile = None
+
     def __str__(self):
         return '''self.cfgFN = '%s'
 self.cfgPhotoRootDir = '%s'
 self.cfgStatSaveFile = '%s'
 self.cfgScanRAWFiles = %s
 self.cfgScanImageFiles = %s
+self.cfgSamplingMode = %s
+self.cfgRefreshOnStart = %s
+self.cfgExtractWorkers = %d
+self.cfgExtractTimeout = %g
+self.cfgWalkThreads = %d
+self.cfgExcludeDirs = %s
+self.cfgFollowSymlinks = %s
+self.cfgManifestFile = '%s'
+self.cfgCatalogs = %s
+self.cfgCatalogCheckMtime = %s
+self.cfgMetadataCache = '%s'
+self.cfgPairRawJpeg = %s
+self.cfgFindDuplicates = %s
+self.cfgThrottle = %s
+self.cfgThrottleFilesPerSec = %g
+self.cfgThrottleMBytesPerSec = %g
+self.cfgThrottleLatency = %g
+self.cfgThrottleNice = %d
+self.cfgAutotuneWorkers = %s
+self.cfgAutotuneMaxWorkers = %d
+self.cfgTunedWorkers = %s
+self.cfgEstimateSampleSize = %d
+self.cfgEstimateDirFraction = %g
 self.cfgRAWFileExtensions = %s
 self.cfgImageFileExtensions = %s''' % (self.cfgFN,
             self.cfgPhotoRootDir,
             self.cfgStatSaveFile,
             self.cfgScanRAWFiles,
             self.cfgScanImageFiles,
+            self.cfgSamplingMode,
+            self.cfgRefreshOnStart,
+            self.cfgExtractWorkers,
+            self.cfgExtractTimeout,
+            self.cfgWalkThreads,
+            self.cfgExcludeDirs,
+            self.cfgFollowSymlinks,
+            self.cfgManifestFile,
+            self.cfgCatalogs,
+            self.cfgCatalogCheckMtime,
+            self.cfgMetadataCache,
+            self.cfgPairRawJpeg,
+            self.cfgFindDuplicates,
+            self.cfgThrottle,
+            self.cfgThrottleFilesPerSec,
+            self.cfgThrottleMBytesPerSec,
+            self.cfgThrottleLatency,
+            self.cfgThrottleNice,
+            self.cfgAutotuneWorkers,
+            self.cfgAutotuneMaxWorkers,
+            self.cfgTunedWorkers,
+            self.cfgEstimateSampleSize,
+            self.cfgEstimateDirFraction,
             self.cfgRAWFileExtensions,
             self.cfgImageFileExtensions)
 
@@ -107,6 +279,57 @@ self.cfgImageFileExtensions = %s''' % (self.cfgFN,
 
         self.cfgScanRAWFiles = cfg.getboolean(self.CS_SETTINGS, self.CV_SCAN_RAW_FILES, fallback=self.DEF_SCAN_RAW_FILES)
         self.cfgScanImageFiles = cfg.getboolean(self.CS_SETTINGS, self.CV_SCAN_IMAGE_FILES, fallback=self.DEF_SCAN_IMAGE_FILES)
+        self.cfgSamplingMode = cfg.getboolean(self.CS_SETTINGS, self.CV_SAMPLING_MODE, fallback=self.DEF_SAMPLING_MODE)
+        self.cfgRefreshOnStart = cfg.getboolean(self.CS_SETTINGS, self.CV_REFRESH_ON_START, fallback=self.DEF_REFRESH_ON_START)
+
+        self.cfgExtractWorkers = max(0, cfg.getint(self.CS_SETTINGS, self.CV_EXTRACT_WORKERS, fallback=self.DEF_EXTRACT_WORKERS))
+        self.cfgExtractTimeout = cfg.getfloat(self.CS_SETTINGS, self.CV_EXTRACT_TIMEOUT, fallback=self.DEF_EXTRACT_TIMEOUT)
+        if self.cfgExtractTimeout <= 0:
+            self.cfgExtractTimeout = self.DEF_EXTRACT_TIMEOUT
+
+        self.cfgWalkThreads = max(1, cfg.getint(self.CS_SETTINGS, self.CV_WALK_THREADS, fallback=self.DEF_WALK_THREADS))
+
+        # шаблоны - через пробел, регистр символов не меняем
+        sv = cfg.get(self.CS_SETTINGS, self.CV_EXCLUDE_DIRS, fallback=None)
+        self.cfgExcludeDirs = sv.split(None) if isinstance(sv, str) else list(self.DEF_EXCLUDE_DIRS)
+
+        self.cfgFollowSymlinks = cfg.getboolean(self.CS_SETTINGS, self.CV_FOLLOW_SYMLINKS, fallback=self.DEF_FOLLOW_SYMLINKS)
+
+        sv = cfg.get(self.CS_SETTINGS, self.CV_MANIFEST_FILE, fallback='').strip()
+        self.cfgManifestFile = os.path.abspath(os.path.expanduser(sv)) if sv else ''
+
+        # пути - через os.pathsep, как в $PATH
+        sv = cfg.get(self.CS_SETTINGS, self.CV_CATALOGS, fallback='')
+        self.cfgCatalogs = [os.path.abspath(os.path.expanduser(s)) for s in sv.split(os.pathsep) if s.strip()]
+
+        self.cfgCatalogCheckMtime = cfg.getboolean(self.CS_SETTINGS, self.CV_CATALOG_CHECK_MTIME, fallback=self.DEF_CATALOG_CHECK_MTIME)
+
+        sv = cfg.get(self.CS_SETTINGS, self.CV_METADATA_CACHE, fallback='').strip()
+        self.cfgMetadataCache = os.path.abspath(os.path.expanduser(sv)) if sv else ''
+
+        self.cfgPairRawJpeg = cfg.getboolean(self.CS_SETTINGS, self.CV_PAIR_RAW_JPEG, fallback=self.DEF_PAIR_RAW_JPEG)
+        self.cfgFindDuplicates = cfg.getboolean(self.CS_SETTINGS, self.CV_FIND_DUPLICATES, fallback=self.DEF_FIND_DUPLICATES)
+
+        self.cfgThrottle = cfg.getboolean(self.CS_SETTINGS, self.CV_THROTTLE, fallback=self.DEF_THROTTLE)
+        self.cfgThrottleFilesPerSec = max(0.0, cfg.getfloat(self.CS_SETTINGS, self.CV_THROTTLE_FILES_PER_SEC, fallback=self.DEF_THROTTLE_FILES_PER_SEC))
+        self.cfgThrottleMBytesPerSec = max(0.0, cfg.getfloat(self.CS_SETTINGS, self.CV_THROTTLE_MBYTES_PER_SEC, fallback=self.DEF_THROTTLE_MBYTES_PER_SEC))
+        self.cfgThrottleLatency = max(0.0, cfg.getfloat(self.CS_SETTINGS, self.CV_THROTTLE_LATENCY, fallback=self.DEF_THROTTLE_LATENCY))
+        self.cfgThrottleNice = max(0, cfg.getint(self.CS_SETTINGS, self.CV_THROTTLE_NICE, fallback=self.DEF_THROTTLE_NICE))
+
+        self.cfgAutotuneWorkers = cfg.getboolean(self.CS_SETTINGS, self.CV_AUTOTUNE_WORKERS, fallback=self.DEF_AUTOTUNE_WORKERS)
+        self.cfgAutotuneMaxWorkers = max(1, cfg.getint(self.CS_SETTINGS, self.CV_AUTOTUNE_MAX_WORKERS, fallback=self.DEF_AUTOTUNE_MAX_WORKERS))
+
+        # пары "путь=количество" через os.pathsep
+        self.cfgTunedWorkers.clear()
+
+        for s in cfg.get(self.CS_SETTINGS, self.CV_TUNED_WORKERS, fallback='').split(os.pathsep):
+            path, sep, sn = s.rpartition('=')
+
+            if path and sn.isdigit() and int(sn) > 0:
+                self.cfgTunedWorkers[path] = int(sn)
+
+        self.cfgEstimateSampleSize = max(1, cfg.getint(self.CS_SETTINGS, self.CV_ESTIMATE_SAMPLE_SIZE, fallback=self.DEF_ESTIMATE_SAMPLE_SIZE))
+        self.cfgEstimateDirFraction = min(max(cfg.getfloat(self.CS_SETTINGS, self.CV_ESTIMATE_DIR_FRACTION, fallback=self.DEF_ESTIMATE_DIR_FRACTION), 0.001), 1.0)
 
         def get_set_of_str(section, option, defval):
             sv = cfg.get(section, option, fallback=None)
@@ -140,6 +363,30 @@ self.cfgImageFileExtensions = %s''' % (self.cfgFN,
 
         cfg.set(self.CS_SETTINGS, self.CV_SCAN_RAW_FILES, str(self.cfgScanRAWFiles))
         cfg.set(self.CS_SETTINGS, self.CV_SCAN_IMAGE_FILES, str(self.cfgScanImageFiles))
+        cfg.set(self.CS_SETTINGS, self.CV_SAMPLING_MODE, str(self.cfgSamplingMode))
+        cfg.set(self.CS_SETTINGS, self.CV_REFRESH_ON_START, str(self.cfgRefreshOnStart))
+        cfg.set(self.CS_SETTINGS, self.CV_EXTRACT_WORKERS, str(self.cfgExtractWorkers))
+        cfg.set(self.CS_SETTINGS, self.CV_EXTRACT_TIMEOUT, str(self.cfgExtractTimeout))
+        cfg.set(self.CS_SETTINGS, self.CV_WALK_THREADS, str(self.cfgWalkThreads))
+        cfg.set(self.CS_SETTINGS, self.CV_EXCLUDE_DIRS, ' '.join(self.cfgExcludeDirs))
+        cfg.set(self.CS_SETTINGS, self.CV_FOLLOW_SYMLINKS, str(self.cfgFollowSymlinks))
+        cfg.set(self.CS_SETTINGS, self.CV_MANIFEST_FILE, self.cfgManifestFile)
+        cfg.set(self.CS_SETTINGS, self.CV_CATALOGS, os.pathsep.join(self.cfgCatalogs))
+        cfg.set(self.CS_SETTINGS, self.CV_CATALOG_CHECK_MTIME, str(self.cfgCatalogCheckMtime))
+        cfg.set(self.CS_SETTINGS, self.CV_METADATA_CACHE, self.cfgMetadataCache)
+        cfg.set(self.CS_SETTINGS, self.CV_PAIR_RAW_JPEG, str(self.cfgPairRawJpeg))
+        cfg.set(self.CS_SETTINGS, self.CV_FIND_DUPLICATES, str(self.cfgFindDuplicates))
+        cfg.set(self.CS_SETTINGS, self.CV_THROTTLE, str(self.cfgThrottle))
+        cfg.set(self.CS_SETTINGS, self.CV_THROTTLE_FILES_PER_SEC, str(self.cfgThrottleFilesPerSec))
+        cfg.set(self.CS_SETTINGS, self.CV_THROTTLE_MBYTES_PER_SEC, str(self.cfgThrottleMBytesPerSec))
+        cfg.set(self.CS_SETTINGS, self.CV_THROTTLE_LATENCY, str(self.cfgThrottleLatency))
+        cfg.set(self.CS_SETTINGS, self.CV_THROTTLE_NICE, str(self.cfgThrottleNice))
+        cfg.set(self.CS_SETTINGS, self.CV_AUTOTUNE_WORKERS, str(self.cfgAutotuneWorkers))
+        cfg.set(self.CS_SETTINGS, self.CV_AUTOTUNE_MAX_WORKERS, str(self.cfgAutotuneMaxWorkers))
+        cfg.set(self.CS_SETTINGS, self.CV_TUNED_WORKERS,
+            os.pathsep.join('%s=%d' % pn for pn in sorted(self.cfgTunedWorkers.items())))
+        cfg.set(self.CS_SETTINGS, self.CV_ESTIMATE_SAMPLE_SIZE, str(self.cfgEstimateSampleSize))
+        cfg.set(self.CS_SETTINGS, self.CV_ESTIMATE_DIR_FRACTION, str(self.cfgEstimateDirFraction))
 
         def set_set_of_str(section, option, v):
             cfg.set(section, option, ' '.join(sorted(v)))
@@ -153,6 +400,43 @@ self.cfgImageFileExtensions = %s''' % (self.cfgFN,
         except Exception as ex:
                 return 'Не удалось сохранить файл настроек "%s" - %s' % (cfgFN, exception_to_str(ex))
 
+    def get_extract_workers(self):
+        """Возвращает количество рабочих процессов извлечения метаданных
+        для каталога cfgPhotoRootDir: подобранное ранее (если подбор
+        включен) или заданное в cfgExtractWorkers."""
+
+        if self.cfgAutotuneWorkers and self.cfgExtractWorkers > 0:
+            return self.cfgTunedWorkers.get(self.cfgPhotoRootDir, self.cfgExtractWorkers)
+
+        return self.cfgExtractWorkers
+
+    def set_tuned_workers(self, nworkers):
+        """Запоминает подобранное количество рабочих процессов nworkers
+        (None - не подобрано) для каталога cfgPhotoRootDir.
+        Возвращает True, если значение изменилось (т.е. настройки
+        следует сохранить)."""
+
+        if not nworkers or self.cfgTunedWorkers.get(self.cfgPhotoRootDir) == nworkers:
+            return False
+
+        self.cfgTunedWorkers[self.cfgPhotoRootDir] = nworkers
+
+        return True
+
+    def get_scan_file_types(self):
+        """Возвращает множество расширений файлов, подлежащих обработке,
+        в соответствии с настройками."""
+
+        ftypes = set()
+
+        if self.cfgScanRAWFiles:
+            ftypes.update(self.cfgRAWFileExtensions)
+
+        if self.cfgScanImageFiles:
+            ftypes.update(self.cfgImageFileExtensions)
+
+        return ftypes
+
     def check_fields(self):
         """Проверка правильности заполнения полей.
         Возвращает булевское значение."""
@@ -184,6 +468,28 @@ def get_config_file_name():
     return os.path.join(cfgDir, CFGSUBDIR, 'settings.cfg')
 
 
+def get_quarantine_file_name():
+    """Возвращает полный путь к файлу со списком файлов,
+    помещённых в карантин (см. pstat_extract.Quarantine)."""
+
+    return os.path.join(os.path.split(get_config_file_name())[0], 'quarantine.txt')
+
+
+def get_snapshot_file_name():
+    """Возвращает полный путь к файлу с сохранённой статистикой
+    (см. pstat_snapshot)."""
+
+    return os.path.join(os.path.split(get_config_file_name())[0], 'snapshot.bin')
+
+
+def get_cache_directory():
+    """Возвращает полный путь к каталогу для данных, которые
+    программа может при необходимости пересоздать (растеризованные
+    иконки, см. gtktools.FileResourceLoader.load_pixbuf())."""
+
+    return os.path.join(os.path.split(get_config_file_name())[0], 'cache')
+
+
 def get_resource_directory():
     """Возвращает полный путь к каталогу неизменяемых данных программы."""
 
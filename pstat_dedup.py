@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_dedup.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Поиск копий одних и тех же файлов (напр. в нескольких каталогах
+# с резервными копиями съёмок) до извлечения метаданных - чтобы каждый
+# снимок учитывался в статистике и обрабатывался один раз.
+#
+# Сравнение идёт от дешёвого к дорогому:
+# 1. размер файла - уже известен после поиска файлов (см. PathTable),
+#    файлы с уникальным размером дальше не рассматриваются;
+# 2. хэш начального и конечного блоков файла - два коротких чтения;
+# 3. хэш всего содержимого - только для файлов, у которых совпали
+#    и размер, и хэши блоков.
+
+
+from hashlib import blake2b
+
+from pstat_common import *
+
+
+# размер начального и конечного блоков для быстрого сравнения
+BLOCK_SIZE = 64 * 1024
+
+# размер куска при чтении всего файла
+CHUNK_SIZE = 1024 * 1024
+
+HASH_DIGEST_SIZE = 16
+
+
+class DuplicateFinder():
+    """Поиск файлов с одинаковым содержимым среди файлов
+    из экземпляра pstat_paths.PathTable.
+
+    Из каждой группы одинаковых файлов "оригиналом" считается файл
+    с наименьшим полным путём (т.е. результат не зависит от порядка
+    обхода каталогов), прочие - копиями.
+
+    Файлы, которые не удалось прочитать, копиями не считаются."""
+
+    def __init__(self, blockSize=BLOCK_SIZE):
+        """blockSize - размер начального и конечного блоков файла
+        для быстрого сравнения."""
+
+        self.blockSize = blockSize
+
+        self.clear()
+
+    def clear(self):
+        # группы одинаковых файлов - списки номеров файлов;
+        # первый элемент каждого списка - оригинал
+        self.groups = []
+
+        # количество копий и их суммарный размер
+        self.nDuplicates = 0
+        self.duplicateBytes = 0
+
+        # количество файлов, у которых читались начальный и конечный
+        # блоки, и количество файлов, прочитанных целиком
+        self.nBlockHashed = 0
+        self.nFullHashed = 0
+
+        # количество прочитанных байт
+        self.bytesRead = 0
+
+    def __hash_blocks(self, fpath, size):
+        h = blake2b(digest_size=HASH_DIGEST_SIZE)
+
+        with open(fpath, 'rb') as f:
+            buf = f.read(self.blockSize)
+            h.update(buf)
+            self.bytesRead += len(buf)
+
+            if size > self.blockSize:
+                f.seek(max(size - self.blockSize, self.blockSize))
+                buf = f.read(self.blockSize)
+                h.update(buf)
+                self.bytesRead += len(buf)
+
+        self.nBlockHashed += 1
+
+        return h.digest()
+
+    def __hash_file(self, fpath):
+        h = blake2b(digest_size=HASH_DIGEST_SIZE)
+
+        with open(fpath, 'rb') as f:
+            while True:
+                buf = f.read(CHUNK_SIZE)
+                if not buf:
+                    break
+
+                h.update(buf)
+                self.bytesRead += len(buf)
+
+        self.nFullHashed += 1
+
+        return h.digest()
+
+    def __group_by(self, files, fileIds, hashfunc):
+        # возвращает список групп (списков номеров файлов) с одинаковыми
+        # значениями hashfunc(путь, размер) из двух и более файлов
+        groups = {}
+
+        for fileId in fileIds:
+            try:
+                key = hashfunc(files.get_path(fileId), files.get_size(fileId))
+            except OSError:
+                continue
+
+            groups.setdefault(key, []).append(fileId)
+
+        return [group for group in groups.values() if len(group) > 1]
+
+    def find(self, files, progress=None):
+        """Поиск одинаковых файлов.
+
+        files       - экземпляр pstat_paths.PathTable;
+        progress    - None или функция, получающая два параметра -
+                      количество уже проверенных файлов и общее количество
+                      файлов, требующих чтения; должна возвращать True
+                      для продолжения и False для прерывания поиска.
+
+        Возвращает множество номеров файлов-копий (без оригиналов)
+        или None, если поиск прерван. Подробности - в self.groups
+        и счётчиках (см. get_report())."""
+
+        self.clear()
+
+        if not callable(progress):
+            progress = lambda ndone, ntotal: True
+
+        # размер файла, не известный при поиске файлов, равен 0 -
+        # такие файлы не сравниваем
+        bySize = {}
+
+        for fileId in range(len(files)):
+            size = files.get_size(fileId)
+            if size > 0:
+                bySize.setdefault(size, []).append(fileId)
+
+        candidates = [group for group in bySize.values() if len(group) > 1]
+
+        ntotal = sum(map(len, candidates))
+        ndone = 0
+
+        for sizeGroup in candidates:
+            for blockGroup in self.__group_by(files, sizeGroup, self.__hash_blocks):
+                size = files.get_size(blockGroup[0])
+
+                if size <= self.blockSize * 2:
+                    # файл уже прочитан целиком
+                    fullGroups = [blockGroup]
+                else:
+                    fullGroups = self.__group_by(files, blockGroup, lambda fpath, size: self.__hash_file(fpath))
+
+                for group in fullGroups:
+                    group.sort(key=files.get_path)
+
+                    self.groups.append(group)
+                    self.nDuplicates += len(group) - 1
+                    self.duplicateBytes += size * (len(group) - 1)
+
+            ndone += len(sizeGroup)
+            if not progress(ndone, ntotal):
+                return None
+
+        return {fileId for group in self.groups for fileId in group[1:]}
+
+    def get_summary_str(self):
+        """Возвращает строку с кратким итогом поиска."""
+
+        return 'найдено копий: %d (%s) в %d группах; прочитано %s (начало и конец %d файлов, целиком - %d файлов)' % (self.nDuplicates,
+            size_str(self.duplicateBytes),
+            len(self.groups),
+            size_str(self.bytesRead),
+            self.nBlockHashed,
+            self.nFullHashed)
+
+    def get_report(self, files):
+        """Возвращает отчёт о найденных копиях в виде строки.
+        files - экземпляр PathTable, переданный find()."""
+
+        ret = ['Поиск копий файлов: %s' % self.get_summary_str()]
+
+        # сначала - группы, занимающие больше всего места
+        for group in sorted(self.groups, key=lambda g: files.get_size(g[0]) * (len(g) - 1), reverse=True):
+            ret += ['', '%s (%s)' % (files.get_path(group[0]), size_str(files.get_size(group[0])))]
+            ret += ['  = %s' % files.get_path(fileId) for fileId in group[1:]]
+
+        return '\n'.join(ret)
+
+
+def create_duplicate_finder(config):
+    """Создаёт экземпляр DuplicateFinder, если поиск копий включен
+    в настройках config (экземпляр pstat_config.Configuration),
+    иначе возвращает None."""
+
+    return DuplicateFinder() if config.cfgFindDuplicates else None
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    import sys
+    from pstat_walk import DirWalker
+    from pstat_paths import PathTable
+
+    files = PathTable()
+
+    for dirpath, nfiles, fnames, npaired, nlinked in DirWalker(4).walk(sys.argv[1] if len(sys.argv) > 1 else '.', {'.jpg', '.nef', '.py'}):
+        dirId = files.add_dir(dirpath)
+
+        for fname, fsize, fmtime in fnames:
+            files.add_file(dirId, fname, fsize, fmtime)
+
+    finder = DuplicateFinder()
+    finder.find(files)
+
+    print(finder.get_report(files))
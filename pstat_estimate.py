@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_estimate.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Оценка продолжительности и "стоимости" сбора статистики без самого
+# сбора - чтобы до запуска на многотерабайтном архиве знать, займёт
+# он минуты или часы.
+#
+# 1. Каталоги просматриваются так же, как при сборе (тем же DirWalker,
+#    т.е. с теми же исключениями, парами RAW+JPEG и ссылками, или список
+#    файлов берётся из манифеста); при dirFraction < 1 ниже первых уровней
+#    просматривается только случайная часть подкаталогов каждого каталога,
+#    а найденные в них файлы учитываются с соответствующим весом (оценка
+#    Горвица-Томпсона).
+# 2. Из найденных файлов для каждого расширения отбирается случайная
+#    выборка, и её метаданные извлекаются тем же экстрактором, что и при
+#    сборе. Файлы, метаданные которых будут взяты без чтения файла (напр.
+#    из баз каталогизаторов - см. MetadataExtractor.is_cached()),
+#    учитываются отдельно.
+# 3. По этим данным оцениваются время сбора, объём файлов и расход
+#    памяти (см. get_report()).
+
+
+import os, os.path
+import sys
+import random
+from time import perf_counter
+
+from pstat_common import *
+from pstat_memprof import get_rss
+from pstat_walk import DirWalker
+
+
+# размер выборки для замера времени обработки - файлов на расширение
+SAMPLE_PER_EXT = 20
+
+# количество верхних уровней дерева каталогов, просматриваемых
+# целиком и при dirFraction < 1 - от них зависит разнообразие выборки
+FULL_DEPTH = 2
+
+# расход памяти на каждый найденный файл (кроме имени) и каталог (кроме
+# пути) в байтах - таблица путей, метаданные по столбцам, индексы,
+# порядок обработки при сборе по выборке; статистика по каталогу
+# и узел дерева каталогов (замерено tracemalloc на синтетических наборах)
+MEMORY_PER_FILE = 250
+MEMORY_PER_DIR = 16 * 1024
+
+# время учёта результата обработки файла в статистике (в основном
+# процессе) в секундах - замерено на синтетических наборах
+AGGREGATE_SECONDS_PER_FILE = 60e-6
+
+
+class ExtEstimate():
+    """Данные оценки для файлов с одним расширением."""
+
+    def __init__(self):
+        # оценки количества файлов и их суммарного размера
+        # (с учётом веса непросмотренных каталогов)
+        self.nFiles = 0.0
+        self.nBytes = 0.0
+
+        # количество найденных файлов и выборка из них - список
+        # кортежей (путь, размер)
+        self.nSeen = 0
+        self.sample = []
+
+        # результаты обработки выборки: количество файлов, метаданные
+        # которых берутся без чтения файла, количество обработанных
+        # файлов, из них - неудачно, и суммарное время обработки
+        self.nCached = 0
+        self.nTimed = 0
+        self.nFailed = 0
+        self.seconds = 0.0
+
+    def add_file(self, fpath, size, weight, sampleSize, rng):
+        self.nFiles += weight
+        self.nBytes += size * weight
+        self.nSeen += 1
+
+        # "резервуарная" выборка - без хранения всех путей
+        if len(self.sample) < sampleSize:
+            self.sample.append((fpath, size))
+        else:
+            ix = rng.randrange(self.nSeen)
+            if ix < sampleSize:
+                self.sample[ix] = (fpath, size)
+
+    def get_cached_fraction(self):
+        nsampled = self.nCached + self.nTimed
+
+        return self.nCached / nsampled if nsampled else 0.0
+
+    def get_seconds_per_file(self):
+        """Возвращает среднее время обработки файла, метаданные которого
+        берутся из самого файла, в секундах."""
+
+        return self.seconds / self.nTimed if self.nTimed else 0.0
+
+
+class ScanEstimator():
+    """Оценка продолжительности и расхода ресурсов сбора статистики."""
+
+    def __init__(self, sampleSize=SAMPLE_PER_EXT, dirFraction=1.0, nworkers=1, seed=None):
+        """sampleSize   - размер выборки для замера времени обработки
+                          (файлов на расширение);
+        dirFraction     - доля просматриваемых подкаталогов (0..1]
+                          ниже FULL_DEPTH уровней;
+        nworkers        - количество одновременно обрабатываемых файлов
+                          при сборе статистики (см. pstat_extract.ExtractorPool);
+        seed            - None или начальное значение генератора
+                          случайных чисел (для воспроизводимости)."""
+
+        self.sampleSize = max(1, sampleSize)
+        self.dirFraction = min(max(dirFraction, 0.001), 1.0)
+        self.nworkers = max(1, nworkers)
+        self.rng = random.Random(seed)
+
+        self.clear()
+
+    def clear(self):
+        self.photodir = None
+
+        # количество просмотренных каталогов и оценка общего количества
+        self.nDirsVisited = 0
+        self.nDirs = 0.0
+
+        # оценки общего количества файлов, а также файлов, не отобранных
+        # как часть пар RAW+JPEG и как ссылки
+        self.nTotalFiles = 0.0
+        self.nPairedFiles = 0.0
+        self.nLinkedFiles = 0.0
+
+        # оценки суммарной длины имён файлов и путей каталогов
+        # (для оценки расхода памяти)
+        self.nameBytes = 0.0
+        self.dirPathBytes = 0.0
+
+        # ключи - расширения, значения - экземпляры ExtEstimate
+        self.exts = {}
+
+        # время просмотра каталогов и обработки выборки в секундах
+        self.walkSeconds = 0.0
+        self.sampleSeconds = 0.0
+
+        # среднее время между получением результатов обработки выборки
+        # в секундах (0 - результатов меньше двух), т.е. с учётом
+        # одновременной обработки и передачи данных между процессами
+        self.resultInterval = 0.0
+
+    def __walk_all(self, top, ftypes, walker):
+        # без выборки каталогов - обычным обходом (в т.ч. многопоточным);
+        # вес каталогов - 1, подкаталогов для просмотра нет
+        for dirpath, nfiles, files, npaired, nlinked in walker.walk(top, ftypes):
+            yield (dirpath, 0, 1.0, ([], nfiles, files, npaired, nlinked))
+
+    def __walk_sampled(self, top, ftypes, walker, stack):
+        walker.reset(top)
+
+        while stack:
+            dirpath, depth, weight = stack.pop()
+
+            yield (dirpath, depth, weight, walker.list_dir(dirpath, top, ftypes))
+
+    def __walk(self, top, ftypes, walker, progress):
+        # кортежи (путь, уровень, вес): вес - величина, обратная
+        # вероятности попадания каталога в просмотр
+        stack = [(top, 0, 1.0)]
+
+        if self.dirFraction < 1.0 and isinstance(walker, DirWalker):
+            dirs = self.__walk_sampled(top, ftypes, walker, stack)
+        else:
+            dirs = self.__walk_all(top, ftypes, walker)
+
+        # каталог может возвращаться несколько раз (см. pstat_manifest)
+        visited = set()
+
+        for dirpath, depth, weight, (subdirs, nfiles, files, npaired, nlinked) in dirs:
+            if dirpath not in visited:
+                visited.add(dirpath)
+
+                self.nDirsVisited += 1
+                self.nDirs += weight
+                self.dirPathBytes += len(dirpath) * weight
+
+            self.nTotalFiles += nfiles * weight
+            self.nPairedFiles += npaired * weight
+            self.nLinkedFiles += nlinked * weight
+
+            for fname, fsize, fmtime in files:
+                fext = os.path.splitext(fname)[1].lower()
+
+                es = self.exts.get(fext)
+                if es is None:
+                    es = ExtEstimate()
+                    self.exts[fext] = es
+
+                es.add_file(os.path.join(dirpath, fname), fsize, weight, self.sampleSize, self.rng)
+                self.nameBytes += len(fname) * weight
+
+            if subdirs and depth >= FULL_DEPTH and self.dirFraction < 1.0:
+                nsub = len(subdirs)
+                nvisit = max(1, int(round(nsub * self.dirFraction)))
+
+                if nvisit < nsub:
+                    subdirs = self.rng.sample(subdirs, nvisit)
+                    weight *= nsub / nvisit
+
+            stack.extend((subdir, depth + 1, weight) for subdir in subdirs)
+
+            if not progress(-1, 'Просмотрено каталогов: %d, найдено файлов: %d' % (self.nDirsVisited,
+                    sum(es.nSeen for es in self.exts.values()))):
+                return False
+
+        return True
+
+    def __time_sample(self, extractor, progress):
+        # items - только файлы, которые при сборе будут прочитаны
+        items = []
+        itemExts = []
+
+        for fext, es in self.exts.items():
+            for fpath, fsize in es.sample:
+                if extractor.is_cached(fpath):
+                    es.nCached += 1
+                else:
+                    items.append((len(items), fpath))
+                    itemExts.append(es)
+
+        ndone = 0
+        ntotal = max(1, len(items))
+        tFirst = None
+
+        for r in extractor.process(items):
+            if r is not None:
+                ix, md, status, seconds = r
+
+                # первый результат - после запуска рабочих процессов,
+                # потому интервалы отсчитываем от него
+                if tFirst is None:
+                    tFirst = perf_counter()
+                elif ndone == len(items) - 1:
+                    self.resultInterval = (perf_counter() - tFirst) / ndone
+
+                es = itemExts[ix]
+                es.nTimed += 1
+                es.seconds += seconds
+
+                if md is None:
+                    es.nFailed += 1
+
+                ndone += 1
+
+            if not progress(ndone / ntotal, 'Обработано файлов выборки: %d из %d' % (ndone, len(items))):
+                return False
+
+        return True
+
+    def estimate(self, photodir, ftypes, extractor, walker, progress=None):
+        """Оценка сбора статистики.
+
+        photodir    - путь к каталогу с фотографиями;
+        ftypes      - множество расширений обрабатываемых файлов;
+        extractor   - экземпляр pstat_extract.MetadataExtractor (или потомка),
+                      закрывается вызывающей стороной;
+        walker      - экземпляр pstat_walk.DirWalker;
+        progress    - None или функция, получающая два параметра: значение
+                      прогресса (< 0 - неизвестно) и строку с сообщением;
+                      должна возвращать True для продолжения и False
+                      для прерывания оценки.
+
+        Возвращает True, если оценка закончена, и False, если прервана.
+        Результаты - в полях экземпляра (см. get_report())."""
+
+        self.clear()
+        self.photodir = os.path.normpath(photodir)
+
+        if not callable(progress):
+            progress = lambda fraction, msg: True
+
+        t0 = perf_counter()
+        ok = self.__walk(self.photodir, ftypes, walker, progress)
+        self.walkSeconds = perf_counter() - t0
+
+        if not ok:
+            return False
+
+        t0 = perf_counter()
+        ok = self.__time_sample(extractor, progress)
+        self.sampleSeconds = perf_counter() - t0
+
+        return ok
+
+    def get_found_files(self):
+        """Возвращает оценку количества файлов, которые будут обработаны."""
+
+        return sum(es.nFiles for es in self.exts.values())
+
+    def get_read_bytes(self):
+        """Возвращает оценку суммарного размера файлов, которые будут
+        прочитаны (без файлов, метаданные которых берутся без чтения);
+        это верхняя граница - из большинства файлов читается только
+        начало с метаданными."""
+
+        return sum(es.nBytes * (1.0 - es.get_cached_fraction()) for es in self.exts.values())
+
+    def get_walk_seconds(self):
+        """Возвращает оценку времени поиска файлов в секундах
+        (при выборке каталогов - для однопоточного просмотра)."""
+
+        if not self.nDirsVisited:
+            return 0.0
+
+        return self.walkSeconds * self.nDirs / self.nDirsVisited
+
+    def get_extract_seconds(self):
+        """Возвращает оценку времени обработки метаданных в секундах.
+
+        Время обработки файла рабочим процессом занижает общее время
+        (не учитывается передача данных между процессами), поэтому
+        соотношение времени для разных расширений берётся из него,
+        а масштаб - из интервала между результатами (resultInterval)."""
+
+        ntimed = sum(es.nTimed for es in self.exts.values())
+        seconds = sum(es.seconds for es in self.exts.values())
+
+        if ntimed and seconds > 0.0 and self.resultInterval > 0.0:
+            scale = self.resultInterval / (seconds / ntimed)
+        else:
+            scale = 1.0 / self.nworkers
+
+        return sum(es.nFiles * (1.0 - es.get_cached_fraction()) * es.get_seconds_per_file()
+            for es in self.exts.values()) * scale + self.get_found_files() * AGGREGATE_SECONDS_PER_FILE
+
+    def get_peak_memory(self):
+        """Возвращает оценку наибольшего расхода памяти основным процессом
+        (без рабочих процессов ExtractorPool) в байтах."""
+
+        base = get_rss() or 0
+
+        return int(base + self.get_found_files() * MEMORY_PER_FILE + self.nameBytes
+            + self.nDirs * MEMORY_PER_DIR + self.dirPathBytes)
+
+    def get_report(self):
+        """Возвращает отчёт об оценке в виде строки."""
+
+        walkSeconds = self.get_walk_seconds()
+        extractSeconds = self.get_extract_seconds()
+
+        ret = ['Оценка сбора статистики по каталогу "%s"%s' % (self.photodir,
+                ' (просмотрено %s каталогов)' % percents_str(self.nDirsVisited, self.nDirs) if self.dirFraction < 1.0 else ''),
+            'Каталогов: ~%.0f, файлов: ~%.0f, будет обработано: ~%.0f (%s)' % (self.nDirs,
+                self.nTotalFiles, self.get_found_files(), size_str(sum(es.nBytes for es in self.exts.values())))]
+
+        if self.nPairedFiles or self.nLinkedFiles:
+            ret.append('Не обрабатываются: RAW из пар RAW+JPEG - ~%.0f, ссылки - ~%.0f' % (self.nPairedFiles, self.nLinkedFiles))
+
+        for fext in sorted(self.exts, key=lambda e: self.exts[e].nFiles, reverse=True):
+            es = self.exts[fext]
+
+            ret.append('  %-6s ~%.0f файлов, %s; выборка %d: %s/файл, ошибок %d, без чтения файла %s' % (fext,
+                es.nFiles, size_str(es.nBytes),
+                es.nCached + es.nTimed,
+                duration_str(es.get_seconds_per_file()),
+                es.nFailed,
+                percents_str(es.nCached, es.nCached + es.nTimed)))
+
+        ret += ['Время: поиск файлов ~%s, обработка метаданных ~%s (рабочих процессов: %d), всего ~%s' % (duration_str(walkSeconds),
+                duration_str(extractSeconds), self.nworkers,
+                duration_str(walkSeconds + extractSeconds)),
+            'Будет прочитано: не более %s' % size_str(self.get_read_bytes()),
+            'Память: ~%s' % size_str(self.get_peak_memory()),
+            'Время оценки: %s' % duration_str(self.walkSeconds + self.sampleSeconds)]
+
+        return '\n'.join(ret)
+
+
+def create_estimator(config):
+    """Создаёт экземпляр ScanEstimator в соответствии с настройками
+    config (экземпляр pstat_config.Configuration)."""
+
+    return ScanEstimator(config.cfgEstimateSampleSize, config.cfgEstimateDirFraction,
+        config.get_extract_workers())
+
+
+def run_estimate(config):
+    """Оценка сбора статистики по каталогу config.cfgPhotoRootDir
+    (для консольного режима). Отчёт выводится в stdout, сообщения
+    об ошибках - в stderr.
+    Возвращает код завершения программы."""
+
+    from pstat_extract import create_extractor
+    from pstat_walk import create_walker
+
+    if not os.path.isdir(config.cfgPhotoRootDir):
+        print('Каталог "%s" не существует или недоступен' % config.cfgPhotoRootDir, file=sys.stderr)
+        return 1
+
+    estimator = create_estimator(config)
+    extractor = create_extractor(config)
+
+    try:
+        ok = estimator.estimate(config.cfgPhotoRootDir, config.get_scan_file_types(), extractor, create_walker(config))
+    finally:
+        extractor.close()
+
+    print(estimator.get_report())
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    from pstat_config import Configuration, get_config_file_name
+
+    config = Configuration(get_config_file_name())
+    config.load()
+
+    if len(sys.argv) > 1:
+        config.cfgPhotoRootDir = os.path.abspath(sys.argv[1])
+
+    exit(run_estimate(config))
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_exif.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Встроенный разборщик EXIF для контейнеров JPEG и TIFF (в т.ч. RAW
+# на основе TIFF - DNG, NEF, CR2, ARW, PEF...).
+# Читает из файла только заголовки и нужные тэги, не загружая
+# весь файл, и потому гораздо быстрее, чем GExiv2.Metadata().
+# Если разобрать файл не удалось - генерируется ExifFormatError,
+# и вызывающая сторона обращается к GExiv2; к нему же следует
+# обращаться, если нужных значений нет в основных тэгах (см.
+# ExifMetadata.is_complete()) - makernote здесь не разбираются.
+
+
+import struct
+from fractions import Fraction
+
+from pstat_sniff import CT_JPEG, CT_TIFF
+
+
+class ExifFormatError(Exception):
+    pass
+
+
+# ifd - IFD0 (основной каталог, Exif.Image.*) или Exif IFD (Exif.Photo.*)
+IFD_IMAGE, IFD_PHOTO = range(2)
+
+# тэги, которые умеет отдавать ExifMetadata,
+# ключи - имена в нотации Exiv2, значения - кортежи (ifd, номер тэга)
+KNOWN_TAGS = {'Exif.Image.Make':                (IFD_IMAGE, 0x010F),
+    'Exif.Image.Model':                         (IFD_IMAGE, 0x0110),
+    'Exif.Image.DateTime':                      (IFD_IMAGE, 0x0132),
+    'Exif.Image.FNumber':                       (IFD_IMAGE, 0x829D),
+    'Exif.Image.DateTimeOriginal':              (IFD_IMAGE, 0x9003),
+    'Exif.Photo.ExposureTime':                  (IFD_PHOTO, 0x829A),
+    'Exif.Photo.FNumber':                       (IFD_PHOTO, 0x829D),
+    'Exif.Photo.ISOSpeedRatings':               (IFD_PHOTO, 0x8827),
+    'Exif.Photo.ISOSpeed':                      (IFD_PHOTO, 0x8833),
+    'Exif.Photo.DateTimeOriginal':              (IFD_PHOTO, 0x9003),
+    'Exif.Photo.DateTimeDigitized':             (IFD_PHOTO, 0x9004),
+    'Exif.Photo.FocalLength':                   (IFD_PHOTO, 0x920A),
+    'Exif.Photo.SubSecTimeOriginal':            (IFD_PHOTO, 0x9291),
+    'Exif.Photo.BodySerialNumber':              (IFD_PHOTO, 0xA431),
+    'Exif.Photo.LensModel':                     (IFD_PHOTO, 0xA434),
+    }
+
+# номера нужных тэгов по IFD: элементы кортежа - словари,
+# где ключи - номера тэгов, значения - имена тэгов
+WANTED_TAGS = ({}, {})
+for tagName, (tagIFD, tagNumber) in KNOWN_TAGS.items():
+    WANTED_TAGS[tagIFD][tagNumber] = tagName
+
+del tagName, tagIFD, tagNumber
+
+TAG_EXIF_IFD_POINTER = 0x8769
+
+# размеры значений по типам TIFF
+TYPE_SIZES = {1:1, 2:1, 3:2, 4:4, 5:8, 6:1, 7:1, 8:2, 9:4, 10:8, 11:4, 12:8}
+TYPE_ASCII, TYPE_SHORT, TYPE_LONG, TYPE_RATIONAL, TYPE_SLONG, TYPE_SRATIONAL = 2, 3, 4, 5, 9, 10
+
+# значение Exif.Photo.ISOSpeedRatings (SHORT) для ISO больше 65535 -
+# настоящее значение надо искать в других тэгах
+ISO_SPEED_RATINGS_OVERFLOW = 65535
+
+# ограничения, дабы не зациклиться и не съесть память на битых файлах
+MAX_IFD_ENTRIES = 1024
+MAX_ASCII_LENGTH = 256
+MAX_JPEG_SEGMENTS = 64
+
+
+class ExifMetadata():
+    """Результат разбора EXIF встроенным разборщиком.
+    Методы повторяют используемое подмножество методов GExiv2.Metadata,
+    т.е. экземпляры класса могут использоваться вместо него."""
+
+    def __init__(self, tags):
+        # ключи - имена тэгов (см. KNOWN_TAGS), значения - str, int или Fraction
+        self.tags = tags
+
+    def has_exif(self):
+        return bool(self.tags)
+
+    def get_tag_string(self, name):
+        v = self.tags.get(name)
+
+        return None if v is None else str(v)
+
+    def get_exif_tag_rational(self, name):
+        v = self.tags.get(name)
+
+        return v if isinstance(v, Fraction) else None
+
+    def get_focal_length(self):
+        # как и GExiv2: -1, если значение неизвестно
+        v = self.get_exif_tag_rational('Exif.Photo.FocalLength')
+
+        return float(v) if v is not None else -1.0
+
+    def get_iso_speed(self):
+        iso = self.tags.get('Exif.Photo.ISOSpeedRatings')
+        if not isinstance(iso, int) or iso <= 0:
+            iso = 0
+
+        if iso == 0 or iso == ISO_SPEED_RATINGS_OVERFLOW:
+            v = self.tags.get('Exif.Photo.ISOSpeed')
+            if isinstance(v, int) and v > 0:
+                return v
+
+        return iso
+
+    def is_complete(self):
+        """Возвращает True, если найдены ФР и ISO. Иначе их стоит поискать
+        GExiv2 - он знает и тэги из makernote (напр. ISO у Sony и Nikon),
+        которые встроенный разборщик не читает."""
+
+        iso = self.get_iso_speed()
+
+        return self.get_focal_length() > 0 and 0 < iso != ISO_SPEED_RATINGS_OVERFLOW
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.tags)
+
+
+class TiffReader():
+    """Разбор структуры TIFF.
+    read_at - функция, получающая смещение (от начала TIFF) и длину,
+    и возвращающая bytes."""
+
+    def __init__(self, read_at):
+        self.read_at = read_at
+
+        hdr = read_at(0, 8)
+        if len(hdr) < 8:
+            raise ExifFormatError('TIFF header is too short')
+
+        if hdr[:2] == b'II':
+            self.bo = '<'
+        elif hdr[:2] == b'MM':
+            self.bo = '>'
+        else:
+            raise ExifFormatError('bad TIFF byte order mark')
+
+        magic, self.ifd0offset = struct.unpack(self.bo + 'HL', hdr[2:8])
+        if magic != 42:
+            raise ExifFormatError('bad TIFF magic')
+
+    def __value(self, vtype, count, valfield):
+        size = TYPE_SIZES.get(vtype)
+        if size is None or count == 0:
+            return None
+
+        if vtype == TYPE_ASCII:
+            count = min(count, MAX_ASCII_LENGTH)
+        elif vtype in (TYPE_SHORT, TYPE_LONG, TYPE_SLONG, TYPE_RATIONAL, TYPE_SRATIONAL):
+            # нужно только первое значение
+            count = 1
+        else:
+            return None
+
+        total = size * count
+
+        if total <= 4:
+            data = valfield[:total]
+        else:
+            data = self.read_at(struct.unpack(self.bo + 'L', valfield)[0], total)
+            if len(data) < total:
+                raise ExifFormatError('value is out of file bounds')
+
+        if vtype == TYPE_ASCII:
+            return data.split(b'\x00', 1)[0].decode('utf-8', 'replace').strip()
+        elif vtype == TYPE_SHORT:
+            return struct.unpack(self.bo + 'H', data)[0]
+        elif vtype == TYPE_LONG:
+            return struct.unpack(self.bo + 'L', data)[0]
+        elif vtype == TYPE_SLONG:
+            return struct.unpack(self.bo + 'l', data)[0]
+        else:
+            num, den = struct.unpack(self.bo + ('LL' if vtype == TYPE_RATIONAL else 'll'), data)
+
+            return Fraction(num, den) if den != 0 else None
+
+    def read_ifd(self, offset, wanted, tags):
+        """Чтение IFD по смещению offset.
+        wanted - словарь {номер тэга: имя}, найденные значения
+        помещаются в словарь tags.
+        Возвращает смещение Exif IFD или 0."""
+
+        cnt = self.read_at(offset, 2)
+        if len(cnt) < 2:
+            raise ExifFormatError('IFD is out of file bounds')
+
+        nentries = struct.unpack(self.bo + 'H', cnt)[0]
+        if nentries > MAX_IFD_ENTRIES:
+            raise ExifFormatError('too many IFD entries')
+
+        data = self.read_at(offset + 2, nentries * 12)
+        if len(data) < nentries * 12:
+            raise ExifFormatError('IFD is out of file bounds')
+
+        exifOffset = 0
+
+        for ix in range(0, nentries * 12, 12):
+            tag, vtype, count = struct.unpack(self.bo + 'HHL', data[ix:ix + 8])
+
+            if tag == TAG_EXIF_IFD_POINTER:
+                exifOffset = struct.unpack(self.bo + 'L', data[ix + 8:ix + 12])[0]
+            elif tag in wanted:
+                v = self.__value(vtype, count, data[ix + 8:ix + 12])
+                if v is not None:
+                    tags[wanted[tag]] = v
+
+        return exifOffset
+
+    def read_tags(self):
+        """Возвращает словарь с найденными тэгами из KNOWN_TAGS."""
+
+        tags = {}
+
+        exifOffset = self.read_ifd(self.ifd0offset, WANTED_TAGS[IFD_IMAGE], tags)
+
+        if exifOffset:
+            self.read_ifd(exifOffset, WANTED_TAGS[IFD_PHOTO], tags)
+
+        return tags
+
+
+def read_jpeg_exif_segment(f):
+    """Поиск сегмента APP1 с EXIF в файле JPEG.
+    Возвращает содержимое сегмента без заголовка "Exif\\0\\0"
+    (т.е. структуру TIFF) или None, если EXIF в файле нет."""
+
+    pos = 2
+
+    for nseg in range(MAX_JPEG_SEGMENTS):
+        f.seek(pos)
+        hdr = f.read(4)
+
+        if len(hdr) < 4 or hdr[0] != 0xFF:
+            raise ExifFormatError('bad JPEG segment')
+
+        marker = hdr[1]
+
+        if marker == 0xFF:
+            # заполнитель
+            pos += 1
+            continue
+
+        if marker in (0xD9, 0xDA):
+            # EOI или SOS - дальше метаданных не будет
+            return None
+
+        seglen = struct.unpack('>H', hdr[2:4])[0]
+        if seglen < 2:
+            raise ExifFormatError('bad JPEG segment length')
+
+        if marker == 0xE1:
+            seg = f.read(seglen - 2)
+
+            if seg[:6] == b'Exif\x00\x00':
+                return seg[6:]
+
+        pos += 2 + seglen
+
+    raise ExifFormatError('too many JPEG segments')
+
+
+def read_exif(f, ctype, head=b''):
+    """Разбор EXIF в файле f (файловый объект, открытый в двоичном режиме).
+
+    ctype   - тип контейнера (pstat_sniff.CT_JPEG или CT_TIFF);
+    head    - уже прочитанное начало файла (для TIFF используется
+              вместо повторного чтения, если его хватает).
+
+    Возвращает экземпляр ExifMetadata или None, если EXIF в файле нет.
+    В случае ошибок разбора генерирует ExifFormatError."""
+
+    try:
+        if ctype == CT_JPEG:
+            tiff = read_jpeg_exif_segment(f)
+            if tiff is None:
+                return None
+
+            reader = TiffReader(lambda offset, size: tiff[offset:offset + size])
+
+        elif ctype == CT_TIFF:
+            def read_at(offset, size):
+                if offset + size <= len(head):
+                    return head[offset:offset + size]
+
+                f.seek(offset)
+                return f.read(size)
+
+            reader = TiffReader(read_at)
+
+        else:
+            raise ExifFormatError('unsupported container type %s' % ctype)
+
+        tags = reader.read_tags()
+
+    except (struct.error, ValueError) as ex:
+        raise ExifFormatError(str(ex))
+
+    return ExifMetadata(tags) if tags else None
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    import sys
+    from pstat_sniff import sniff_header, SNIFF_SIZE
+
+    for fpath in sys.argv[1:]:
+        with open(fpath, 'rb') as f:
+            head = f.read(SNIFF_SIZE)
+
+            print(fpath, read_exif(f, sniff_header(head), head))
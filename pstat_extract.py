@@ -0,0 +1,750 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_extract.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+import sys
+import datetime
+from collections import namedtuple, deque
+from time import perf_counter, monotonic
+
+from pstat_common import *
+from pstat_config import get_quarantine_file_name
+from pstat_sniff import sniff_header, SNIFF_SIZE, FAST_EXIF_TYPES
+from pstat_exif import read_exif, ExifFormatError
+
+
+photo_metadata = namedtuple('photo_metadata', 'focal aperture iso year month exposure date camera lens')
+# focal     - фокусное расстояние (целое, НЕ приведённое к ЭФР; -1, если неизвестно);
+# aperture  - значение диафрагмы (float; 0.0, если неизвестно);
+# iso       - значение ISO Speed (целое; 0, если неизвестно);
+# year,
+# month     - год и месяц съёмки (целые; None, если дата неизвестна);
+# exposure  - выдержка в секундах (float; 0.0, если неизвестна);
+# date      - дата и время съёмки (datetime.datetime; None, если неизвестны);
+# camera    - производитель и модель камеры (строка; пустая, если неизвестны);
+# lens      - модель объектива (строка; пустая, если неизвестна)
+
+
+# тэги даты/времени создания снимка в порядке предпочтения
+# (авось хоть какой обнаружится в файле)
+DT_TAGS = ('Exif.Photo.DateTimeDigitized',
+    'Exif.Image.DateTimeOriginal',
+    'Exif.Photo.DateTimeOriginal',
+    'Exif.Image.DateTime')
+
+
+# модуль GExiv2 (см. get_gexiv2())
+GExiv2 = None
+
+
+def get_gexiv2():
+    """Возвращает модуль GExiv2, загружая его при первом вызове -
+    typelib грузится не быстро, а до сбора статистики (и в процессе,
+    где файлы обрабатывают рабочие процессы) он не нужен."""
+
+    global GExiv2
+
+    if GExiv2 is None:
+        from gi import require_version as gi_require_version
+        gi_require_version('GExiv2', '0.10') # только чтоб не лаялось...
+        from gi.repository import GExiv2 as gexiv2
+
+        gexiv2.log_set_level(gexiv2.LogLevel.MUTE)
+
+        GExiv2 = gexiv2
+
+    return GExiv2
+
+
+def get_camera_name(make, model):
+    """Возвращает название камеры по значениям тэгов Make и Model
+    (строкам или None). Производитель не дублируется, если он уже
+    указан в названии модели (как любят делать Canon и Nikon)."""
+
+    make = make.strip() if make else ''
+    model = model.strip() if model else ''
+
+    if not make:
+        return model
+
+    if not model:
+        return make
+
+    # "NIKON CORPORATION" + "NIKON D750" -> "NIKON D750"
+    if model.lower().startswith(make.split(None, 1)[0].lower()):
+        return model
+
+    return '%s %s' % (make, model)
+
+
+def extract_metadata(fpath, profiler=None):
+    """Извлечение метаданных из файла фотографии.
+
+    fpath       - полный путь к файлу;
+    profiler    - None или экземпляр pstat_profile.ScanProfiler.
+
+    Сначала по первым байтам файла определяется тип контейнера
+    (см. pstat_sniff): файлы неизвестных типов сразу отбрасываются,
+    JPEG и TIFF разбираются встроенным разборщиком (см. pstat_exif),
+    а прочие файлы - GExiv2. Файлы, с которыми встроенный разборщик
+    не справился или в основных тэгах которых не нашлось EXIF, ФР
+    или ISO, тоже передаются GExiv2 - дабы результат не зависел
+    от того, какой разборщик обработал файл.
+
+    Возвращает экземпляр photo_metadata, или None, если файл
+    не удалось открыть или в нём нет EXIF."""
+
+    if profiler:
+        t0 = profiler.begin()
+
+    gmd = None
+
+    try:
+        # файл открываем один раз - и для определения типа,
+        # и для встроенного разборщика
+        with open(fpath, 'rb') as f:
+            head = f.read(SNIFF_SIZE)
+            ctype = sniff_header(head)
+
+            if ctype in FAST_EXIF_TYPES:
+                try:
+                    gmd = read_exif(f, ctype, head)
+                except ExifFormatError:
+                    gmd = None
+
+                if gmd is not None and not gmd.is_complete():
+                    # пусть с этим файлом разбирается GExiv2
+                    gmd = None
+
+    except OSError:
+        ctype = None
+
+    finally:
+        if profiler:
+            profiler.end(profiler.STAGE_SNIFF, t0)
+            t0 = profiler.begin()
+
+    if ctype is None:
+        # не фото
+        return
+
+    if gmd is None:
+        try:
+            gmd = get_gexiv2().Metadata(fpath)
+
+        except Exception:
+            # файлы, которые не содержат EXIF или не открываются
+            # выгребалкой по любой другой причине - фотками не считаются.
+            # подробности мну в данный момент не колышут.
+            return
+
+        finally:
+            if profiler:
+                profiler.end(profiler.STAGE_OPEN, t0)
+                t0 = profiler.begin()
+
+    if not gmd.has_exif():
+        # такие товарищи нам совсем не товарищи
+        # снимки без метаданных не учитываем ваще совсем
+        return
+
+    # дробные значения ФР нам нафиг не нужны
+    focal = int(round(gmd.get_focal_length()))
+
+    aperture = gmd.get_exif_tag_rational('Exif.Photo.FNumber')
+    if not aperture:
+        aperture = gmd.get_exif_tag_rational('Exif.Image.FNumber')
+
+    aperture = float(aperture) if aperture else 0.0
+
+    if aperture < 0.5:
+        # считается, что диафрагмы < 0.7 не бывает, но оставим всё ж запас ради параноищи
+        # если вернуло кривое значение (например, <0)
+        # считаем это "неизвестным значением"
+        aperture = 0.0
+
+    isoSpeed = gmd.get_iso_speed()
+    if isoSpeed < 0:
+        isoSpeed = 0
+
+    exposure = gmd.get_exif_tag_rational('Exif.Photo.ExposureTime')
+    exposure = float(exposure) if exposure and exposure > 0 else 0.0
+
+    camera = get_camera_name(gmd.get_tag_string('Exif.Image.Make'),
+        gmd.get_tag_string('Exif.Image.Model'))
+
+    lens = gmd.get_tag_string('Exif.Photo.LensModel')
+    lens = lens.strip() if lens else ''
+
+    if profiler:
+        profiler.end(profiler.STAGE_METADATA, t0)
+        t0 = profiler.begin()
+
+    #
+    # определяем дату создания снимка для статистики по годам и месяцам
+    #
+    year = None
+    month = None
+    pdate = None
+
+    for dtn in DT_TAGS:
+        tagv = gmd.get_tag_string(dtn)
+        if tagv:
+            try:
+                pdate = datetime.datetime.strptime(tagv, '%Y:%m:%d %H:%M:%S')
+            except:
+                continue
+
+            year = pdate.year
+            month = pdate.month
+            break
+
+    if profiler:
+        profiler.end(profiler.STAGE_DATES, t0)
+
+    return photo_metadata(focal, aperture, isoSpeed, year, month,
+        exposure, pdate, camera, lens)
+
+
+class Quarantine():
+    """Список файлов, при обработке которых рабочий процесс завис
+    или рухнул. Такие файлы при последующих сборах статистики
+    не обрабатываются.
+
+    Список хранится в текстовом файле (по одному пути в строке,
+    строки, начинающиеся с "#" - комментарии); новые записи
+    дописываются в файл сразу, дабы не потерялись, если рухнет
+    уже вся программа."""
+
+    def __init__(self, fname):
+        """fname - путь к файлу со списком, или None (список только в памяти)."""
+
+        self.fname = fname
+        self.paths = set()
+
+        self.load()
+
+    def load(self):
+        self.paths.clear()
+
+        if not self.fname or not os.path.exists(self.fname):
+            return
+
+        try:
+            with open(self.fname, 'r', errors='surrogateescape') as f:
+                for s in f:
+                    s = s.rstrip('\n')
+
+                    if s and not s.startswith('#'):
+                        self.paths.add(s)
+
+        except OSError as ex:
+            print('Не удалось загрузить список файлов в карантине "%s" - %s' % (self.fname,
+                exception_to_str(ex)), file=sys.stderr)
+
+    def add(self, fpath, reason):
+        """Добавление файла в список.
+        reason - строка с описанием причины (пишется в комментарий)."""
+
+        if fpath in self.paths:
+            return
+
+        self.paths.add(fpath)
+
+        if not self.fname:
+            return
+
+        try:
+            fdir = os.path.split(self.fname)[0]
+            if fdir:
+                os.makedirs(fdir, exist_ok=True)
+
+            with open(self.fname, 'a', errors='surrogateescape') as f:
+                f.write('# %s: %s\n%s\n' % (datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    reason, fpath))
+
+        except OSError as ex:
+            print('Не удалось сохранить список файлов в карантине "%s" - %s' % (self.fname,
+                exception_to_str(ex)), file=sys.stderr)
+
+    def __contains__(self, fpath):
+        return fpath in self.paths
+
+    def __len__(self):
+        return len(self.paths)
+
+
+def split_quarantined(items, quarantine, skipped):
+    """Генератор, возвращающий элементы items (см. MetadataExtractor.process()),
+    кроме файлов, находящихся в карантине quarantine (экземпляре Quarantine
+    или None): номера таких файлов добавляются в конец skipped (deque),
+    а вместо них возвращается None - дабы вызывающая сторона могла
+    сразу выдать результаты для них."""
+
+    for item in items:
+        if item is not None and quarantine is not None and item[1] in quarantine:
+            skipped.append(item[0])
+            yield None
+        else:
+            yield item
+
+
+class MetadataExtractor():
+    """Извлечение метаданных в текущем процессе.
+    Базовый класс для ExtractorPool."""
+
+    # состояния обработки файла
+    STATUS_OK, STATUS_FAILED, STATUS_QUARANTINED, STATUS_TIMEOUT, STATUS_CRASHED = range(5)
+
+    def __init__(self, quarantine=None):
+        """quarantine - None или экземпляр Quarantine."""
+
+        self.quarantine = quarantine
+
+        # None или экземпляр pstat_profile.ScanProfiler;
+        # устанавливается вызывающей стороной на время обработки
+        self.profiler = None
+
+        # None или функция, получающая последовательность файлов (в формате
+        # параметра items метода process()) и возвращающая её же, но
+        # с ограничением скорости (см. pstat_throttle.ScanThrottle.paced());
+        # применяется только к файлам, которые действительно читаются
+        # (без файлов из карантина, а у потомков-обёрток - без файлов,
+        # метаданные которых взяты из баз или кэша);
+        # устанавливается вызывающей стороной на время обработки
+        self.pace = None
+
+        # None или функция, получающая номер файла (fileId) и возвращающая
+        # кортеж (размер, время изменения в наносекундах) по данным поиска
+        # файлов (0 - неизвестно); потомки-обёртки проверяют по нему
+        # актуальность данных из баз или кэша без повторного os.stat();
+        # устанавливается вызывающей стороной на время обработки
+        self.fileStat = None
+
+    def process(self, items):
+        """Генератор, обрабатывающий файлы.
+
+        items   - итерируемый объект, возвращающий кортежи
+                  из двух элементов: номера файла (fileId)
+                  и полного пути к файлу; вместо кортежа может
+                  возвращать None (файла для чтения пока нет, напр.
+                  у pstat_catalog.CatalogExtractor) - тогда process()
+                  возвращает None и продолжает перебор.
+
+        Для каждого файла возвращает кортеж из четырёх элементов:
+        1. номер файла;
+        2. экземпляр photo_metadata или None;
+        3. состояние обработки (STATUS_*);
+        4. время обработки файла в секундах.
+        Результаты могут возвращаться не в порядке поступления файлов.
+
+        Потомки также могут возвращать None, пока ожидают результатов,
+        дабы вызывающая сторона могла обновить UI или прервать обработку."""
+
+        skipped = deque()
+
+        items = split_quarantined(items, self.quarantine, skipped)
+
+        if self.pace is not None:
+            items = self.pace(items)
+
+        for item in items:
+            while skipped:
+                yield (skipped.popleft(), None, self.STATUS_QUARANTINED, 0.0)
+
+            if item is None:
+                yield None
+                continue
+
+            fileId, fpath = item
+
+            t0 = perf_counter()
+            md = extract_metadata(fpath, self.profiler)
+
+            yield (fileId, md, self.STATUS_FAILED if md is None else self.STATUS_OK, perf_counter() - t0)
+
+        while skipped:
+            yield (skipped.popleft(), None, self.STATUS_QUARANTINED, 0.0)
+
+    def is_cached(self, fpath):
+        """Возвращает True, если метаданные файла fpath будут получены
+        без чтения самого файла (напр. из базы каталогизатора)."""
+
+        return False
+
+    def get_tuned_workers(self):
+        """Возвращает подобранное во время последнего вызова process()
+        количество рабочих процессов (см. pstat_autotune) или None."""
+
+        return None
+
+    def close(self):
+        pass
+
+
+def extractor_worker_main(conn, niceness=0):
+    """Главная функция рабочего процесса ExtractorPool.
+    Получает из conn кортежи (fileId, путь, профилировать ли обработку),
+    отправляет обратно кортежи (fileId, photo_metadata или None,
+    время обработки в секундах, время стадий обработки или None) -
+    время стадий в формате pstat_profile.ScanProfiler.stages.
+    При получении None завершает работу.
+    niceness - увеличение значения nice процесса (0 - не менять)."""
+
+    if niceness:
+        # в Linux приоритет ввода-вывода процесса, если он не задан
+        # явно, вычисляется из nice, т.е. тоже снижается
+        try:
+            os.nice(niceness)
+        except (OSError, AttributeError):
+            pass
+
+    profiler = None
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if msg is None:
+            break
+
+        fileId, fpath, profile = msg
+
+        if profile:
+            if profiler is None:
+                from pstat_profile import ScanProfiler
+                profiler = ScanProfiler()
+
+            profiler.stages.clear()
+
+        t0 = perf_counter()
+
+        try:
+            md = extract_metadata(fpath, profiler if profile else None)
+        except Exception:
+            md = None
+
+        conn.send((fileId, md, perf_counter() - t0, profiler.stages if profile else None))
+
+
+class ExtractorPool(MetadataExtractor):
+    """Извлечение метаданных в отдельных рабочих процессах.
+
+    Если рабочий процесс не справился с файлом за отведённое время
+    или рухнул - процесс перезапускается, а файл попадает в карантин
+    (см. Quarantine). Прочие рабочие процессы при этом продолжают
+    обрабатывать свои файлы.
+
+    Рабочие процессы создаются по мере надобности и живут до вызова
+    close(), т.е. экземпляр можно использовать для нескольких
+    сборов статистики подряд.
+
+    Если задан tuner (экземпляр pstat_autotune.WorkerTuner), количество
+    одновременно работающих процессов (nworkers) подбирается во время
+    обработки по измеренной скорости."""
+
+    # максимальное время ожидания результатов, после которого
+    # process() возвращает None для обновления UI
+    IDLE_TICK = 0.2
+
+    class Worker():
+        def __init__(self, ctx, niceness):
+            self.conn, childConn = ctx.Pipe()
+
+            self.process = ctx.Process(target=extractor_worker_main, args=(childConn, niceness), daemon=True)
+            self.process.start()
+
+            childConn.close()
+
+            # обрабатываемый файл: номер, путь и время отправки
+            self.fileId = None
+            self.fpath = None
+            self.started = 0.0
+
+        def send(self, fileId, fpath, profile):
+            self.fileId = fileId
+            self.fpath = fpath
+            self.started = monotonic()
+
+            self.conn.send((fileId, fpath, profile))
+
+        def kill(self):
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+
+        def stop(self):
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+
+            self.process.join(1.0)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+
+            self.conn.close()
+
+    def __init__(self, nworkers, timeout, quarantine=None, niceness=0):
+        """nworkers     - количество рабочих процессов;
+        timeout         - максимальное время обработки одного файла в секундах;
+        quarantine      - None или экземпляр Quarantine;
+        niceness        - увеличение значения nice рабочих процессов
+                          (напр. при ограничении скорости сбора, см. pstat_throttle)."""
+
+        super().__init__(quarantine)
+
+        self.nworkers = max(1, nworkers)
+        self.timeout = timeout
+        self.niceness = niceness
+
+        # None или экземпляр pstat_autotune.WorkerTuner
+        self.tuner = None
+
+        # spawn - т.к. fork процесса с GTK и потоками чреват;
+        # multiprocessing импортируется здесь - дабы не тормозить
+        # запуск программы
+        import multiprocessing
+
+        self.ctx = multiprocessing.get_context('spawn')
+
+        # простаивающие рабочие процессы
+        self.idleWorkers = []
+
+    def __get_worker(self, nbusy):
+        # nworkers может уменьшиться при подборе - тогда лишние
+        # процессы просто простаивают
+        if nbusy >= self.nworkers:
+            return None
+
+        if self.idleWorkers:
+            return self.idleWorkers.pop()
+
+        return self.Worker(self.ctx, self.niceness)
+
+    def __quarantine(self, fpath, reason):
+        if self.quarantine is not None:
+            self.quarantine.add(fpath, reason)
+
+    def process(self, items):
+        from multiprocessing.connection import wait as mp_wait
+
+        skipped = deque()
+
+        items = split_quarantined(items, self.quarantine, skipped)
+
+        if self.pace is not None:
+            items = self.pace(items)
+
+        itemsLeft = True
+
+        if self.tuner is not None:
+            self.tuner.reset(self.nworkers)
+
+        # ключи - Connection, значения - экземпляры Worker
+        busy = {}
+
+        try:
+            while True:
+                # файла для чтения пока нет (см. параметр items) -
+                # результаты не ждём, а сразу возвращаем управление
+                noItem = False
+
+                # раздаём файлы простаивающим процессам
+                while itemsLeft:
+                    worker = self.__get_worker(len(busy))
+                    if worker is None:
+                        break
+
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        itemsLeft = False
+                        self.idleWorkers.append(worker)
+                        break
+
+                    if item is None:
+                        noItem = True
+                        self.idleWorkers.append(worker)
+                        break
+
+                    fileId, fpath = item
+
+                    worker.send(fileId, fpath, self.profiler is not None)
+                    busy[worker.conn] = worker
+
+                nresults = 0
+
+                # файлы из карантина
+                while skipped:
+                    nresults += 1
+                    yield (skipped.popleft(), None, self.STATUS_QUARANTINED, 0.0)
+
+                if not busy:
+                    if not itemsLeft:
+                        break
+
+                    if not nresults:
+                        yield None
+
+                    continue
+
+                now = monotonic()
+                deadline = min(map(lambda w: w.started, busy.values())) + self.timeout
+
+                waitobjs = list(busy.keys())
+                sentinels = dict(map(lambda w: (w.process.sentinel, w), busy.values()))
+                waitobjs += list(sentinels.keys())
+
+                ready = mp_wait(waitobjs, 0.0 if noItem else max(0.0, min(self.IDLE_TICK, deadline - now)))
+
+                for obj in ready:
+                    if obj in sentinels:
+                        continue
+
+                    worker = busy.pop(obj)
+
+                    try:
+                        fileId, md, seconds, stages = worker.conn.recv()
+                    except (EOFError, OSError):
+                        # рабочий процесс рухнул, не успев ответить
+                        worker.kill()
+                        self.__quarantine(worker.fpath, 'рабочий процесс аварийно завершился')
+
+                        nresults += 1
+                        yield (worker.fileId, None, self.STATUS_CRASHED, monotonic() - worker.started)
+                        continue
+
+                    self.idleWorkers.append(worker)
+
+                    # время стадий, измеренное рабочим процессом
+                    if stages and self.profiler is not None:
+                        self.profiler.merge_stages(stages)
+
+                    if self.tuner is not None:
+                        self.nworkers = self.tuner.add_result(seconds)
+
+                    # время - измеренное рабочим процессом, т.е. без учёта
+                    # задержки между готовностью результата и его получением
+                    nresults += 1
+                    yield (fileId, md, self.STATUS_FAILED if md is None else self.STATUS_OK, seconds)
+
+                # процессы, завершившиеся без ответа
+                for sentinel, worker in sentinels.items():
+                    if sentinel in ready and worker.conn in busy:
+                        del busy[worker.conn]
+                        worker.kill()
+                        self.__quarantine(worker.fpath, 'рабочий процесс аварийно завершился (код %s)' % worker.process.exitcode)
+
+                        nresults += 1
+                        yield (worker.fileId, None, self.STATUS_CRASHED, monotonic() - worker.started)
+
+                # зависшие процессы
+                now = monotonic()
+
+                for conn, worker in list(busy.items()):
+                    if now - worker.started >= self.timeout:
+                        del busy[conn]
+                        worker.kill()
+                        self.__quarantine(worker.fpath, 'обработка файла длилась более %g с' % self.timeout)
+
+                        nresults += 1
+                        yield (worker.fileId, None, self.STATUS_TIMEOUT, now - worker.started)
+
+                if not nresults:
+                    yield None
+
+        finally:
+            # при прерывании обработки результаты недообработанных
+            # файлов уже не нужны - процессы просто прибиваем
+            for worker in busy.values():
+                worker.kill()
+
+    def get_tuned_workers(self):
+        return self.tuner.get_result() if self.tuner is not None else None
+
+    def close(self):
+        """Завершение рабочих процессов."""
+
+        for worker in self.idleWorkers:
+            worker.stop()
+
+        self.idleWorkers.clear()
+
+
+def create_extractor(config):
+    """Возвращает экземпляр MetadataExtractor, ExtractorPool,
+    pstat_mdcache.CachedExtractor или pstat_catalog.CatalogExtractor
+    в соответствии с настройками.
+
+    config - экземпляр pstat_config.Configuration."""
+
+    quarantine = Quarantine(get_quarantine_file_name())
+
+    if config.cfgExtractWorkers > 0:
+        extractor = ExtractorPool(config.get_extract_workers(), config.cfgExtractTimeout, quarantine,
+            config.cfgThrottleNice if config.cfgThrottle else 0)
+
+        # при ограничении скорости подбирать нечего - скорость задана
+        if config.cfgAutotuneWorkers and not config.cfgThrottle:
+            from pstat_autotune import WorkerTuner
+
+            extractor.tuner = WorkerTuner(config.cfgAutotuneMaxWorkers)
+    else:
+        extractor = MetadataExtractor(quarantine)
+
+    if config.cfgMetadataCache:
+        # метаданные, уже извлечённые этим или другими экземплярами -
+        # из общего кэша; базы каталогизаторов - перед кэшем, т.к.
+        # известные им файлы кэшировать незачем
+        from pstat_mdcache import create_cached_extractor
+
+        extractor = create_cached_extractor(extractor, config.cfgMetadataCache)
+
+    if config.cfgCatalogs:
+        # метаданные файлов, известных каталогизаторам - из их баз
+        from pstat_catalog import create_catalog_extractor
+
+        extractor = create_catalog_extractor(extractor, config.cfgCatalogs, config.cfgCatalogCheckMtime)
+
+    return extractor
+
+
+def remember_tuned_workers(config, extractor, save):
+    """Запоминает в config количество рабочих процессов, подобранное
+    экземпляром extractor (см. create_extractor()) во время сбора
+    статистики. Если save == True и значение изменилось - сохраняет
+    настройки (сообщение об ошибке выводится в stderr)."""
+
+    nworkers = extractor.get_tuned_workers()
+
+    if not config.set_tuned_workers(nworkers):
+        return
+
+    print('Подобранное количество рабочих процессов для "%s": %d' % (config.cfgPhotoRootDir, nworkers), file=sys.stderr)
+
+    if save:
+        e = config.save()
+        if e:
+            print(e, file=sys.stderr)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_filelist.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+from gtktools import *
+from gi.repository import Gtk, Gdk, GObject
+
+from pstat_common import *
+
+
+class FileListDialog():
+    """Окно со списком файлов, учтённых в выбранной ячейке
+    таблицы статистики."""
+
+    # больше строк в Gtk.ListStore пихать нет смысла - заполнение
+    # растягивается на секунды, а листать такое всё равно никто не станет;
+    # в буфер обмена копируется полный список
+    MAX_ROWS = 20000
+
+    def __init__(self, parentwnd):
+        self.dlg = Gtk.Dialog(parent=parentwnd, use_header_bar=True)
+        self.dlg.set_default_size(WIDGET_BASE_WIDTH * 80, WIDGET_BASE_HEIGHT * 30)
+
+        self.dlg.add_buttons('Скопировать', Gtk.ResponseType.APPLY,
+            'Закрыть', Gtk.ResponseType.CLOSE)
+        self.dlg.set_default_response(Gtk.ResponseType.CLOSE)
+
+        vbox = self.dlg.get_content_area()
+        vbox.set_spacing(WIDGET_BASE_HEIGHT // 2)
+
+        self.txtInfo = create_aligned_label('')
+        vbox.pack_start(self.txtInfo, False, False, 0)
+
+        self.fileListView = TreeViewShell.new_view((GObject.TYPE_STRING,),
+            (TreeViewShell.Column((TreeViewShell.Cell(0, expand=True),), 'Файл', expand=True),),
+            withscroll=True)
+        self.fileListView.view.set_headers_visible(False)
+
+        vbox.pack_start(self.fileListView.widget, True, True, 0)
+
+        self.paths = []
+
+    def run(self, title, paths):
+        """Показ списка.
+        title   - заголовок окна (описание ячейки таблицы);
+        paths   - список полных путей к файлам."""
+
+        self.paths = paths
+
+        self.dlg.set_title(title)
+
+        self.fileListView.refresh_begin()
+
+        for path in paths[:self.MAX_ROWS]:
+            self.fileListView.store.append((path,))
+
+        self.fileListView.refresh_end()
+
+        if len(paths) > self.MAX_ROWS:
+            self.txtInfo.set_text('Файлов: %d (показаны первые %d)' % (len(paths), self.MAX_ROWS))
+        else:
+            self.txtInfo.set_text('Файлов: %d' % len(paths))
+
+        self.dlg.show_all()
+
+        while self.dlg.run() == Gtk.ResponseType.APPLY:
+            self.copy_to_clipboard()
+
+        self.dlg.hide()
+
+    def copy_to_clipboard(self):
+        try:
+            cb = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
+            cb.clear()
+            cb.set_text('\n'.join(self.paths), -1)
+            cb.store()
+        except Exception as ex:
+            msg_dialog(self.dlg, 'Копирование списка файлов в буфер обмена',
+                           'Сбой при операции с буфером обмена - %s' % exception_to_str(ex))
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    FileListDialog(None).run('Проверка', ['/photos/2021/a.nef', '/photos/2021/b.nef'])
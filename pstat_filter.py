@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_filter.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Отбор снимков по условию (напр. 'year == 2023 and "70-200" in lens')
+# для пересчёта статистики без повторного просмотра файлов.
+#
+# Условие записывается в синтаксисе выражений питона, разбирается
+# модулем ast (т.е. никогда не выполняется как код) и превращается
+# в цепочку map() по столбцам pstat_index.PhotoTable: каждое сравнение
+# вычисляется сразу для всех снимков циклом на стороне C, без вызова
+# питоньей функции на каждый снимок. Условия для строковых полей
+# (камера, объектив и т.п.) вычисляются один раз для каждой различной
+# строки, а по столбцу проверяется только принадлежность кода
+# множеству подошедших кодов.
+
+
+import os.path
+import sys
+import ast
+import datetime
+import operator
+from array import array
+from fractions import Fraction
+from itertools import compress, repeat
+from functools import reduce
+
+from pstat_stat import PhotoStatistics, normalized_aperture
+from pstat_extract import create_extractor, remember_tuned_workers
+from pstat_walk import create_walker
+from pstat_dedup import create_duplicate_finder
+from pstat_throttle import create_throttle
+from pstat_memprof import MemoryProfiler
+
+
+class FilterError(ValueError):
+    pass
+
+
+# виды полей
+FT_NUMBER, FT_APERTURE, FT_EXPOSURE, FT_DATE, FT_STRING = range(5)
+
+# поля, доступные в условиях: имя - (вид, имя столбца PhotoTable
+# или None для пути каталога)
+FILTER_FIELDS = {'focal': (FT_NUMBER, 'focal'),
+    'aperture': (FT_APERTURE, 'naperture'),
+    'iso': (FT_NUMBER, 'iso'),
+    'exposure': (FT_EXPOSURE, 'exposure'),
+    'year': (FT_NUMBER, 'year'),
+    'month': (FT_NUMBER, 'month'),
+    'date': (FT_DATE, 'date'),
+    'camera': (FT_STRING, 'camera'),
+    'lens': (FT_STRING, 'lens'),
+    'ext': (FT_STRING, 'ext'),
+    'folder': (FT_STRING, None)}
+
+COMPARE_OPS = {ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge}
+
+# операция для случая "значение <оп> поле" - переставляем операнды
+SWAPPED_OPS = {ast.Eq: ast.Eq,
+    ast.NotEq: ast.NotEq,
+    ast.Lt: ast.Gt,
+    ast.LtE: ast.GtE,
+    ast.Gt: ast.Lt,
+    ast.GtE: ast.LtE,
+    ast.In: ast.In,
+    ast.NotIn: ast.NotIn}
+
+
+class FilterContext():
+    """Данные, по которым вычисляется условие: столбцы PhotoTable
+    и строковые значения, соответствующие кодам в столбцах."""
+
+    def __init__(self, stats):
+        self.photos = stats.photos
+        self.nrows = len(stats.photos)
+
+        # пути каталогов - относительно корневого, с '/' в качестве
+        # разделителя (как бы ни было принято в ОС)
+        rootdir = stats.dirTree.path if stats.dirTree is not None else ''
+
+        def folder_name(dirpath):
+            return os.path.relpath(dirpath, rootdir).replace(os.sep, '/') if rootdir else dirpath
+
+        self.strings = {'camera': self.photos.cameras.values,
+            'lens': self.photos.lenses.values,
+            'ext': self.photos.exts.values,
+            'folder': list(map(folder_name, stats.files.dirs))}
+
+        self.columns = {'folder': stats.files.fileDirs}
+
+    def get_column(self, fname):
+        ftype, colname = FILTER_FIELDS[fname]
+
+        col = self.columns.get(fname)
+        if col is None:
+            col = getattr(self.photos, colname)
+
+        return col
+
+
+class PhotoFilter():
+    """Скомпилированное условие отбора снимков.
+
+    Поля:
+        expr    - исходная строка условия."""
+
+    def __init__(self, expr):
+        """Разбор условия expr.
+        В случае ошибки генерирует исключение FilterError."""
+
+        self.expr = expr.strip()
+
+        if not self.expr:
+            # пустое условие - все снимки
+            self.mask = None
+            return
+
+        try:
+            tree = ast.parse(self.expr, mode='eval')
+        except SyntaxError as ex:
+            raise FilterError('Синтаксическая ошибка в условии%s' % (' (позиция %d)' % ex.offset if ex.offset else ''))
+
+        self.mask = self.__compile(tree.body)
+
+    def __compile(self, node):
+        """Возвращает функцию, которая получает экземпляр FilterContext,
+        а возвращает итератор булевских значений - по одному
+        на строку PhotoTable."""
+
+        if isinstance(node, ast.BoolOp):
+            parts = list(map(self.__compile, node.values))
+            op = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+
+            def bool_op(ctx):
+                return reduce(lambda a, b: map(op, a, b), map(lambda part: part(ctx), parts))
+
+            return bool_op
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            part = self.__compile(node.operand)
+
+            def not_op(ctx):
+                return map(operator.not_, part(ctx))
+
+            return not_op
+
+        if isinstance(node, ast.Compare):
+            # a < b < c - то же, что a < b and b < c
+            operands = [node.left] + node.comparators
+            parts = [self.__compile_compare(operands[ix], op, operands[ix + 1]) for ix, op in enumerate(node.ops)]
+
+            if len(parts) == 1:
+                return parts[0]
+
+            def chain_op(ctx):
+                return reduce(lambda a, b: map(operator.and_, a, b), map(lambda part: part(ctx), parts))
+
+            return chain_op
+
+        raise FilterError('Недопустимое выражение в условии: "%s"' % ast.get_source_segment(self.expr, node))
+
+    def __compile_compare(self, left, op, right):
+        optype = type(op)
+
+        if isinstance(left, ast.Name):
+            fname = left.id
+            value = right
+        elif isinstance(right, ast.Name):
+            fname = right.id
+            value = left
+
+            if optype in (ast.In, ast.NotIn):
+                # "строка" in поле - поиск подстроки
+                return self.__compile_substring(fname, self.__get_constant(value), optype is ast.NotIn)
+
+            optype = SWAPPED_OPS[optype]
+        else:
+            raise FilterError('В сравнении "%s" нет имени поля' % ast.get_source_segment(self.expr, left))
+
+        if fname not in FILTER_FIELDS:
+            raise FilterError('Неизвестное поле "%s"; допустимые поля: %s' % (fname, ', '.join(FILTER_FIELDS)))
+
+        ftype = FILTER_FIELDS[fname][0]
+
+        if optype in (ast.In, ast.NotIn):
+            # поле in (значение, значение...)
+            values = self.__get_constant(value)
+            if not isinstance(values, (tuple, list, set)):
+                raise FilterError('Справа от "in" должен быть список значений, а не "%s"' % ast.get_source_segment(self.expr, value))
+
+            if ftype == FT_STRING:
+                wanted = set(map(lambda v: self.__get_string(fname, v).lower(), values))
+
+                return self.__compile_string_match(fname, lambda s: (s.lower() in wanted) != (optype is ast.NotIn))
+
+            wanted = frozenset(map(lambda v: self.__convert_value(fname, ftype, v), values))
+            negate = optype is ast.NotIn
+
+            def in_op(ctx):
+                r = map(wanted.__contains__, ctx.get_column(fname))
+
+                return map(operator.not_, r) if negate else r
+
+            return in_op
+
+        if optype not in COMPARE_OPS:
+            raise FilterError('Недопустимая операция сравнения в условии')
+
+        opfunc = COMPARE_OPS[optype]
+        cvalue = self.__get_constant(value)
+
+        if ftype == FT_STRING:
+            if optype not in (ast.Eq, ast.NotEq):
+                raise FilterError('Поле "%s" можно сравнивать только на равенство или с помощью "in"' % fname)
+
+            cvalue = self.__get_string(fname, cvalue).lower()
+
+            return self.__compile_string_match(fname, lambda s: opfunc(s.lower(), cvalue))
+
+        cvalue = self.__convert_value(fname, ftype, cvalue)
+
+        def compare_op(ctx):
+            col = ctx.get_column(fname)
+            r = map(opfunc, col, repeat(cvalue))
+
+            if optype in (ast.Lt, ast.LtE, ast.NotEq):
+                # неизвестные значения (<= 0) не подходят ни под какие условия
+                r = map(operator.and_, r, map(operator.gt, col, repeat(0)))
+
+            return r
+
+        return compare_op
+
+    def __compile_substring(self, fname, value, negate):
+        if FILTER_FIELDS.get(fname, (None,))[0] != FT_STRING:
+            raise FilterError('Поиск подстроки возможен только в полях %s' % ', '.join(
+                fn for fn, (ft, col) in FILTER_FIELDS.items() if ft == FT_STRING))
+
+        substr = self.__get_string(fname, value).lower()
+
+        return self.__compile_string_match(fname, lambda s: (substr in s.lower()) != negate)
+
+    def __compile_string_match(self, fname, match):
+        """Условие по строковому полю: match вызывается для каждой
+        различной строки, а не для каждого снимка."""
+
+        def string_op(ctx):
+            codes = frozenset(code for code, s in enumerate(ctx.strings[fname]) if match(s))
+
+            return map(codes.__contains__, ctx.get_column(fname))
+
+        return string_op
+
+    def __get_constant(self, node):
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            raise FilterError('"%s" - не значение (строки следует заключать в кавычки)' % ast.get_source_segment(self.expr, node))
+
+    def __get_string(self, fname, value):
+        if not isinstance(value, str):
+            raise FilterError('Поле "%s" сравнивается со строкой, а не с %s' % (fname, repr(value)))
+
+        return value
+
+    def __convert_value(self, fname, ftype, value):
+        """Приведение значения из условия к виду, в котором значения
+        поля хранятся в PhotoTable."""
+
+        if ftype == FT_DATE:
+            # "ГГГГ", "ГГГГ-ММ" или "ГГГГ-ММ-ДД" - первый день периода
+            try:
+                parts = list(map(int, str(value).split('-')))
+                parts += [1] * (3 - len(parts))
+
+                return datetime.date(*parts).toordinal()
+            except (ValueError, TypeError):
+                raise FilterError('Неправильная дата "%s" (нужно "ГГГГ-ММ-ДД")' % value)
+
+        if ftype == FT_EXPOSURE and isinstance(value, str):
+            # выдержка может быть задана как "1/250"
+            try:
+                value = float(Fraction(value))
+            except (ValueError, ZeroDivisionError):
+                raise FilterError('Неправильное значение выдержки "%s"' % value)
+
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise FilterError('Поле "%s" сравнивается с числом, а не с %s' % (fname, repr(value)))
+
+        if ftype == FT_APERTURE:
+            return normalized_aperture(value)
+
+        return value
+
+    def is_empty(self):
+        return self.mask is None
+
+    def get_mask(self, stats, dirpath=None):
+        """Возвращает bytearray, где индексы - номера файлов (в stats.files),
+        а значения - 1 для снимков, удовлетворяющих условию, иначе 0.
+
+        stats   - экземпляр pstat_stat.PhotoStatistics;
+        dirpath - None или путь каталога, которым (вместе с подкаталогами)
+                  следует ограничить отбор."""
+
+        ctx = FilterContext(stats)
+
+        # снимки без метаданных не отбираются никогда
+        mask = iter(stats.photos.valid)
+
+        if self.mask is not None:
+            mask = map(operator.and_, mask, self.mask(ctx))
+
+        if dirpath is not None and stats.dirTree is not None and os.path.normpath(dirpath) != stats.dirTree.path:
+            subdir = os.path.normpath(dirpath)
+            subprefix = os.path.join(subdir, '')
+
+            dirIds = frozenset(dirId for dirId, dpath in enumerate(stats.files.dirs)
+                if dpath == subdir or dpath.startswith(subprefix))
+
+            mask = map(operator.and_, mask, map(dirIds.__contains__, stats.files.fileDirs))
+
+        return bytearray(mask)
+
+    def select(self, stats, dirpath=None):
+        """Возвращает массив номеров файлов (в stats.files) снимков,
+        удовлетворяющих условию. Параметры - как у get_mask()."""
+
+        mask = self.get_mask(stats, dirpath)
+
+        return array('I', compress(range(len(mask)), mask))
+
+    def __str__(self):
+        return self.expr
+
+
+def run_filtered_stats(config, expr):
+    """Сбор статистики и вывод в stdout таблиц статистики по снимкам,
+    удовлетворяющим условию expr (консольный режим, ключ --filter).
+
+    config  - экземпляр pstat_config.Configuration.
+
+    Сообщения об ошибках выводятся в stderr.
+    Возвращает код завершения программы."""
+
+    # условие проверяем до сбора статистики - чтобы не ждать зря
+    try:
+        photoFilter = PhotoFilter(expr)
+    except FilterError as ex:
+        print(ex, file=sys.stderr)
+        return 1
+
+    stats = PhotoStatistics()
+    extractor = create_extractor(config)
+    dedup = create_duplicate_finder(config)
+    throttle = create_throttle(config)
+
+    memprof = MemoryProfiler() if config.cfgMemProfile else None
+    if memprof:
+        memprof.start()
+
+    try:
+        ok, em = stats.gather_photo_statistics(config.cfgPhotoRootDir,
+            config.get_scan_file_types(),
+            memprof.wrap_stagedisp(None) if memprof else None,
+            sampling=config.cfgSamplingMode,
+            extractor=extractor,
+            walker=create_walker(config),
+            dedup=dedup,
+            throttle=throttle)
+    finally:
+        extractor.close()
+
+    remember_tuned_workers(config, extractor, True)
+
+    if em:
+        print(em, file=sys.stderr)
+        return 1
+
+    if dedup and dedup.groups:
+        print(dedup.get_report(stats.files), file=sys.stderr)
+
+    if throttle:
+        print(throttle.get_summary_str(), file=sys.stderr)
+
+    if memprof:
+        memprof.stage('Отбор снимков и вывод статистики')
+
+    print(stats.get_filtered_stats(photoFilter).get_stat_tables_str())
+
+    if memprof:
+        memprof.finish()
+        print(memprof.get_report(), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    for expr in sys.argv[1:] or ['year == 2023 and "70-200" in lens and aperture <= 4',
+            '50 <= focal <= 85 or camera in ("nikon d750", "x-t3")',
+            'date >= "2024-03" and not ext == ".nef"',
+            'focal >', 'foo == 1', 'camera < "a"']:
+        try:
+            PhotoFilter(expr)
+            print('OK:', expr)
+        except FilterError as ex:
+            print('%s: %s' % (expr, ex))
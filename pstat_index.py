@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_index.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+from array import array
+from itertools import compress, repeat
+from operator import ge
+
+
+# виды "корзин" (групп снимков, соответствующих ячейкам таблиц статистики)
+# и ключи корзин каждого вида:
+# BUCKET_FA     - (фокусное расстояние, нормализованная диафрагма)
+# BUCKET_DATE   - (год, месяц)
+# BUCKET_ISO    - (ISO Speed,)
+BUCKET_FA, BUCKET_DATE, BUCKET_ISO = range(3)
+
+
+class BucketIndex():
+    """Индекс "корзина - номера файлов" (номера - как в pstat_paths.PathTable).
+
+    Для каждой корзины хранится массив номеров файлов (array.array
+    с 32-битными элементами, без питоньего объекта на каждый номер),
+    после вызова finish() - отсортированный по возрастанию, т.е. списки
+    файлов для объединения нескольких корзин (строки "прочие", итоги
+    по строкам и столбцам) получаются слиянием уже отсортированных
+    массивов (сортировка питона находит в данных готовые упорядоченные
+    участки и просто сливает их)."""
+
+    def __init__(self):
+        # ключи - (вид корзины, ключ корзины), значения - массивы номеров файлов
+        self.buckets = {}
+
+        # признак того, что массивы могут быть не отсортированы
+        # (файлы обрабатываются не по порядку - при сборе по выборке
+        # и при извлечении метаданных несколькими процессами)
+        self.unsorted = False
+
+    def clear(self):
+        self.buckets.clear()
+        self.unsorted = False
+
+    def __add(self, kind, key, fileId):
+        ids = self.buckets.get((kind, key))
+        if ids is None:
+            ids = array('I')
+            self.buckets[(kind, key)] = ids
+        elif ids[-1] > fileId:
+            self.unsorted = True
+
+        ids.append(fileId)
+
+    def add_file(self, fileId, focal, naperture, year, month, iso):
+        """Добавление файла с номером fileId во все соответствующие
+        его метаданным корзины. Значения - как в
+        AggregateStatistics.add_photo_metadata(): naperture -
+        нормализованное значение диафрагмы, year и month могут быть
+        равны None, iso - 0, если неизвестно."""
+
+        self.__add(BUCKET_FA, (focal, naperture), fileId)
+
+        if year is not None and month is not None:
+            self.__add(BUCKET_DATE, (year, month), fileId)
+
+        if iso > 0:
+            self.__add(BUCKET_ISO, (iso,), fileId)
+
+    def finish(self):
+        """Сортировка массивов номеров (после окончания сбора статистики)."""
+
+        if not self.unsorted:
+            return
+
+        for bkey, ids in self.buckets.items():
+            self.buckets[bkey] = array('I', sorted(ids))
+
+        self.unsorted = False
+
+    def get_file_ids(self, kind, match=None):
+        """Возвращает отсортированный массив номеров файлов из корзин
+        вида kind (BUCKET_*).
+
+        match - None (все корзины этого вида) или функция, получающая
+                ключ корзины (кортеж) и возвращающая True, если
+                корзина нужна."""
+
+        parts = [ids for (bkind, key), ids in self.buckets.items()
+            if bkind == kind and (match is None or match(key))]
+
+        ids = array('I')
+        for part in parts:
+            ids.extend(part)
+
+        if len(parts) > 1:
+            # каждый файл попадает только в одну корзину каждого вида,
+            # т.е. повторов при слиянии не бывает
+            ids = array('I', sorted(ids))
+
+        return ids
+
+    def remap(self, idMap):
+        """Замена номеров файлов после удаления файлов из таблицы путей.
+        idMap - массив, где индексы - старые номера файлов, а значения -
+        новые номера или -1 для удалённых файлов
+        (см. pstat_paths.PathTable.remove_dirs()).
+        Порядок оставшихся файлов не меняется, т.е. отсортированные
+        массивы остаются отсортированными."""
+
+        for bkey in list(self.buckets):
+            ids = array('I', filter(lambda i: i >= 0, map(idMap.__getitem__, self.buckets[bkey])))
+
+            if ids:
+                self.buckets[bkey] = ids
+            else:
+                del self.buckets[bkey]
+
+    def extend(self, other, offset):
+        """Добавление номеров файлов из индекса other (экземпляра
+        BucketIndex), сдвинутых на offset (см. pstat_paths.PathTable.extend())."""
+
+        for bkey, oids in other.buckets.items():
+            ids = self.buckets.get(bkey)
+            if ids is None:
+                ids = array('I')
+                self.buckets[bkey] = ids
+            elif oids and ids and ids[-1] > oids[0] + offset:
+                self.unsorted = True
+
+            ids.extend(map(lambda i: i + offset, oids))
+
+        self.unsorted |= other.unsorted
+
+    def __repr__(self):
+        return '%s(buckets=%d, ids=%d)' % (self.__class__.__name__,
+            len(self.buckets), sum(map(len, self.buckets.values())))
+
+
+class StringCodes():
+    """Словарь строк: каждой различной строке присваивается код
+    (порядковый номер, начиная с 0), в столбцах PhotoTable хранятся
+    только коды."""
+
+    def __init__(self):
+        # строки; индекс в списке - код
+        self.values = []
+        # ключи - строки, значения - коды
+        self.codes = {}
+
+    def clear(self):
+        self.values.clear()
+        self.codes.clear()
+
+    def get_code(self, s):
+        code = self.codes.get(s)
+        if code is None:
+            code = len(self.values)
+            self.values.append(s)
+            self.codes[s] = code
+
+        return code
+
+
+class PhotoTable():
+    """Метаданные снимков "по столбцам": для каждого поля - массив
+    array.array, индекс в массиве - номер файла (как в pstat_paths.PathTable).
+    Строковые значения (камера, объектив, расширение) хранятся
+    в виде кодов (см. StringCodes).
+
+    Используется для отбора снимков по условиям и пересчёта статистики
+    по отобранным снимкам (см. pstat_filter) без повторного просмотра
+    файлов.
+
+    Неизвестные значения числовых полей хранятся как значения <= 0,
+    неизвестные строки - как пустые строки."""
+
+    # имена столбцов-массивов (полей экземпляра) и коды типов array.array
+    COLUMNS = (('focal', 'i'),      # ФР
+        ('naperture', 'i'),         # нормализованная диафрагма
+        ('iso', 'i'),               # ISO Speed
+        ('exposure', 'd'),          # выдержка в секундах
+        ('year', 'i'),
+        ('month', 'i'),
+        ('date', 'i'),              # дата съёмки (datetime.date.toordinal())
+        ('camera', 'i'),            # код в self.cameras
+        ('lens', 'i'),              # код в self.lenses
+        ('ext', 'i'))               # код в self.exts
+
+    def __init__(self):
+        # 1 - метаданные файла извлечены, 0 - нет (ещё не обработан,
+        # не обработан при сборе по выборке, не удалось извлечь)
+        self.valid = bytearray()
+
+        for name, tcode in self.COLUMNS:
+            setattr(self, name, array(tcode))
+
+        self.cameras = StringCodes()
+        self.lenses = StringCodes()
+        self.exts = StringCodes()
+
+        # ключи - нормализованные значения диафрагмы, значения -
+        # первое встреченное исходное значение (для отображения)
+        self.apertureValues = {}
+
+    def clear(self):
+        del self.valid[:]
+
+        for name, tcode in self.COLUMNS:
+            del getattr(self, name)[:]
+
+        self.cameras.clear()
+        self.lenses.clear()
+        self.exts.clear()
+        self.apertureValues.clear()
+
+    def __len__(self):
+        return len(self.valid)
+
+    def resize(self, nrows):
+        """Увеличение количества строк до nrows (новые строки - без метаданных)."""
+
+        nadd = nrows - len(self.valid)
+        if nadd <= 0:
+            return
+
+        self.valid.extend(bytes(nadd))
+
+        for name, tcode in self.COLUMNS:
+            getattr(self, name).extend(repeat(0, nadd))
+
+    def set_row(self, fileId, md, naperture, aperture, fext):
+        """Запись метаданных файла с номером fileId.
+        md          - экземпляр pstat_extract.photo_metadata;
+        naperture   - нормализованное значение диафрагмы;
+        aperture    - исходное значение диафрагмы (см.
+                      AggregateStatistics.add_photo_metadata());
+        fext        - расширение файла в нижнем регистре."""
+
+        self.valid[fileId] = 1
+
+        self.focal[fileId] = md.focal
+        self.naperture[fileId] = naperture
+        self.iso[fileId] = md.iso
+        self.exposure[fileId] = md.exposure
+
+        self.year[fileId] = md.year if md.year is not None and md.month is not None else 0
+        self.month[fileId] = md.month if md.year is not None and md.month is not None else 0
+        self.date[fileId] = md.date.toordinal() if md.date is not None else 0
+
+        self.camera[fileId] = self.cameras.get_code(md.camera)
+        self.lens[fileId] = self.lenses.get_code(md.lens)
+        self.ext[fileId] = self.exts.get_code(fext)
+
+        if naperture not in self.apertureValues:
+            self.apertureValues[naperture] = aperture
+
+    def remap(self, idMap):
+        """Удаление строк удалённых файлов (см. BucketIndex.remap())."""
+
+        keep = array('b', map(ge, idMap, repeat(0)))
+
+        self.valid = bytearray(compress(self.valid, keep))
+
+        for name, tcode in self.COLUMNS:
+            setattr(self, name, array(tcode, compress(getattr(self, name), keep)))
+
+    def extend(self, other):
+        """Добавление в конец всех строк другого экземпляра PhotoTable
+        (см. pstat_paths.PathTable.extend())."""
+
+        self.valid.extend(other.valid)
+
+        for name, tcode in self.COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+        # коды строк в other - коды строк в self
+        nrows = len(other)
+
+        for name, codes, ocodes in (('camera', self.cameras, other.cameras),
+                ('lens', self.lenses, other.lenses),
+                ('ext', self.exts, other.exts)):
+            codeMap = list(map(codes.get_code, ocodes.values))
+
+            # если строк не было вовсе - в other одни нулевые коды
+            # у строк без метаданных, перекодировать нечего
+            if nrows and codeMap:
+                col = getattr(self, name)
+                start = len(col) - nrows
+                col[start:] = array('i', map(codeMap.__getitem__, col[start:]))
+
+        for naperture, aperture in other.apertureValues.items():
+            self.apertureValues.setdefault(naperture, aperture)
+
+    def __repr__(self):
+        return '%s(rows=%d, valid=%d, cameras=%d, lenses=%d)' % (self.__class__.__name__,
+            len(self.valid), sum(self.valid), len(self.cameras.values), len(self.lenses.values))
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    bi = BucketIndex()
+    for fileId, focal in ((3, 50), (1, 50), (2, 85), (0, 50)):
+        bi.add_file(fileId, focal, 0, 2021, 1 + fileId, 100)
+
+    bi.finish()
+    print(bi)
+    print(bi.get_file_ids(BUCKET_FA, lambda key: key[0] == 50))
+    print(bi.get_file_ids(BUCKET_DATE))
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_manifest.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Список файлов архива из готового файла-"манифеста" вместо просмотра
+# каталогов - если такие списки и так составляются регулярно (напр.
+# по ночам), повторно обходить миллионы каталогов незачем.
+#
+# Поддерживаемые форматы (определяются автоматически, по содержимому):
+# - mlocate.db (база updatedb из пакета mlocate);
+# - вывод find -print / -print0 (по пути в строке или через '\0');
+# - вывод find -printf с колонками, разделёнными табуляцией, где путь -
+#   последняя колонка, а перед ним в любом порядке могут быть тип файла
+#   (%y - буква), размер (%s - целое число) и время изменения (%T@ -
+#   число с дробной частью), напр. find . -printf '%y\t%s\t%T@\t%p\n';
+# - вывод rsync --list-only (права, размер, дата, время, путь).
+# Файлы манифестов могут быть сжаты gzip, bzip2 или xz. Строки, которые
+# не удалось разобрать, пропускаются.
+#
+# Относительные пути считаются относительными каталога с фотографиями,
+# файлы вне этого каталога пропускаются. Если тип элемента в манифесте
+# не указан, строка каталога распознаётся по тому, что следующая строка -
+# файл из этого каталога (как в выводе find).
+
+
+import os, os.path
+import re
+import gzip
+import bz2
+import lzma
+import struct
+from time import mktime
+
+from pstat_walk import is_excluded_dir, remove_paired_raws
+
+
+# размер блока при чтении манифеста
+CHUNK_SIZE = 1024 * 1024
+
+MLOCATE_MAGIC = b'\0mlocate'
+
+# сигнатуры сжатых файлов и функции для их открытия
+COMPRESSED_FORMATS = ((b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open))
+
+# строка вывода rsync --list-only:
+# "-rw-r--r--      1,234,567 2021/05/01 12:34:56 path"
+RSYNC_LINE = re.compile(rb'([-dlcbps])[-rwxsStT]{9}\s+([\d,.]+)\s+(\d{4})/(\d\d)/(\d\d)\s+(\d\d):(\d\d):(\d\d)\s(.+)')
+
+# числовые колонки перед путём в выводе find -printf: целое число -
+# размер (%s), число с дробной частью - время изменения (%T@)
+NUMBER_COLUMN = re.compile(rb'\d+(\.\d*)?')
+
+
+# признаки путей, требующих нормализации ("/./", "/../", "//")
+SEP_DOT = os.sep + '.'
+SEP_SEP = os.sep + os.sep
+
+
+class ManifestError(Exception):
+    pass
+
+
+def open_manifest(fname):
+    """Открытие файла манифеста (в т.ч. сжатого) для чтения
+    в двоичном режиме."""
+
+    with open(fname, 'rb') as f:
+        magic = f.read(8)
+
+    for signature, opener in COMPRESSED_FORMATS:
+        if magic.startswith(signature):
+            return opener(fname, 'rb')
+
+    return open(fname, 'rb')
+
+
+class ManifestReader():
+    """Разбор манифеста.
+
+    Генератор entries() возвращает для каждого элемента манифеста кортежи
+    из четырёх элементов:
+    1. путь (bytes, как в манифесте);
+    2. размер файла в байтах (0 - неизвестен);
+    3. время изменения файла (None - неизвестно);
+    4. тип элемента: 'f' - файл, 'd' - каталог, прочие буквы - прочие
+       типы (как у find -printf '%y'), None - неизвестен."""
+
+    def __init__(self, f):
+        """f - файловый объект, открытый для чтения в двоичном режиме."""
+
+        self.f = f
+
+        # данные, уже прочитанные при определении формата
+        self.head = f.read(CHUNK_SIZE)
+
+    def entries(self):
+        if self.head.startswith(MLOCATE_MAGIC):
+            return self.__mlocate_entries()
+
+        # find -print0
+        sep = b'\0' if b'\0' in self.head.split(b'\n', 1)[0] else b'\n'
+
+        return self.__text_entries(sep)
+
+    def __records(self, sep):
+        buf = self.head
+
+        while True:
+            records = buf.split(sep)
+            buf = records.pop()
+
+            yield from records
+
+            chunk = self.f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+
+            buf += chunk
+
+        if buf:
+            yield buf
+
+    def __text_entries(self, sep):
+        for rec in self.__records(sep):
+            rec = rec.rstrip(b'\r\n') if sep == b'\n' else rec
+            if not rec:
+                continue
+
+            rm = RSYNC_LINE.fullmatch(rec)
+            if rm is not None:
+                ftype, size, year, month, day, hour, minute, second, fpath = rm.groups()
+
+                try:
+                    size = int(size.replace(b',', b'').replace(b'.', b''))
+                    mtime = mktime((int(year), int(month), int(day), int(hour), int(minute), int(second), 0, 0, -1))
+                except (ValueError, OverflowError):
+                    continue
+
+                yield (fpath, size, mtime, 'f' if ftype == b'-' else ftype.decode())
+                continue
+
+            # колонки find -printf: тип, размер и время - в любом
+            # порядке и сочетании перед путём (путь может содержать
+            # табуляцию); колонка, повторяющая уже встреченную, - начало пути
+            ftype = None
+            size = None
+            mtime = None
+
+            cols = rec.split(b'\t', 3)
+            ncols = 0
+
+            for col in cols[:-1]:
+                nm = NUMBER_COLUMN.fullmatch(col)
+
+                if len(col) == 1 and col.isalpha() and ftype is None:
+                    ftype = col.decode()
+                elif nm is None:
+                    break
+                elif nm.group(1) is None and size is None:
+                    size = int(col)
+                elif nm.group(1) is not None and mtime is None:
+                    mtime = float(col)
+                else:
+                    break
+
+                ncols += 1
+
+            fpath = b'\t'.join(cols[ncols:])
+            if not fpath:
+                continue
+
+            yield (fpath, size or 0, mtime, ftype)
+
+    def __mlocate_entries(self):
+        # формат mlocate.db (числа - big endian):
+        # заголовок: сигнатура, размер блока настроек (4 байта), версия (1),
+        # флаг видимости (1), выравнивание (2), корневой каталог (строка
+        # с '\0' в конце), блок настроек;
+        # далее каталоги: время изменения (8 + 4 байта), выравнивание (4),
+        # путь каталога (строка), элементы: тип (1 байт: 0 - файл,
+        # 1 - каталог, 2 - конец списка), имя (строка) - кроме типа 2
+        data = self.head
+        pos = 0
+
+        def read_more():
+            nonlocal data, pos
+
+            chunk = self.f.read(CHUNK_SIZE)
+            if not chunk:
+                raise ManifestError('неожиданный конец файла базы mlocate')
+
+            data = data[pos:] + chunk
+            pos = 0
+
+        def read_bytes(n):
+            nonlocal pos
+
+            while len(data) - pos < n:
+                read_more()
+
+            pos += n
+            return data[pos - n:pos]
+
+        def read_str():
+            nonlocal pos
+
+            while True:
+                end = data.find(b'\0', pos)
+                if end >= 0:
+                    break
+
+                read_more()
+
+            s = data[pos:end]
+            pos = end + 1
+            return s
+
+        hdr = read_bytes(16)
+        confSize, version = struct.unpack('>IB', hdr[8:13])
+        if version != 0:
+            raise ManifestError('неподдерживаемая версия базы mlocate - %d' % version)
+
+        read_str()
+        read_bytes(confSize)
+
+        while True:
+            # конец файла допустим только между каталогами
+            if pos >= len(data):
+                chunk = self.f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                data = chunk
+                pos = 0
+
+            read_bytes(16)
+            dirpath = read_str()
+
+            while True:
+                etype = read_bytes(1)[0]
+                if etype == 2:
+                    break
+
+                name = read_str()
+
+                yield (os.path.join(dirpath, name), 0, None, 'd' if etype == 1 else 'f')
+
+
+class ManifestWalker():
+    """Список файлов из манифеста вместо обхода дерева каталогов.
+
+    Интерфейс - как у pstat_walk.DirWalker (метод walk()), исключение
+    каталогов (excludeDirs) и пары RAW+JPEG (pairRawExts) - тоже; пары
+    ищутся, только если в манифесте есть время изменения файлов.
+    Время изменения в списках файлов не передаётся (0 - неизвестно):
+    в манифестах оно неточное, а его сравнивают с os.stat().st_mtime_ns.
+    Ссылки не распознаются - в манифесте о них ничего нет.
+
+    Каталог, файлы которого идут в манифесте не подряд, возвращается
+    walk() несколько раз (см. PhotoStatistics.gather_photo_statistics())."""
+
+    def __init__(self, fname, excludeDirs=(), pairRawExts=None):
+        """fname        - путь к файлу манифеста;
+        excludeDirs     - последовательность шаблонов имён пропускаемых
+                          каталогов;
+        pairRawExts     - None или множество расширений RAW-файлов
+                          (в нижнем регистре) для поиска пар RAW+JPEG."""
+
+        self.fname = fname
+        self.excludeDirs = tuple(excludeDirs)
+        self.pairRawExts = pairRawExts
+
+    def __is_excluded(self, dirpath, top, cache):
+        # каталог пропускается, если он сам или один из родительских
+        # каталогов (до top) соответствует шаблону
+        r = cache.get(dirpath)
+
+        if r is None:
+            if dirpath == top:
+                r = False
+            else:
+                r = self.__is_excluded(os.path.dirname(dirpath), top, cache) or \
+                    is_excluded_dir(self.excludeDirs, os.path.basename(dirpath), os.path.relpath(dirpath, top))
+
+            cache[dirpath] = r
+
+        return r
+
+    def __dir_tuple(self, dirpath, nfiles, files, mtimes):
+        npaired = 0
+
+        if self.pairRawExts and len(files) > 1:
+            files, npaired = remove_paired_raws(files, mtimes, self.pairRawExts)
+
+        return (dirpath, nfiles, files, npaired, 0)
+
+    def walk(self, top, ftypes):
+        """Генератор, возвращающий кортежи, как у DirWalker.walk(),
+        для файлов из манифеста, находящихся в каталоге top.
+        В случае ошибки чтения манифеста генерирует исключение
+        ManifestError."""
+
+        top = os.path.normpath(top)
+        prefix = os.path.join(top, '')
+        excluded = {}
+
+        # файлы каталога curDir, идущие в манифесте подряд
+        curDir = None
+        curExcluded = False
+        nfiles = 0
+        files = []
+        mtimes = []
+
+        # предыдущий файл - если это мог быть каталог (тип не известен)
+        prevPath = None
+
+        try:
+            with open_manifest(self.fname) as f:
+                for fpath, size, mtime, ftype in ManifestReader(f).entries():
+                    if ftype == 'd':
+                        continue
+
+                    # записей - миллионы, потому os.path.normpath() и т.п.
+                    # вызываются, только когда без них не обойтись
+                    if fpath.startswith(b'./'):
+                        fpath = fpath[2:]
+
+                    fpath = os.fsdecode(fpath)
+
+                    if not fpath.startswith(os.sep):
+                        fpath = prefix + fpath
+
+                    if SEP_DOT in fpath or SEP_SEP in fpath or fpath.endswith(os.sep):
+                        fpath = os.path.normpath(fpath)
+
+                    if not fpath.startswith(prefix):
+                        continue
+
+                    ix = fpath.rfind(os.sep)
+                    dirpath = fpath[:ix]
+                    fname = fpath[ix + 1:]
+
+                    if dirpath == prevPath and nfiles:
+                        # предыдущая строка - каталог, а не файл
+                        nfiles -= 1
+
+                    if dirpath != curDir:
+                        if nfiles:
+                            yield self.__dir_tuple(curDir, nfiles, files, mtimes)
+
+                        curDir = dirpath
+                        curExcluded = self.excludeDirs and self.__is_excluded(dirpath, top, excluded)
+                        nfiles = 0
+                        files = []
+                        mtimes = []
+
+                    prevPath = None
+
+                    if curExcluded:
+                        continue
+
+                    nfiles += 1
+
+                    ix = fname.rfind('.')
+
+                    if ix > 0 and fname[ix:].lower() in ftypes:
+                        files.append((fname, size, 0))
+                        mtimes.append(mtime)
+                    elif ftype is None:
+                        prevPath = fpath
+
+        except (OSError, EOFError, ValueError, lzma.LZMAError) as ex:
+            raise ManifestError('Ошибка чтения файла "%s" - %s' % (self.fname, ex))
+
+        if nfiles:
+            yield self.__dir_tuple(curDir, nfiles, files, mtimes)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    import sys
+
+    ndirs = nfiles = nfound = 0
+
+    for dirpath, n, files, npaired, nlinked in ManifestWalker(sys.argv[1], pairRawExts={'.nef'}).walk(sys.argv[2], {'.jpg', '.nef'}):
+        ndirs += 1
+        nfiles += n
+        nfound += len(files)
+
+    print('dirs: %d, files: %d, found: %d' % (ndirs, nfiles, nfound))
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_mdcache.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Общий кэш метаданных, который могут одновременно использовать
+# несколько экземпляров PhotoStat (в т.ч. на разных машинах, если
+# каталог кэша - на общем хранилище): метаданные, извлечённые одним
+# экземпляром, не извлекаются повторно остальными.
+#
+# Кэш - каталог с файлами в формате JSON Lines:
+# - base.mdc - основной файл;
+# - *.seg - "сегменты" с новыми записями; каждый экземпляр пишет
+#   собственные сегменты (во временный файл, затем переименовывая его),
+#   т.е. сегменты появляются целиком и больше не изменяются, и блокировки
+#   при записи не нужны (SQLite в режиме WAL на сетевых ФС не работает);
+# - compact.lock - блокировка на время слияния ("уплотнения") сегментов
+#   с основным файлом, когда сегментов становится слишком много.
+#
+# Записи ищутся не по полному пути, а по имени, размеру и времени
+# изменения файла (с точностью до наносекунд - у несжатых RAW-файлов
+# размер одинаков) - на разных машинах архив может быть смонтирован
+# в разные каталоги, а копии файла (с тем же временем изменения)
+# и так содержат те же метаданные.
+
+
+import os, os.path
+import sys
+import json
+import socket
+import datetime
+from time import time, monotonic
+from collections import deque
+
+from pstat_common import *
+from pstat_extract import MetadataExtractor, photo_metadata
+
+
+CACHE_FORMAT = '# PhotoStat metadata cache 1\n'
+
+BASE_FILE = 'base.mdc'
+SEGMENT_EXT = '.seg'
+TEMP_EXT = '.tmp'
+LOCK_FILE = 'compact.lock'
+
+# новые записи сохраняются в сегмент, когда их накопится столько,
+# или через столько секунд после сохранения предыдущего сегмента
+FLUSH_RECORDS = 2000
+FLUSH_INTERVAL = 60.0
+
+# сегменты сливаются с основным файлом, когда их становится столько
+COMPACT_SEGMENTS = 32
+
+# блокировка старше стольки секунд считается оставшейся от рухнувшего
+# процесса, временные файлы - тоже
+STALE_LOCK_AGE = 600.0
+STALE_TEMP_AGE = 86400.0
+
+# сегменты, записанные другими экземплярами, загружаются не чаще
+REFRESH_INTERVAL = 60.0
+
+
+class MetadataCache():
+    """Кэш метаданных в каталоге dirname.
+
+    Поля:
+        dirname - путь к каталогу кэша;
+        entries - словарь, где ключи - кортежи (имя файла, размер,
+                  время изменения в наносекундах), а значения - кортежи
+                  значений полей photo_metadata (см. get())."""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.entries = {}
+
+        # загруженные сегменты и признаки загруженного основного файла
+        self.segments = set()
+        self.baseSignature = None
+        self.refreshed = None
+
+        # записи, ещё не сохранённые в сегмент
+        self.pending = []
+        self.flushed = monotonic()
+        self.nflushes = 0
+
+        # после ошибки записи новые записи не сохраняются
+        self.writable = True
+
+        # одинаковые строки (названия камер и объективов) храним в одном экземпляре
+        self.strings = {}
+
+    @staticmethod
+    def get_key(fpath, size=0, mtime=0):
+        """Возвращает ключ для поиска файла fpath в кэше, или None,
+        если файл недоступен.
+        size, mtime - размер файла и время его изменения в наносекундах,
+        если известны по данным поиска файлов (иначе - 0, и вызывается
+        os.stat())."""
+
+        if not mtime:
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                return
+
+            size = st.st_size
+            mtime = st.st_mtime_ns
+
+        return (os.path.basename(fpath), size, mtime)
+
+    def get(self, key):
+        """Возвращает экземпляр photo_metadata для ключа key,
+        или None, если в кэше его нет."""
+
+        v = self.entries.get(key)
+        if v is None:
+            return
+
+        focal, aperture, iso, exposure, date, camera, lens = v
+
+        if date:
+            date = datetime.datetime.fromisoformat(date)
+            year = date.year
+            month = date.month
+        else:
+            date = year = month = None
+
+        return photo_metadata(focal, aperture, iso, year, month, exposure, date, camera, lens)
+
+    def add(self, key, md):
+        """Добавление метаданных md (экземпляра photo_metadata)
+        файла с ключом key."""
+
+        v = (md.focal, md.aperture, md.iso, md.exposure,
+            md.date.isoformat() if md.date is not None else None,
+            md.camera, md.lens)
+
+        self.entries[key] = v
+
+        if self.writable:
+            self.pending.append(key + v)
+
+            if len(self.pending) >= FLUSH_RECORDS or monotonic() - self.flushed >= FLUSH_INTERVAL:
+                self.flush()
+
+    def __error(self, msg, ex):
+        print('%s "%s" - %s' % (msg, self.dirname, exception_to_str(ex)), file=sys.stderr)
+
+    def __load_file(self, fpath):
+        # FileNotFoundError - вызывающей стороне
+        with open(fpath, 'r', encoding='utf-8') as f:
+            if f.readline() != CACHE_FORMAT:
+                print('Файл "%s" - не кэш метаданных или неподдерживаемая версия' % fpath, file=sys.stderr)
+                return
+
+            for s in f:
+                try:
+                    name, size, mtime, focal, aperture, iso, exposure, date, camera, lens = json.loads(s)
+                except (ValueError, TypeError):
+                    continue
+
+                self.entries[(name, size, mtime)] = (focal, aperture, iso, exposure, date,
+                    self.strings.setdefault(camera, camera),
+                    self.strings.setdefault(lens, lens))
+
+    def refresh(self, force=False):
+        """Загрузка сегментов, записанных другими экземплярами после
+        предыдущего вызова (не чаще раза в REFRESH_INTERVAL секунд,
+        если force == False), и основного файла, если он изменился."""
+
+        if not force and self.refreshed is not None and monotonic() - self.refreshed < REFRESH_INTERVAL:
+            return
+
+        self.refreshed = monotonic()
+
+        try:
+            names = {fn for fn in os.listdir(self.dirname) if fn.endswith(SEGMENT_EXT)}
+        except FileNotFoundError:
+            return
+        except OSError as ex:
+            self.__error('Ошибка чтения каталога кэша метаданных', ex)
+            return
+
+        # сегменты загружаются до основного файла: сегмент, удалённый
+        # при уплотнении после получения списка, уже есть в новом
+        # основном файле, который и будет загружен ниже
+        for fn in sorted(names - self.segments):
+            try:
+                self.__load_file(os.path.join(self.dirname, fn))
+            except FileNotFoundError:
+                continue
+            except (OSError, UnicodeError) as ex:
+                self.__error('Ошибка чтения кэша метаданных', ex)
+                continue
+
+            self.segments.add(fn)
+
+        # удалённые при уплотнении больше не появятся
+        self.segments &= names
+
+        fpath = os.path.join(self.dirname, BASE_FILE)
+
+        try:
+            st = os.stat(fpath)
+            signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+            if signature != self.baseSignature:
+                self.__load_file(fpath)
+                self.baseSignature = signature
+
+        except FileNotFoundError:
+            pass
+        except (OSError, UnicodeError) as ex:
+            self.__error('Ошибка чтения кэша метаданных', ex)
+
+    def __write_file(self, fpath, records):
+        # файл появляется под своим именем только целиком
+        tmpPath = fpath + TEMP_EXT
+
+        try:
+            with open(tmpPath, 'w', encoding='utf-8') as f:
+                f.write(CACHE_FORMAT)
+
+                for r in records:
+                    f.write(json.dumps(r, separators=(',', ':')))
+                    f.write('\n')
+
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(tmpPath, fpath)
+
+        except Exception:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+
+            raise
+
+    def flush(self):
+        """Сохранение новых записей в сегмент (короткая "транзакция" -
+        запись одного небольшого файла)."""
+
+        self.flushed = monotonic()
+
+        if not self.pending:
+            return
+
+        self.nflushes += 1
+
+        # имя уникально для машины, процесса и сохранения
+        fn = '%s-%d-%d-%d%s' % (socket.gethostname(), os.getpid(), int(time()), self.nflushes, SEGMENT_EXT)
+
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+            self.__write_file(os.path.join(self.dirname, fn), self.pending)
+
+        except (OSError, UnicodeError) as ex:
+            self.__error('Ошибка записи кэша метаданных', ex)
+            self.writable = False
+
+        else:
+            self.segments.add(fn)
+
+        self.pending.clear()
+
+    def __lock(self):
+        lockPath = os.path.join(self.dirname, LOCK_FILE)
+
+        try:
+            os.close(os.open(lockPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+
+        except FileExistsError:
+            # блокировка рухнувшего процесса снимается, но уплотнением
+            # займётся следующий экземпляр - вдруг её кто-то уже снял
+            # и успел поставить свою
+            try:
+                if time() - os.stat(lockPath).st_mtime > STALE_LOCK_AGE:
+                    os.remove(lockPath)
+            except OSError:
+                pass
+
+        return False
+
+    def __remove_stale_temp_files(self):
+        now = time()
+
+        for fn in os.listdir(self.dirname):
+            if fn.endswith(TEMP_EXT):
+                fpath = os.path.join(self.dirname, fn)
+
+                try:
+                    if now - os.stat(fpath).st_mtime > STALE_TEMP_AGE:
+                        os.remove(fpath)
+                except OSError:
+                    pass
+
+    def compact(self, force=False):
+        """Слияние сегментов с основным файлом, если их не меньше
+        COMPACT_SEGMENTS (или есть хоть один, если force == True)
+        и никто другой уже не занимается тем же."""
+
+        if not self.writable:
+            return
+
+        self.flush()
+        self.refresh(True)
+
+        if len(self.segments) < (1 if force else COMPACT_SEGMENTS) or not self.__lock():
+            return
+
+        try:
+            # после захвата блокировки - ещё раз, т.к. основной файл мог
+            # только что смениться
+            self.refresh(True)
+
+            segments = list(self.segments)
+            fpath = os.path.join(self.dirname, BASE_FILE)
+
+            self.__write_file(fpath, (k + v for k, v in self.entries.items()))
+
+            st = os.stat(fpath)
+            self.baseSignature = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+            # все записи удаляемых сегментов - уже в основном файле
+            for fn in segments:
+                try:
+                    os.remove(os.path.join(self.dirname, fn))
+                except FileNotFoundError:
+                    pass
+
+            self.segments.difference_update(segments)
+
+            self.__remove_stale_temp_files()
+
+        except (OSError, UnicodeError) as ex:
+            self.__error('Ошибка уплотнения кэша метаданных', ex)
+
+        finally:
+            try:
+                os.remove(os.path.join(self.dirname, LOCK_FILE))
+            except OSError:
+                pass
+
+    def close(self):
+        self.compact()
+
+    def __repr__(self):
+        return '%s(dirname="%s", entries=%d, segments=%d)' % (self.__class__.__name__,
+            self.dirname, len(self.entries), len(self.segments))
+
+
+class CachedExtractor(MetadataExtractor):
+    """Извлечение метаданных с использованием кэша: метаданные
+    файлов, найденных в кэше (экземпляре MetadataCache), берутся
+    из него, остальные файлы передаются экстрактору fallback,
+    а полученные от него метаданные добавляются в кэш."""
+
+    # сколько результатов из кэша может накопиться, пока fallback
+    # ждёт очередной файл для чтения (см. process())
+    RESULTS_BATCH = 256
+
+    def __init__(self, fallback, cache):
+        # до вызова конструктора предка - см. свойство profiler
+        self.fallback = fallback
+
+        super().__init__(fallback.quarantine)
+
+        self.cache = cache
+
+        # счётчики файлов, метаданные которых взяты из кэша
+        # и переданных экстрактору fallback
+        self.nFromCache = 0
+        self.nFallback = 0
+
+    @property
+    def profiler(self):
+        return self.fallback.profiler
+
+    @profiler.setter
+    def profiler(self, v):
+        self.fallback.profiler = v
+
+    @property
+    def pace(self):
+        return self.fallback.pace
+
+    @pace.setter
+    def pace(self, v):
+        self.fallback.pace = v
+
+    @property
+    def fileStat(self):
+        return self.fallback.fileStat
+
+    @fileStat.setter
+    def fileStat(self, v):
+        self.fallback.fileStat = v
+
+    def is_cached(self, fpath):
+        self.cache.refresh()
+
+        key = self.cache.get_key(fpath)
+
+        return key is not None and key in self.cache.entries
+
+    def process(self, items):
+        self.cache.refresh()
+
+        # как в pstat_catalog.CatalogExtractor - файлы, которых нет
+        # в кэше, передаются экстрактору fallback по мере перебора,
+        # результаты из кэша возвращаются между его результатами
+        known = deque()
+
+        # ключи кэша для файлов, переданных fallback (и ещё
+        # не обработанных): ключи - fileId, значения - ключи кэша
+        keys = {}
+
+        def unknown_items():
+            for item in items:
+                if item is None:
+                    yield None
+                    continue
+
+                fileId, fpath = item
+                # размер и время изменения - по данным поиска файлов,
+                # если они известны (см. MetadataExtractor.fileStat)
+                key = self.cache.get_key(fpath, *(self.fileStat(fileId) if self.fileStat is not None else ()))
+                md = self.cache.get(key) if key is not None else None
+
+                if md is not None:
+                    self.nFromCache += 1
+                    known.append((fileId, md, self.STATUS_OK, 0.0))
+
+                    if len(known) >= self.RESULTS_BATCH:
+                        yield None
+                else:
+                    self.nFallback += 1
+
+                    if key is not None:
+                        keys[fileId] = key
+
+                    yield item
+
+        try:
+            for r in self.fallback.process(unknown_items()):
+                while known:
+                    yield known.popleft()
+
+                if r is not None:
+                    fileId, md, status, seconds = r
+                    key = keys.pop(fileId, None)
+
+                    # файлы без метаданных не кэшируются - причиной
+                    # может быть и временная ошибка чтения
+                    if md is not None and key is not None:
+                        self.cache.add(key, md)
+
+                yield r
+
+            while known:
+                yield known.popleft()
+
+        finally:
+            # дабы другим экземплярам не ждать следующего сбора статистики
+            self.cache.flush()
+
+    def get_tuned_workers(self):
+        return self.fallback.get_tuned_workers()
+
+    def close(self):
+        self.cache.close()
+        self.fallback.close()
+
+
+def create_cached_extractor(fallback, dirname):
+    """Возвращает экземпляр CachedExtractor, использующий кэш
+    в каталоге dirname и экстрактор fallback для прочих файлов."""
+
+    return CachedExtractor(fallback, MetadataCache(dirname))
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    cache = MetadataCache(sys.argv[1])
+    cache.refresh()
+
+    print(cache)
+
+    for key in list(cache.entries)[:10]:
+        print(key, cache.get(key))
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_memprof.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os
+import tracemalloc
+from threading import Thread, Event, Lock
+from time import perf_counter
+
+
+def get_rss():
+    """Возвращает текущий размер резидентной памяти процесса (RSS)
+    в байтах или None, если его не узнать (не Linux)."""
+
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class MemoryProfiler():
+    """Диагностика расхода памяти при сборе статистики.
+
+    На границах стадий (см. stage() и wrap_stagedisp()) делаются снимки
+    tracemalloc, и для каждой стадии запоминаются: объём памяти,
+    выделенной питоном, в конце стадии и пиковый, места размещения
+    с наибольшим приростом за стадию, а также RSS процесса в начале,
+    в конце и пиковый (RSS опрашивается отдельным потоком каждые
+    interval секунд - в т.ч. и память, выделенная в обход питона,
+    напр. GExiv2 и GTK).
+
+    В отличие от ScanProfiler, отслеживание размещений tracemalloc
+    замедляет работу в разы, т.е. включать только для диагностики."""
+
+    class StageRecord():
+        def __init__(self, name):
+            self.name = name
+            self.seconds = 0.0
+
+            # объём памяти, выделенной питоном (tracemalloc), в конце
+            # стадии, изменение за стадию и пиковый
+            self.traced = 0
+            self.tracedDelta = 0
+            self.tracedPeak = 0
+
+            # RSS в начале, в конце и пиковый (None - неизвестно)
+            self.rssStart = None
+            self.rssEnd = None
+            self.rssPeak = None
+
+            # список экземпляров tracemalloc.StatisticDiff - места
+            # размещения с наибольшим приростом за стадию
+            self.topGrowth = []
+
+    def __init__(self, topN=10, nframes=1, interval=0.05):
+        """topN     - количество мест размещения в отчёте по каждой стадии;
+        nframes     - глубина стека, запоминаемая tracemalloc для каждого
+                      размещения (1 - только строка, где выделена память);
+        interval    - период опроса RSS в секундах."""
+
+        self.topN = topN
+        self.nframes = nframes
+        self.interval = interval
+
+        # список экземпляров StageRecord - завершённые стадии
+        self.stages = []
+
+        # текущая стадия (StageRecord) и данные на её начало
+        self.curStage = None
+        self.curStart = 0.0
+        self.curSnapshot = None
+
+        # места размещения с наибольшим объёмом занятой памяти
+        # (tracemalloc.Statistic) на момент вызова finish()
+        self.topFinal = []
+        self.tracedFinal = 0
+
+        self.startedTracing = False
+
+        self.rssLock = Lock()
+        self.rssPeak = None
+        self.stopSampling = Event()
+        self.samplerThread = None
+
+    def __sample_rss(self):
+        while not self.stopSampling.wait(self.interval):
+            self.__update_rss_peak()
+
+    def __update_rss_peak(self):
+        rss = get_rss()
+        if rss is None:
+            return None
+
+        with self.rssLock:
+            if self.rssPeak is None or rss > self.rssPeak:
+                self.rssPeak = rss
+
+        return rss
+
+    def __take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>')))
+
+    def start(self):
+        """Начало отслеживания (до начала первой стадии)."""
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+            self.startedTracing = True
+
+        self.stopSampling.clear()
+        self.samplerThread = Thread(target=self.__sample_rss, daemon=True)
+        self.samplerThread.start()
+
+    def __finish_stage(self, snapshot):
+        st = self.curStage
+        if st is None:
+            return
+
+        st.seconds = perf_counter() - self.curStart
+
+        st.traced, st.tracedPeak = tracemalloc.get_traced_memory()
+        st.rssEnd = self.__update_rss_peak()
+
+        with self.rssLock:
+            st.rssPeak = self.rssPeak
+
+        diff = snapshot.compare_to(self.curSnapshot, 'lineno')
+        st.tracedDelta = sum(map(lambda sd: sd.size_diff, diff))
+        st.topGrowth = [sd for sd in diff[:self.topN] if sd.size_diff > 0]
+
+        self.stages.append(st)
+        self.curStage = None
+
+    def stage(self, name):
+        """Завершение текущей стадии (если есть) и начало стадии name."""
+
+        snapshot = self.__take_snapshot()
+        self.__finish_stage(snapshot)
+
+        st = self.StageRecord(name)
+        st.rssStart = self.__update_rss_peak()
+
+        # пиковые значения считаем для каждой стадии отдельно
+        with self.rssLock:
+            self.rssPeak = st.rssStart
+
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        self.curStage = st
+        self.curSnapshot = snapshot
+        self.curStart = perf_counter()
+
+    def wrap_stagedisp(self, stagedisp):
+        """Возвращает функцию для передачи в параметре stagedisp
+        метода PhotoStatistics.gather_photo_statistics(), которая
+        начинает новую стадию и вызывает stagedisp (если это не None)."""
+
+        def stage_changed(msg):
+            self.stage(msg)
+
+            if stagedisp:
+                stagedisp(msg)
+
+        return stage_changed
+
+    def finish(self):
+        """Завершение последней стадии и отслеживания."""
+
+        snapshot = self.__take_snapshot()
+        self.__finish_stage(snapshot)
+
+        self.stopSampling.set()
+        if self.samplerThread is not None:
+            self.samplerThread.join()
+            self.samplerThread = None
+
+        stats = snapshot.statistics('lineno')
+        self.tracedFinal = sum(map(lambda s: s.size, stats))
+        self.topFinal = stats[:self.topN]
+
+        self.curSnapshot = None
+
+        if self.startedTracing:
+            tracemalloc.stop()
+            self.startedTracing = False
+
+    @staticmethod
+    def __size_str(size, signed=False):
+        if size is None:
+            return 'н/д'
+
+        sign = ('+' if size >= 0 else '-') if signed else ('-' if size < 0 else '')
+        size = abs(size)
+
+        if size < 1024:
+            return '%s%d Б' % (sign, size)
+        elif size < 1024 * 1024:
+            return '%s%.1f КиБ' % (sign, size / 1024)
+        elif size < 1024 * 1024 * 1024:
+            return '%s%.1f МиБ' % (sign, size / (1024 * 1024))
+        else:
+            return '%s%.2f ГиБ' % (sign, size / (1024 * 1024 * 1024))
+
+    @staticmethod
+    def __trace_str(traceback):
+        frame = traceback[0]
+
+        return '%s:%d' % (frame.filename, frame.lineno)
+
+    def get_report(self):
+        """Возвращает отчёт в виде строки."""
+
+        ret = ['Профилирование памяти', '']
+
+        for st in self.stages:
+            ret += ['Стадия "%s" (%.2f с):' % (st.name, st.seconds),
+                '  выделено питоном: в конце %s (%s), пик %s' % (self.__size_str(st.traced),
+                    self.__size_str(st.tracedDelta, True), self.__size_str(st.tracedPeak)),
+                '  RSS: в начале %s, в конце %s, пик %s' % (self.__size_str(st.rssStart),
+                    self.__size_str(st.rssEnd), self.__size_str(st.rssPeak))]
+
+            if st.topGrowth:
+                ret.append('  наибольший прирост:')
+
+                for sd in st.topGrowth:
+                    ret.append('    %12s  блоков: %+9d  %s' % (self.__size_str(sd.size_diff, True),
+                        sd.count_diff, self.__trace_str(sd.traceback)))
+
+            ret.append('')
+
+        if self.topFinal:
+            ret.append('Занято по окончании: %s, в т.ч.:' % self.__size_str(self.tracedFinal))
+
+            for s in self.topFinal:
+                ret.append('    %12s  блоков: %9d  %s' % (self.__size_str(s.size),
+                    s.count, self.__trace_str(s.traceback)))
+
+        return '\n'.join(ret)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    prof = MemoryProfiler(5)
+    prof.start()
+
+    prof.stage('список')
+    lst = [str(i) for i in range(200000)]
+
+    prof.stage('словарь')
+    d = dict.fromkeys(lst)
+
+    prof.stage('освобождение')
+    del lst, d
+
+    prof.finish()
+
+    print(prof.get_report())
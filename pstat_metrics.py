@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_metrics.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+import sys
+from time import time, monotonic
+
+from pstat_common import *
+
+
+class ScanMetrics():
+    """Экспорт счётчиков процесса сбора статистики в текстовом формате
+    Prometheus (для HTTP-сервиса и/или периодически перезаписываемого
+    файла, напр. для textfile collector у node_exporter).
+
+    Значения берутся непосредственно из счётчиков экземпляра
+    PhotoStatistics, т.е. экспорт не добавляет работы на каждый файл,
+    кроме проверки счётчика вызовов в wrap_progress()."""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    # проверяем, не пора ли перезаписать файл, раз в столько вызовов progressdisp
+    CHECK_EVERY = 256
+
+    def __init__(self, metricsFile=None, interval=10.0):
+        """metricsFile  - None или путь к файлу, который будет периодически
+                          перезаписываться (см. wrap_progress());
+        interval        - период перезаписи файла в секундах."""
+
+        self.metricsFile = metricsFile
+        self.interval = interval
+
+        # экземпляр PhotoStatistics, счётчики которого экспортируются
+        self.stats = None
+        self.scanning = False
+        self.scanStartTime = 0.0
+        self.scansCompleted = 0
+
+        self.nextWrite = 0.0
+        self.callCounter = 0
+
+    def scan_started(self, stats):
+        """Вызывается перед началом сбора статистики в stats
+        (экземпляр PhotoStatistics)."""
+
+        self.stats = stats
+        self.scanning = True
+        self.scanStartTime = time()
+        self.nextWrite = monotonic() + self.interval
+
+        self.write_file()
+
+    def scan_finished(self, stats=None):
+        """Вызывается после завершения сбора статистики.
+        stats - None или экземпляр PhotoStatistics, счётчики которого
+        следует экспортировать далее (если не тот, что в scan_started())."""
+
+        if stats is not None:
+            self.stats = stats
+
+        self.scanning = False
+        self.scansCompleted += 1
+
+        self.write_file()
+
+    def wrap_progress(self, progressdisp):
+        """Возвращает функцию для передачи в параметре progressdisp
+        метода PhotoStatistics.gather_photo_statistics(), которая
+        вызывает progressdisp (если это не None) и периодически
+        перезаписывает файл с метриками."""
+
+        def progress(sobj, fraction, msg):
+            self.callCounter += 1
+
+            if self.callCounter >= self.CHECK_EVERY:
+                self.callCounter = 0
+
+                if monotonic() >= self.nextWrite:
+                    self.nextWrite = monotonic() + self.interval
+                    self.write_file()
+
+            return progressdisp(sobj, fraction, msg) if progressdisp else True
+
+        return progress
+
+    def get_text(self):
+        """Возвращает метрики в текстовом формате Prometheus."""
+
+        ret = []
+
+        def add_metric(name, mtype, helpstr, values):
+            # values - список кортежей (метки, значение);
+            # метки - строка вида 'name="value"' или пустая строка
+            ret.append('# HELP photostat_%s %s' % (name, helpstr))
+            ret.append('# TYPE photostat_%s %s' % (name, mtype))
+
+            for labels, value in values:
+                ret.append('photostat_%s%s %s' % (name,
+                    '{%s}' % labels if labels else '', value))
+
+        add_metric('scan_running', 'gauge', 'Whether a scan is in progress.',
+            [('', 1 if self.scanning else 0)])
+        add_metric('scan_start_time_seconds', 'gauge', 'Start time of the last scan (unix time).',
+            [('', '%.3f' % self.scanStartTime)])
+        add_metric('scans_completed_total', 'counter', 'Number of completed scans.',
+            [('', self.scansCompleted)])
+
+        stats = self.stats
+        if stats is not None:
+            add_metric('generation', 'gauge', 'Statistics generation counter.',
+                [('', stats.generation)])
+            add_metric('files_seen_total', 'counter', 'Files seen during directory traversal.',
+                [('', stats.statTotalFiles)])
+            add_metric('files_discovered_total', 'counter', 'Files selected for metadata extraction.',
+                [('', stats.statFoundFiles)])
+            add_metric('files_processed_total', 'counter', 'Files with metadata extraction attempted.',
+                [('', stats.statProcessedFiles)])
+            add_metric('files_paired_total', 'counter', 'RAW files skipped as part of RAW+JPEG pairs.',
+                [('', stats.statPairedFiles)])
+            add_metric('files_duplicate_total', 'counter', 'Files skipped as copies of other files.',
+                [('', stats.statDuplicateFiles)])
+            add_metric('files_linked_total', 'counter', 'Files skipped as hard or symbolic links to files already selected.',
+                [('', stats.statLinkedFiles)])
+            add_metric('files_failed_total', 'counter', 'Files that could not be opened or had no EXIF.',
+                [('', stats.statFailedFiles)])
+            add_metric('files_quarantined_total', 'counter', 'Files skipped or aborted because of extractor hangs or crashes.',
+                [('', stats.statQuarantinedFiles)])
+            add_metric('photos_total', 'counter', 'Photos accounted in statistics.',
+                [('', stats.statTotalPhotos)])
+            add_metric('bytes_read_total', 'counter', 'Size of processed files (when known from traversal).',
+                [('', stats.statBytesRead)])
+            add_metric('queue_depth', 'gauge', 'Files waiting in the processing queue.',
+                [('queue="metadata"', max(0, stats.statFoundFiles - stats.statProcessedFiles))])
+            add_metric('files_processed_by_extension_total', 'counter', 'Processed files by extension.',
+                [('ext="%s"' % ext.replace('\\', '\\\\').replace('"', '\\"'), n) for ext, n in sorted(dict(stats.statProcessedByExt).items())])
+
+        ret.append('')
+
+        return '\n'.join(ret)
+
+    def write_file(self):
+        """Перезапись файла с метриками (если он указан).
+        Файл заменяется атомарно, дабы читатель не получил половину."""
+
+        if not self.metricsFile:
+            return
+
+        tmpname = '%s.tmp' % self.metricsFile
+
+        try:
+            with open(tmpname, 'w') as f:
+                f.write(self.get_text())
+
+            os.replace(tmpname, self.metricsFile)
+        except OSError as ex:
+            print('Не удалось записать файл метрик "%s" - %s' % (self.metricsFile,
+                exception_to_str(ex)), file=sys.stderr)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_paths.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+from array import array
+
+
+class PathTable():
+    """Компактная таблица путей к файлам.
+
+    Пути к каталогам хранятся в единственном экземпляре (в списке dirs),
+    для каждого файла хранится только номер каталога и имя файла.
+    Имена файлов хранятся подряд в одном bytearray, а номера каталогов
+    и смещения имён - в массивах array.array, т.е. без отдельного
+    питоньего объекта на каждый файл.
+
+    Полный путь к файлу собирается только по запросу (get_path()).
+
+    Номер файла (fileId) - порядковый номер добавления файла в таблицу,
+    начиная с 0. Номер каталога (dirId) - аналогично, для каталогов.
+    Номера каталогов не меняются до вызова clear(), номера файлов -
+    до вызова clear() или remove_dirs(), поэтому могут использоваться
+    в других структурах данных (кэшах, индексах и т.п.) вместо путей.
+    remove_dirs() сохраняет порядок оставшихся файлов, но сдвигает их
+    номера (таблица соответствия старых и новых номеров возвращается),
+    т.е. прежними остаются только номера файлов, добавленных раньше
+    первого удалённого."""
+
+    def __init__(self):
+        # пути каталогов; индекс в списке - dirId
+        self.dirs = []
+
+        # ключи - пути каталогов, значения - dirId
+        self.dirIndex = {}
+
+        # номера каталогов файлов; индекс в массиве - fileId
+        self.fileDirs = array('L')
+
+        # смещения имён файлов в self.names;
+        # имя файла N занимает names[nameOffsets[N]:nameOffsets[N + 1]]
+        self.nameOffsets = array('Q', [0])
+
+        # имена файлов (os.fsencode), без разделителей
+        self.names = bytearray()
+
+        # размеры файлов (0, если размер не известен при добавлении)
+        self.fileSizes = array('Q')
+
+        # время изменения файлов в наносекундах (как os.stat().st_mtime_ns;
+        # 0, если не известно при добавлении)
+        self.fileMtimes = array('q')
+
+    def clear(self):
+        self.dirs.clear()
+        self.dirIndex.clear()
+
+        del self.fileDirs[:]
+        del self.nameOffsets[1:]
+        del self.names[:]
+        del self.fileSizes[:]
+        del self.fileMtimes[:]
+
+    def add_dir(self, dirpath):
+        """Добавление каталога в таблицу (если его там ещё нет).
+        Возвращает dirId."""
+
+        dirId = self.dirIndex.get(dirpath)
+        if dirId is None:
+            dirId = len(self.dirs)
+            self.dirs.append(dirpath)
+            self.dirIndex[dirpath] = dirId
+
+        return dirId
+
+    def add_file(self, dirId, fname, size=0, mtime=0):
+        """Добавление файла с именем fname из каталога с номером dirId.
+        size, mtime - размер файла и время его изменения в наносекундах,
+        если известны (напр. из os.DirEntry).
+        Возвращает fileId."""
+
+        fileId = len(self.fileDirs)
+
+        self.fileDirs.append(dirId)
+        self.names += os.fsencode(fname)
+        self.nameOffsets.append(len(self.names))
+        self.fileSizes.append(size)
+        self.fileMtimes.append(mtime)
+
+        return fileId
+
+    def add_path(self, fpath, size=0, mtime=0):
+        """Добавление файла по полному пути. Возвращает fileId."""
+
+        dirpath, fname = os.path.split(fpath)
+
+        return self.add_file(self.add_dir(dirpath), fname, size, mtime)
+
+    def remove_dirs(self, dirIds):
+        """Удаление из таблицы всех файлов каталогов, номера которых
+        входят в множество dirIds.
+        Номера оставшихся файлов меняются (сдвигаются к началу, порядок
+        файлов сохраняется), номера каталогов - нет (каталоги из таблицы
+        не удаляются).
+
+        Возвращает None (если dirIds пустое) или массив, где индексы -
+        старые номера файлов, а значения - новые номера или -1
+        для удалённых файлов."""
+
+        if not dirIds:
+            return
+
+        idMap = array('q')
+
+        fileDirs = array('L')
+        nameOffsets = array('Q', [0])
+        names = bytearray()
+        fileSizes = array('Q')
+        fileMtimes = array('q')
+
+        for fileId, dirId in enumerate(self.fileDirs):
+            if dirId in dirIds:
+                idMap.append(-1)
+                continue
+
+            idMap.append(len(fileDirs))
+            fileDirs.append(dirId)
+            names += self.names[self.nameOffsets[fileId]:self.nameOffsets[fileId + 1]]
+            nameOffsets.append(len(names))
+            fileSizes.append(self.fileSizes[fileId])
+            fileMtimes.append(self.fileMtimes[fileId])
+
+        self.fileDirs = fileDirs
+        self.nameOffsets = nameOffsets
+        self.names = names
+        self.fileSizes = fileSizes
+        self.fileMtimes = fileMtimes
+
+        return idMap
+
+    def extend(self, other):
+        """Добавление в конец таблицы всех файлов из другого экземпляра
+        PathTable (номера файлов other сдвигаются на len(self))."""
+
+        # номера каталогов other -> номера каталогов self
+        dirMap = [self.add_dir(dirpath) for dirpath in other.dirs]
+
+        for fileId, dirId in enumerate(other.fileDirs):
+            self.fileDirs.append(dirMap[dirId])
+            self.names += other.names[other.nameOffsets[fileId]:other.nameOffsets[fileId + 1]]
+            self.nameOffsets.append(len(self.names))
+
+        self.fileSizes.extend(other.fileSizes)
+        self.fileMtimes.extend(other.fileMtimes)
+
+    def __len__(self):
+        return len(self.fileDirs)
+
+    def get_dir_id(self, fileId):
+        return self.fileDirs[fileId]
+
+    def get_dir(self, fileId):
+        return self.dirs[self.fileDirs[fileId]]
+
+    def get_size(self, fileId):
+        return self.fileSizes[fileId]
+
+    def get_mtime(self, fileId):
+        return self.fileMtimes[fileId]
+
+    def get_name(self, fileId):
+        return os.fsdecode(bytes(self.names[self.nameOffsets[fileId]:self.nameOffsets[fileId + 1]]))
+
+    def get_path(self, fileId):
+        """Возвращает полный путь к файлу с номером fileId."""
+
+        return os.path.join(self.dirs[self.fileDirs[fileId]], self.get_name(fileId))
+
+    def iter_paths(self, fileIds=None):
+        """Генератор полных путей к файлам.
+
+        fileIds - None (все файлы таблицы по порядку) или итерируемый
+                  объект с номерами файлов."""
+
+        if fileIds is None:
+            fileIds = range(len(self.fileDirs))
+
+        for fileId in fileIds:
+            yield self.get_path(fileId)
+
+    def __repr__(self):
+        return '%s(dirs=%d, files=%d, names=%d bytes)' % (self.__class__.__name__,
+            len(self.dirs), len(self.fileDirs), len(self.names))
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    pt = PathTable()
+    for p in ('/photos/2021/a.nef', '/photos/2021/b.nef', '/photos/2022/c.jpg'):
+        print(pt.add_path(p), p)
+
+    print(pt)
+    print(list(pt.iter_paths()))
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_profile.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+from time import perf_counter, process_time
+from heapq import heappush, heapreplace
+
+
+class ScanProfiler():
+    """Сбор данных о времени выполнения стадий сбора статистики.
+
+    Для каждой стадии (STAGE_*) накапливается общее время (реальное
+    и процессорное) и количество вызовов, для каждого обработанного
+    файла - время обработки (гистограммы по расширениям, N самых
+    медленных файлов и каталогов).
+
+    Накладные расходы - несколько вызовов таймеров на файл, т.е.
+    профилирование можно не выключать и при обычной работе."""
+
+    STAGE_WALK = 'поиск файлов'
+    STAGE_SNIFF = 'тип файла и встроенный разборщик EXIF'
+    STAGE_OPEN = 'открытие файлов (GExiv2.Metadata)'
+    STAGE_METADATA = 'чтение тэгов'
+    STAGE_DATES = 'разбор даты'
+    STAGE_CALLBACKS = 'обратные вызовы (UI)'
+
+    # порядок стадий в отчёте; неизвестные стадии выводятся в конце
+    STAGES = (STAGE_WALK, STAGE_SNIFF, STAGE_OPEN, STAGE_METADATA, STAGE_DATES, STAGE_CALLBACKS)
+
+    def __init__(self, topN=20):
+        """topN - количество самых медленных файлов и каталогов в отчёте."""
+
+        self.topN = topN
+        self.clear()
+
+    def clear(self):
+        # ключи - названия стадий, значения - списки [реальное время, процессорное время, кол-во вызовов]
+        self.stages = {}
+
+        # ключи - расширения файлов, значения - списки счётчиков файлов,
+        # где индекс - номер интервала времени обработки файла
+        # (int(микросекунды).bit_length(), т.е. интервалы удваиваются)
+        self.histograms = {}
+
+        # ключи - расширения файлов, значения - списки [кол-во файлов, общее время, макс. время]
+        self.extTotals = {}
+
+        # куча из кортежей (время, fileId) - topN самых медленных файлов
+        self.slowestFiles = []
+
+        # ключи - dirId, значения - общее время обработки файлов каталога
+        self.dirTimes = {}
+
+        self.wallStart = perf_counter()
+        self.cpuStart = process_time()
+
+    @staticmethod
+    def begin():
+        """Начало замера. Возвращает значение, которое следует передать
+        в end() или add_file()."""
+
+        return (perf_counter(), process_time())
+
+    def end(self, stage, t0):
+        """Окончание замера стадии stage, начатого вызовом begin().
+        Возвращает реальное время выполнения (в секундах)."""
+
+        wall = perf_counter() - t0[0]
+        cpu = process_time() - t0[1]
+
+        st = self.stages.get(stage)
+        if st is None:
+            self.stages[stage] = [wall, cpu, 1]
+        else:
+            st[0] += wall
+            st[1] += cpu
+            st[2] += 1
+
+        return wall
+
+    def merge_stages(self, stages):
+        """Добавление времени стадий, измеренного другим экземпляром
+        ScanProfiler (напр. в рабочем процессе pstat_extract.ExtractorPool).
+        stages - словарь в формате self.stages.
+        При параллельной обработке файлов сумма времени стадий может
+        превышать общее время сбора статистики."""
+
+        for stage, (wall, cpu, ncalls) in stages.items():
+            st = self.stages.get(stage)
+            if st is None:
+                self.stages[stage] = [wall, cpu, ncalls]
+            else:
+                st[0] += wall
+                st[1] += cpu
+                st[2] += ncalls
+
+    def timed_iter(self, iterable, stage):
+        """Генератор, возвращающий элементы iterable и учитывающий время
+        получения каждого элемента как время стадии stage.
+        Используется для учёта времени чтения каталогов при os.walk()."""
+
+        it = iter(iterable)
+
+        while True:
+            t0 = self.begin()
+            try:
+                v = next(it)
+            except StopIteration:
+                self.end(stage, t0)
+                return
+
+            self.end(stage, t0)
+            yield v
+
+    def timed_call(self, fn, stage):
+        """Возвращает функцию, вызывающую fn и учитывающую время
+        её выполнения как время стадии stage."""
+
+        def timed_fn(*args):
+            t0 = self.begin()
+            try:
+                return fn(*args)
+            finally:
+                self.end(stage, t0)
+
+        return timed_fn
+
+    def add_file(self, fileId, dirId, fext, seconds):
+        """Учёт времени обработки одного файла.
+
+        fileId, dirId   - номера файла и каталога (см. pstat_paths.PathTable);
+        fext            - расширение файла;
+        seconds         - время обработки в секундах."""
+
+        bucket = int(seconds * 1000000).bit_length()
+
+        hist = self.histograms.get(fext)
+        if hist is None:
+            hist = []
+            self.histograms[fext] = hist
+
+        if bucket >= len(hist):
+            hist.extend([0] * (bucket + 1 - len(hist)))
+
+        hist[bucket] += 1
+
+        ett = self.extTotals.get(fext)
+        if ett is None:
+            self.extTotals[fext] = [1, seconds, seconds]
+        else:
+            ett[0] += 1
+            ett[1] += seconds
+            if seconds > ett[2]:
+                ett[2] = seconds
+
+        if len(self.slowestFiles) < self.topN:
+            heappush(self.slowestFiles, (seconds, fileId))
+        elif seconds > self.slowestFiles[0][0]:
+            heapreplace(self.slowestFiles, (seconds, fileId))
+
+        self.dirTimes[dirId] = self.dirTimes.get(dirId, 0.0) + seconds
+
+    @staticmethod
+    def __time_str(seconds):
+        if seconds < 0.001:
+            return '%.0f мкс' % (seconds * 1000000)
+        elif seconds < 1.0:
+            return '%.1f мс' % (seconds * 1000)
+        else:
+            return '%.2f с' % seconds
+
+    @staticmethod
+    def __hist_percentile(hist, total, pc):
+        """Возвращает верхнюю границу интервала гистограммы (в секундах),
+        в который попадает процентиль pc."""
+
+        limit = total * pc / 100.0
+        n = 0
+
+        for bucket, nfiles in enumerate(hist):
+            n += nfiles
+            if n >= limit:
+                return (1 << bucket) / 1000000.0
+
+        return (1 << len(hist)) / 1000000.0
+
+    def get_report(self, files):
+        """Возвращает отчёт в виде строки.
+        files - экземпляр pstat_paths.PathTable, в котором хранятся
+        пути к файлам, для которых вызывался add_file()."""
+
+        totalWall = perf_counter() - self.wallStart
+        totalCPU = process_time() - self.cpuStart
+
+        ret = ['Профилирование сбора статистики',
+            '',
+            'Всего: %s (процессорное время: %s)' % (self.__time_str(totalWall), self.__time_str(totalCPU)),
+            '',
+            'Стадии:']
+
+        stages = [s for s in self.STAGES if s in self.stages]
+        stages += sorted(set(self.stages.keys()) - set(stages))
+
+        for stage in stages:
+            wall, cpu, ncalls = self.stages[stage]
+            ret.append('  %-36s %10s  CPU %10s  вызовов: %d' % (stage,
+                self.__time_str(wall), self.__time_str(cpu), ncalls))
+
+        if self.extTotals:
+            ret += ['', 'Время обработки файлов по расширениям (медиана/90%/99% - верхние границы интервалов):']
+
+            for fext, (nfiles, total, tmax) in sorted(self.extTotals.items(), key=lambda t: -t[1][1]):
+                hist = self.histograms[fext]
+
+                ret.append('  %-8s файлов: %8d  всего: %10s  среднее: %10s  медиана: %10s  90%%: %10s  99%%: %10s  макс.: %10s' % (fext,
+                    nfiles,
+                    self.__time_str(total),
+                    self.__time_str(total / nfiles),
+                    self.__time_str(self.__hist_percentile(hist, nfiles, 50)),
+                    self.__time_str(self.__hist_percentile(hist, nfiles, 90)),
+                    self.__time_str(self.__hist_percentile(hist, nfiles, 99)),
+                    self.__time_str(tmax)))
+
+        if self.slowestFiles:
+            ret += ['', 'Самые медленные файлы:']
+
+            for seconds, fileId in sorted(self.slowestFiles, reverse=True):
+                ret.append('  %10s  %s' % (self.__time_str(seconds), files.get_path(fileId)))
+
+        if self.dirTimes:
+            ret += ['', 'Самые медленные каталоги:']
+
+            for dirId, seconds in sorted(self.dirTimes.items(), key=lambda t: -t[1])[:self.topN]:
+                ret.append('  %10s  %s' % (self.__time_str(seconds), files.dirs[dirId]))
+
+        return '\n'.join(ret)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    from pstat_paths import PathTable
+    from time import sleep
+
+    files = PathTable()
+    prof = ScanProfiler(3)
+
+    for ix in range(5):
+        fileId = files.add_path('/photos/%d.nef' % ix)
+
+        t0 = prof.begin()
+        sleep(0.001 * ix)
+        prof.add_file(fileId, files.get_dir_id(fileId), '.nef', prof.end(prof.STAGE_OPEN, t0))
+
+    print(prof.get_report(files))
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_records.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Потоковый вывод метаданных снимков (по записи на снимок) в форматах
+# NDJSON и CSV - для передачи в другие программы.
+# Записи выводятся по мере просмотра каталогов и извлечения метаданных,
+# расход памяти от количества файлов не зависит (см.
+# pstat_stat.AggregateStatistics.stream_photo_records()); только при сборе
+# по выборке или поиске копий файлов сначала составляется полный список
+# файлов (см. PhotoStatistics.iter_photo_records()).
+
+
+import os
+import sys
+import json
+import csv
+
+from pstat_common import *
+from pstat_stat import PhotoStatistics
+from pstat_extract import create_extractor, remember_tuned_workers
+from pstat_walk import create_walker
+from pstat_dedup import create_duplicate_finder
+from pstat_throttle import create_throttle
+
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+
+FORMATS = (FORMAT_NDJSON, FORMAT_CSV)
+
+# поля выводимых записей (и столбцы CSV) - в этом порядке
+RECORD_FIELDS = ('path', 'focal', 'aperture', 'iso', 'exposure',
+    'date', 'year', 'month', 'camera', 'lens')
+
+
+def normalized_record(rec):
+    """Преобразование экземпляра pstat_stat.photo_record в словарь
+    из простых типов с ключами RECORD_FIELDS.
+    Неизвестные значения заменяются на None, дата - строка
+    в формате ISO 8601 (без часового пояса - в EXIF его нет)."""
+
+    return {'path': rec.path,
+        'focal': rec.focal if rec.focal > 0 else None,
+        'aperture': rec.aperture if rec.aperture > 0.0 else None,
+        'iso': rec.iso if rec.iso > 0 else None,
+        'exposure': rec.exposure if rec.exposure > 0.0 else None,
+        'date': rec.date.isoformat() if rec.date is not None else None,
+        'year': rec.year,
+        'month': rec.month,
+        'camera': rec.camera if rec.camera else None,
+        'lens': rec.lens if rec.lens else None}
+
+
+class NDJSONRecordWriter():
+    """Вывод записей в формате NDJSON (по объекту JSON в строке)."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, rec):
+        self.f.write(json.dumps(normalized_record(rec), ensure_ascii=False))
+        self.f.write('\n')
+
+
+class CSVRecordWriter():
+    """Вывод записей в формате CSV (с заголовком, неизвестные
+    значения - пустые строки)."""
+
+    def __init__(self, f):
+        self.writer = csv.DictWriter(f, RECORD_FIELDS, lineterminator='\n')
+        self.writer.writeheader()
+
+    def write(self, rec):
+        self.writer.writerow(normalized_record(rec))
+
+
+RECORD_WRITERS = {FORMAT_NDJSON: NDJSONRecordWriter,
+    FORMAT_CSV: CSVRecordWriter}
+
+
+def run_export(config, fmt, outfname=None):
+    """Сбор статистики с выводом записей о снимках.
+
+    config      - экземпляр pstat_config.Configuration;
+    fmt         - формат вывода (FORMAT_*);
+    outfname    - None или '-' (вывод в stdout) или путь к файлу.
+
+    Сообщения об ошибках выводятся в stderr.
+    Возвращает код завершения программы."""
+
+    stats = PhotoStatistics()
+    extractor = create_extractor(config)
+    walker = create_walker(config)
+    dedup = create_duplicate_finder(config)
+    throttle = create_throttle(config)
+
+    if config.cfgSamplingMode or dedup is not None:
+        # нужен полный список файлов
+        records = stats.iter_photo_records(config.cfgPhotoRootDir,
+            config.get_scan_file_types(),
+            sampling=config.cfgSamplingMode,
+            extractor=extractor,
+            walker=walker,
+            dedup=dedup,
+            throttle=throttle)
+    else:
+        records = stats.stream_photo_records(config.cfgPhotoRootDir,
+            config.get_scan_file_types(),
+            extractor=extractor,
+            walker=walker,
+            throttle=throttle)
+
+    try:
+        if not outfname or outfname == '-':
+            fout = sys.stdout
+        else:
+            fout = open(outfname, 'w', newline='', errors='surrogateescape')
+
+        try:
+            writer = RECORD_WRITERS[fmt](fout)
+
+            for rec in records:
+                writer.write(rec)
+
+            fout.flush()
+
+        finally:
+            if fout is not sys.stdout:
+                fout.close()
+
+    except BrokenPipeError:
+        # напр. вывод передаётся в head - дальше никто не читает,
+        # и это не ошибка; stdout подменяем, чтобы питон
+        # не ругался при сбросе буфера во время завершения
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+
+    except OSError as ex:
+        print(exception_to_str(ex), file=sys.stderr)
+        return 1
+
+    finally:
+        extractor.close()
+
+    remember_tuned_workers(config, extractor, True)
+
+    if dedup and dedup.groups:
+        print(dedup.get_report(stats.files), file=sys.stderr)
+
+    if throttle:
+        print(throttle.get_summary_str(), file=sys.stderr)
+
+    print('Файлов: %d, обработано: %d, копий: %d, снимков: %d' % (stats.statTotalFiles,
+        stats.statProcessedFiles, stats.statDuplicateFiles, stats.statTotalPhotos), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    from pstat_config import Configuration, get_config_file_name
+
+    cfg = Configuration(get_config_file_name())
+    cfg.load()
+
+    exit(run_export(cfg, FORMAT_NDJSON))
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_server.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+import stat
+import sys
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import urlsplit, parse_qs
+
+from pstat_common import *
+from pstat_stat import PhotoStatistics
+from pstat_profile import ScanProfiler
+from pstat_memprof import MemoryProfiler
+from pstat_metrics import ScanMetrics
+from pstat_extract import create_extractor, remember_tuned_workers
+from pstat_walk import create_walker
+from pstat_dedup import create_duplicate_finder
+from pstat_throttle import create_throttle
+from pstat_filter import PhotoFilter, FilterError
+
+
+class StatService():
+    """Сервис статистики - держит в памяти результаты последнего
+    завершённого сбора статистики (в виде готовых ответов JSON)
+    и запускает повторный сбор по запросу.
+
+    Одновременные запросы на повторный сбор объединяются:
+    пока идёт сбор, новые запросы только ждут его завершения."""
+
+    # имена наборов данных (и путей запросов /stats/<имя>)
+    DATA_FOCALS = 'focals'
+    DATA_YEARS = 'years'
+    DATA_ISO = 'iso'
+    DATA_ALL = 'all'
+
+    def __init__(self, config):
+        """config - экземпляр pstat_config.Configuration."""
+
+        self.config = config
+
+        # номера поколений статистики после перезапуска сервиса
+        # начинаются заново, поэтому в ETag входит ещё и случайная
+        # метка экземпляра сервиса
+        self.instanceTag = os.urandom(6).hex()
+
+        self.lock = threading.Lock()
+        self.scanFinished = threading.Condition(self.lock)
+
+        # статистика по последнему завершённому сбору
+        self.stats = PhotoStatistics()
+
+        # статистика, собираемая в данный момент (или None)
+        self.scanningStats = None
+        self.scanThread = None
+        self.scanError = None
+
+        # ключи - имена наборов данных (DATA_*), значения - JSON (bytes)
+        self.published = {}
+        self.publish()
+
+        self.metrics = ScanMetrics(config.cfgMetricsFile)
+
+        # рабочие процессы извлечения метаданных живут всё время работы сервиса
+        self.extractor = create_extractor(config)
+
+    def publish(self):
+        """Формирование ответов JSON по текущему self.stats.
+        Вызывается при захваченном self.lock (или до запуска сервера)."""
+
+        self.published = self.encode_stat_data(self.stats, self.stats.generation)
+
+    def encode_stat_data(self, stats, generation, photoFilter=None):
+        """Формирование ответов JSON по статистике stats (экземпляру
+        AggregateStatistics).
+        Возвращает словарь, где ключи - имена наборов данных (DATA_*),
+        а значения - JSON (bytes)."""
+
+        data = stats.get_stat_data()
+        data['generation'] = generation
+
+        common = {k: data[k] for k in ('generation', 'totalFiles', 'foundFiles',
+            'processedFiles', 'pairedFiles', 'duplicateFiles', 'linkedFiles', 'totalPhotos', 'estimate')}
+
+        if photoFilter is not None:
+            common['filter'] = photoFilter.expr
+
+        def table_rows(table):
+            return [table.title] + table.rows
+
+        focals = dict(common,
+            focals=data['focals'],
+            table=table_rows(stats.get_stat_table_by_focals()))
+
+        years = dict(common,
+            years=data['years'],
+            yearsTotal=data['yearsTotal'],
+            table=table_rows(stats.get_stat_table_by_year()))
+
+        iso = dict(common,
+            iso=data['iso'],
+            isoTotal=data['isoTotal'],
+            table=table_rows(stats.get_stat_table_by_iso()))
+
+        def encode_json(d):
+            return json.dumps(d, ensure_ascii=False).encode('utf-8')
+
+        return {self.DATA_FOCALS: encode_json(focals),
+            self.DATA_YEARS: encode_json(years),
+            self.DATA_ISO: encode_json(iso),
+            self.DATA_ALL: encode_json(dict(common,
+                focals=focals, years=years, iso=iso))}
+
+    def get_data(self, name):
+        """Возвращает кортеж из двух элементов - номера поколения
+        статистики и JSON (bytes), или None, если имя набора данных
+        неизвестно."""
+
+        with self.lock:
+            data = self.published.get(name)
+            if data is None:
+                return None
+
+            return (self.stats.generation, data)
+
+    def get_filtered_data(self, name, expr):
+        """То же, что get_data(), но статистика пересчитывается только
+        по снимкам, удовлетворяющим условию expr (см. pstat_filter).
+        При ошибке в условии генерирует исключение FilterError."""
+
+        if name not in (self.DATA_FOCALS, self.DATA_YEARS, self.DATA_ISO, self.DATA_ALL):
+            return None
+
+        photoFilter = PhotoFilter(expr)
+
+        # по завершении сбора self.stats заменяется целиком, а не меняется,
+        # т.е. считать можно и без блокировки - не задерживая другие запросы
+        with self.lock:
+            stats = self.stats
+
+        filtered = stats.get_filtered_stats(photoFilter)
+
+        return (stats.generation, self.encode_stat_data(filtered, stats.generation, photoFilter)[name])
+
+    def get_status(self):
+        with self.lock:
+            status = {'generation': self.stats.generation,
+                'photoRootDir': self.config.cfgPhotoRootDir,
+                'scanning': self.scanThread is not None,
+                'error': self.scanError}
+
+            if self.scanningStats is not None:
+                # счётчики меняются в потоке сбора, но для индикации
+                # прогресса точность не требуется
+                status['foundFiles'] = self.scanningStats.statFoundFiles
+                status['processedFiles'] = self.scanningStats.statProcessedFiles
+
+            return status
+
+    def request_rescan(self, wait=False):
+        """Запрос повторного сбора статистики.
+        Если сбор уже идёт - новый не запускается.
+
+        wait - если True, ожидать завершения сбора.
+
+        Возвращает номер поколения статистики (если wait=True -
+        после завершения сбора)."""
+
+        with self.lock:
+            if self.scanThread is None:
+                self.scanningStats = PhotoStatistics()
+                # номер поколения продолжает нумерацию предыдущей статистики
+                self.scanningStats.generation = self.stats.generation
+
+                self.metrics.scan_started(self.scanningStats)
+
+                self.scanThread = threading.Thread(target=self.__scan_thread, daemon=True)
+                self.scanThread.start()
+
+            if wait:
+                while self.scanThread is not None:
+                    self.scanFinished.wait()
+
+            return self.stats.generation
+
+    def __scan_thread(self):
+        stats = self.scanningStats
+
+        profiler = ScanProfiler() if self.config.cfgProfileScan else None
+        dedup = create_duplicate_finder(self.config)
+        throttle = create_throttle(self.config)
+
+        memprof = MemoryProfiler() if self.config.cfgMemProfile else None
+        if memprof:
+            memprof.start()
+
+        try:
+            ok, em = stats.gather_photo_statistics(self.config.cfgPhotoRootDir,
+                self.config.get_scan_file_types(),
+                memprof.wrap_stagedisp(None) if memprof else None,
+                progressdisp=self.metrics.wrap_progress(None),
+                profiler=profiler,
+                extractor=self.extractor,
+                walker=create_walker(self.config),
+                dedup=dedup,
+                throttle=throttle)
+        except Exception as ex:
+            dump_exception()
+            ok = True
+            em = exception_to_str(ex)
+
+        if profiler:
+            print(profiler.get_report(stats.files), file=sys.stderr)
+
+        if dedup and dedup.groups:
+            print(dedup.get_report(stats.files), file=sys.stderr)
+
+        if throttle:
+            print(throttle.get_summary_str(), file=sys.stderr)
+
+        remember_tuned_workers(self.config, self.extractor, True)
+
+        with self.lock:
+            if ok and not em:
+                if memprof:
+                    memprof.stage('Подготовка ответов (JSON)')
+
+                self.stats = stats
+                self.publish()
+
+            self.scanError = em if em else None
+            self.scanningStats = None
+            self.scanThread = None
+
+            self.metrics.scan_finished(self.stats)
+
+            self.scanFinished.notify_all()
+
+        if memprof:
+            memprof.finish()
+            print(memprof.get_report(), file=sys.stderr)
+
+
+class StatRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов HTTP.
+
+    GET /stats              - вся статистика;
+    GET /stats/focals       - по фокусным расстояниям и диафрагмам;
+    GET /stats/years        - по годам и месяцам;
+    GET /stats/iso          - по значениям ISO Speed;
+    GET /stats*?filter=EXPR - то же, но только по снимкам, удовлетворяющим
+                              условию EXPR (см. pstat_filter);
+    GET /status             - состояние сервиса;
+    GET /metrics            - метрики сбора статистики (формат Prometheus);
+    POST /rescan[?wait=1]   - повторный сбор статистики.
+
+    Ответы на запросы /stats* содержат заголовок ETag (номер поколения
+    статистики); при совпадении с If-None-Match возвращается 304."""
+
+    server_version = 'PhotoStat/%s' % APP_VERSION
+
+    def address_string(self):
+        # у клиентов сокетов AF_UNIX адреса нет
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def __send_json(self, code, body, etag=None):
+        self.send_response(code)
+
+        if etag:
+            self.send_header('ETag', etag)
+
+        if body is None:
+            self.end_headers()
+            return
+
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def __send_obj(self, code, obj):
+        self.__send_json(code, json.dumps(obj, ensure_ascii=False).encode('utf-8'))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/')
+
+        if path == '/status':
+            self.__send_obj(200, self.server.service.get_status())
+            return
+
+        if path == '/metrics':
+            body = self.server.service.metrics.get_text().encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', ScanMetrics.CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+
+            self.wfile.write(body)
+            return
+
+        if path == '/stats':
+            name = StatService.DATA_ALL
+        elif path.startswith('/stats/'):
+            name = path[7:]
+        else:
+            name = None
+
+        expr = parse_qs(url.query).get('filter', [''])[0]
+
+        try:
+            if not name:
+                r = None
+            elif expr:
+                r = self.server.service.get_filtered_data(name, expr)
+            else:
+                r = self.server.service.get_data(name)
+
+        except FilterError as ex:
+            self.__send_obj(400, {'error': str(ex)})
+            return
+
+        if r is None:
+            self.__send_obj(404, {'error': 'unknown path %s' % path})
+            return
+
+        generation, body = r
+        etag = '"%s-%d"' % (self.server.service.instanceTag, generation)
+
+        if etag in map(str.strip, self.headers.get('If-None-Match', '').split(',')):
+            self.__send_json(304, None, etag)
+        else:
+            self.__send_json(200, body, etag)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+
+        if url.path.rstrip('/') != '/rescan':
+            self.__send_obj(404, {'error': 'unknown path %s' % url.path})
+            return
+
+        wait = parse_qs(url.query).get('wait', ['0'])[0] not in ('', '0')
+
+        generation = self.server.service.request_rescan(wait)
+
+        status = self.server.service.get_status()
+        status['generation'] = generation
+
+        self.__send_obj(200 if wait else 202, status)
+
+
+class StatUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def run_server(config, address):
+    """Запуск сервиса статистики.
+
+    config  - экземпляр pstat_config.Configuration;
+    address - строка "host:port", ":port" или "unix:/путь/к/сокету".
+
+    Возвращает код завершения программы."""
+
+    if address.startswith('unix:'):
+        sockpath = address[5:]
+
+        # удаляем только сокет, оставшийся от прежнего запуска
+        try:
+            st = os.lstat(sockpath)
+        except FileNotFoundError:
+            st = None
+
+        if st is not None:
+            if not stat.S_ISSOCK(st.st_mode):
+                print('"%s" существует и не является сокетом' % sockpath, file=sys.stderr)
+                return 1
+
+            os.remove(sockpath)
+
+        server = StatUnixHTTPServer(sockpath, StatRequestHandler)
+    else:
+        host, _, port = address.rpartition(':')
+
+        try:
+            port = int(port)
+        except ValueError:
+            print('Неправильный адрес сервиса - "%s"' % address, file=sys.stderr)
+            return 1
+
+        server = ThreadingHTTPServer((host if host else 'localhost', port), StatRequestHandler)
+
+    server.service = StatService(config)
+    server.service.request_rescan()
+
+    print('%s: сервис статистики запущен (%s), каталог "%s"' % (APP_TITLE_VERSION,
+        address, config.cfgPhotoRootDir), file=sys.stderr)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.extractor.close()
+
+    return 0
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_snapshot.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Сохранение собранной статистики (общей и по каталогам) в двоичный
+# файл ("снимок") и быстрое восстановление из него при запуске.
+#
+# Формат файла:
+#   SNAPSHOT_MAGIC (8 байт)
+#   версия формата (uint32)
+#   длина заголовка (uint32)
+#   заголовок - JSON в UTF-8 (корневой каталог, расширения файлов,
+#       время сохранения, таблица разделов), дополненный нулями
+#       до границы 8 байт
+#   разделы - массивы целых (int64) или float64, каждый выровнен
+#       на 8 байт; смещения в таблице разделов - от начала первого
+#       раздела.
+# Порядок байт - родной для машины (указан в заголовке), т.е. массивы
+# читаются прямо из отображённого в память файла (mmap) без разбора.
+
+
+import os, os.path
+import sys
+import struct
+import json
+import mmap
+from array import array
+from time import time
+
+from pstat_common import *
+from pstat_stat import AggregateStatistics, PhotoStatistics
+
+
+SNAPSHOT_MAGIC = b'PSTATSNP'
+# 2 - добавлен счётчик statPairedFiles
+# 3 - добавлен счётчик statDuplicateFiles
+# 4 - добавлен счётчик statLinkedFiles
+SNAPSHOT_VERSION = 4
+
+HEADER_STRUCT = struct.Struct('=8sII')
+
+SECTION_ALIGN = 8
+
+# разделы файла: имя - (код типа array.array, кол-во элементов на запись);
+# в записях разделов, кроме paths и counters, первый элемент - номер
+# каталога (индекс в списке путей)
+SECTIONS = {
+    # пути каталогов (os.fsencode), разделённые нулевыми байтами
+    'paths':    ('B', 1),
+    # значения AggregateStatistics.COUNTER_FIELDS по каталогам
+    'counters': ('q', len(AggregateStatistics.COUNTER_FIELDS)),
+    # (каталог, ФР, нормализованная диафрагма, кол-во снимков)
+    'focals':   ('q', 4),
+    # значения диафрагм для записей раздела focals
+    'apertures': ('d', 1),
+    # (каталог, год, месяц (0 - весь год), кол-во снимков)
+    'years':    ('q', 4),
+    # (каталог, ISO Speed, кол-во снимков)
+    'iso':      ('q', 3),
+    # (каталог, номер расширения в заголовке, кол-во файлов)
+    'exts':     ('q', 3),
+    }
+
+
+class StatSnapshot():
+    """Снимок собранной статистики в файле.
+
+    Поля (заполняются методами save() и load()):
+        fname       - путь к файлу;
+        rootDir     - корневой каталог, по которому собрана статистика;
+        fileTypes   - множество расширений обработанных файлов;
+        timestamp   - время сохранения (time.time());
+        stats       - экземпляр PhotoStatistics (после load())."""
+
+    def __init__(self, fname):
+        self.fname = fname
+
+        self.rootDir = None
+        self.fileTypes = set()
+        self.timestamp = 0.0
+        self.stats = None
+
+    def save(self, stats, ftypes):
+        """Сохранение статистики в файл.
+
+        stats   - экземпляр PhotoStatistics (с деревом каталогов);
+        ftypes  - множество расширений обработанных файлов.
+
+        Файл заменяется атомарно.
+        Возвращает None или строку с сообщением об ошибке."""
+
+        if stats.dirTree is None:
+            return 'Статистика не собрана'
+
+        nodes = list(stats.dirTree.iter_nodes())
+
+        data = {name: array(tcode) for name, (tcode, nitems) in SECTIONS.items()}
+        exts = {}
+
+        data['paths'].frombytes(b'\x00'.join(map(lambda n: os.fsencode(n.path), nodes)))
+
+        for ixnode, node in enumerate(nodes):
+            ns = node.stats
+
+            data['counters'].extend(map(lambda name: getattr(ns, name), ns.COUNTER_FIELDS))
+
+            for focal, focobj in ns.statFocals.items():
+                for naperture, aobj in focobj.apertures.items():
+                    data['focals'].extend((ixnode, focal, naperture, aobj.numPhotos))
+                    data['apertures'].append(aobj.value)
+
+            for yearno, year in ns.statByYear.items():
+                for month, nphotos in year.items():
+                    data['years'].extend((ixnode, yearno, month, nphotos))
+
+            for isoSpeed, nphotos in ns.statByISOSpeed.items():
+                data['iso'].extend((ixnode, isoSpeed, nphotos))
+
+            for ext, nfiles in ns.statProcessedByExt.items():
+                data['exts'].extend((ixnode, exts.setdefault(ext, len(exts)), nfiles))
+
+        sections = {}
+        offset = 0
+
+        for name, arr in data.items():
+            size = len(arr) * arr.itemsize
+            sections[name] = (offset, len(arr))
+            offset += size + (-size % SECTION_ALIGN)
+
+        self.rootDir = stats.dirTree.path
+        self.fileTypes = set(ftypes)
+        self.timestamp = time()
+
+        header = json.dumps({'root': self.rootDir,
+            'ftypes': sorted(self.fileTypes),
+            'timestamp': self.timestamp,
+            'byteorder': sys.byteorder,
+            'nodes': len(nodes),
+            'exts': sorted(exts, key=lambda e: exts[e]),
+            'sections': sections}, ensure_ascii=False).encode('utf-8', 'surrogateescape')
+
+        header += bytes(-(HEADER_STRUCT.size + len(header)) % SECTION_ALIGN)
+
+        tmpname = '%s.tmp' % self.fname
+
+        try:
+            with open(tmpname, 'wb') as f:
+                f.write(HEADER_STRUCT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+                f.write(header)
+
+                for arr in data.values():
+                    arr.tofile(f)
+
+                    size = len(arr) * arr.itemsize
+                    f.write(bytes(-size % SECTION_ALIGN))
+
+            os.replace(tmpname, self.fname)
+
+        except OSError as ex:
+            return 'Не удалось сохранить статистику в файл "%s" - %s' % (self.fname, exception_to_str(ex))
+
+    def load(self):
+        """Загрузка статистики из файла.
+        Возвращает None или строку с сообщением об ошибке.
+        Отсутствие файла ошибкой не считается - в этом случае
+        self.stats остаётся равным None."""
+
+        self.stats = None
+
+        if not os.path.exists(self.fname):
+            return
+
+        try:
+            with open(self.fname, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return self.__load_mapped(mm)
+
+        except (OSError, ValueError, KeyError, TypeError, IndexError, struct.error) as ex:
+            self.stats = None
+            return 'Файл "%s" повреждён или не читается - %s' % (self.fname, exception_to_str(ex))
+
+    def __load_mapped(self, mm):
+        magic, version, hdrlen = HEADER_STRUCT.unpack_from(mm, 0)
+
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('неизвестный формат файла')
+
+        dataStart = HEADER_STRUCT.size + hdrlen
+        header = json.loads(mm[HEADER_STRUCT.size:dataStart].rstrip(b'\x00').decode('utf-8', 'surrogateescape'))
+
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('файл сохранён на машине с другим порядком байт')
+
+        exts = header['exts']
+        nodeStats = [AggregateStatistics() for ix in range(header['nodes'])]
+
+        mv = memoryview(mm)
+        # все полученные из mv срезы должны быть освобождены до закрытия mmap
+        views = [mv]
+
+        def get_section(name):
+            tcode, nitems = SECTIONS[name]
+            offset, length = header['sections'][name]
+
+            itemsize = array(tcode).itemsize
+            start = dataStart + offset
+
+            if length % nitems or start + length * itemsize > len(mm):
+                raise ValueError('неправильный размер раздела %s' % name)
+
+            view = mv[start:start + length * itemsize].cast(tcode)
+            views.append(view)
+
+            return view
+
+        try:
+            paths = list(map(os.fsdecode, get_section('paths').tobytes().split(b'\x00')))
+            if len(paths) != len(nodeStats):
+                raise ValueError('неправильное количество каталогов')
+
+            counters = get_section('counters')
+            nc = len(AggregateStatistics.COUNTER_FIELDS)
+
+            for ixnode, ns in enumerate(nodeStats):
+                for ixc, name in enumerate(ns.COUNTER_FIELDS):
+                    setattr(ns, name, counters[ixnode * nc + ixc])
+
+            focals = get_section('focals')
+            apertures = get_section('apertures')
+
+            for ix in range(0, len(focals), 4):
+                focal, naperture, nphotos = focals[ix + 1:ix + 4]
+
+                nodeStats[focals[ix]].add_focal_aperture_count(focal, naperture, apertures[ix // 4], nphotos)
+
+            years = get_section('years')
+
+            for ix in range(0, len(years), 4):
+                ns = nodeStats[years[ix]]
+                yearno, month, nphotos = years[ix + 1:ix + 4]
+
+                ns.statByYear.setdefault(yearno, {})[month] = nphotos
+
+            iso = get_section('iso')
+
+            for ix in range(0, len(iso), 3):
+                nodeStats[iso[ix]].statByISOSpeed[iso[ix + 1]] = iso[ix + 2]
+
+            extcounts = get_section('exts')
+
+            for ix in range(0, len(extcounts), 3):
+                nodeStats[extcounts[ix]].statProcessedByExt[exts[extcounts[ix + 1]]] = extcounts[ix + 2]
+
+        finally:
+            for view in reversed(views):
+                view.release()
+
+        stats = PhotoStatistics()
+        stats.set_dir_tree(header['root'], dict(zip(paths, nodeStats)))
+
+        self.rootDir = stats.dirTree.path
+        self.fileTypes = set(header['ftypes'])
+        self.timestamp = header['timestamp']
+        self.stats = stats
+
+    def matches(self, rootDir, ftypes):
+        """Проверка соответствия загруженного снимка настройкам:
+        статистика собрана по каталогу rootDir и файлам с расширениями
+        из множества ftypes."""
+
+        return self.stats is not None and self.rootDir == os.path.normpath(rootDir) and self.fileTypes == set(ftypes)
+
+    def is_probably_stale(self):
+        """Быстрая (без обхода всего дерева) проверка того, что файлы
+        могли измениться после сохранения снимка: сравнивается время
+        изменения корневого каталога и каталогов первого уровня
+        вложенности. Изменения глубже не обнаруживаются."""
+
+        if self.stats is None:
+            return False
+
+        checkdirs = [self.stats.dirTree] + list(self.stats.dirTree.children.values())
+
+        for node in checkdirs:
+            try:
+                if os.stat(node.path).st_mtime > self.timestamp:
+                    return True
+            except OSError:
+                # каталог удалён
+                return True
+
+        return False
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    snapshot = StatSnapshot(sys.argv[1])
+    e = snapshot.load()
+
+    if e:
+        print(e)
+    elif snapshot.stats is not None:
+        print(snapshot.rootDir, snapshot.fileTypes, snapshot.timestamp, snapshot.is_probably_stale())
+        print(snapshot.stats.get_stat_tables_str())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_sniff.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Определение типа файла по первым байтам ("магическим" сигнатурам).
+# Файлы, тип которых не определён, EXIF содержать не могут (или
+# их всё равно не умеет читать GExiv2), и открывать их тяжёлым
+# разборщиком незачем.
+
+
+# сколько байт читать из начала файла
+SNIFF_SIZE = 64
+
+# типы контейнеров
+CT_JPEG = 'jpeg'
+CT_TIFF = 'tiff'        # обычный TIFF, а также DNG, NEF, ARW, PEF, CR2 и прочие RAW на его основе
+CT_ORF = 'orf'          # Olympus (TIFF с нестандартной сигнатурой)
+CT_RW2 = 'rw2'          # Panasonic (то же)
+CT_CRW = 'crw'          # старый Canon CIFF
+CT_RAF = 'raf'          # Fujifilm
+CT_MRW = 'mrw'          # Minolta
+CT_X3F = 'x3f'          # Sigma/Foveon
+CT_BMFF = 'bmff'        # ISO base media file format: CR3, HEIF, AVIF
+CT_PNG = 'png'
+CT_WEBP = 'webp'
+CT_JP2 = 'jp2'
+
+# типы, которые умеет разбирать встроенный разборщик EXIF (pstat_exif)
+FAST_EXIF_TYPES = {CT_JPEG, CT_TIFF}
+
+
+def sniff_header(head):
+    """Определение типа контейнера по первым байтам файла.
+
+    head - bytes (желательно не менее SNIFF_SIZE байт).
+
+    Возвращает одну из констант CT_* или None, если тип не определён."""
+
+    if len(head) < 12:
+        # пустые файлы и "заглушки"
+        return None
+
+    if head[:3] == b'\xff\xd8\xff':
+        return CT_JPEG
+
+    sig4 = head[:4]
+
+    if sig4 in (b'II*\x00', b'MM\x00*'):
+        return CT_TIFF
+
+    if sig4 in (b'IIRO', b'IIRS', b'MMOR'):
+        return CT_ORF
+
+    if sig4 == b'IIU\x00':
+        return CT_RW2
+
+    if head[:2] == b'II' and head[6:14] == b'HEAPCCDR':
+        return CT_CRW
+
+    if head[:15] == b'FUJIFILMCCD-RAW':
+        return CT_RAF
+
+    if sig4 == b'\x00MRM':
+        return CT_MRW
+
+    if sig4 == b'FOVb':
+        return CT_X3F
+
+    if head[4:8] == b'ftyp':
+        return CT_BMFF
+
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        return CT_PNG
+
+    if sig4 == b'RIFF' and head[8:12] == b'WEBP':
+        return CT_WEBP
+
+    if head[:12] == b'\x00\x00\x00\x0cjP  \r\n\x87\n':
+        return CT_JP2
+
+    return None
+
+
+def sniff_file(fpath):
+    """Определение типа контейнера файла fpath (см. sniff_header()).
+    Читает из файла не более SNIFF_SIZE байт за один вызов read().
+    Если файл не открывается, возвращает None."""
+
+    try:
+        with open(fpath, 'rb', buffering=0) as f:
+            return sniff_header(f.read(SNIFF_SIZE))
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    import sys
+
+    for fpath in sys.argv[1:]:
+        print('%-8s %s' % (sniff_file(fpath), fpath))
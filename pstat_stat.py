@@ -19,18 +19,20 @@
     along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
 
 
-from gi import require_version as gi_require_version
-gi_require_version('GExiv2', '0.10') # только чтоб не лаялось...
-from gi.repository import GExiv2
-
-GExiv2.log_set_level(GExiv2.LogLevel.MUTE)
-
 import os, os.path
-import datetime
-from fractions import Fraction
+from array import array
+from math import sqrt, floor, ceil
+from collections import namedtuple, Counter
+from itertools import compress
+import random
 
 import pstat_config
 from pstat_common import *
+from pstat_paths import PathTable
+from pstat_extract import MetadataExtractor, photo_metadata
+from pstat_walk import DirWalker
+from pstat_manifest import ManifestError
+from pstat_index import BucketIndex, PhotoTable
 
 from warnings import warn
 
@@ -47,6 +49,15 @@ V_OTHERS = 0    # для группировки строк/столбцов, в
 
 APERTURE_NORM_CF = 10.0
 
+# квантиль нормального распределения для 95% доверительного интервала
+# (для оценок, полученных по выборке)
+CONFIDENCE_Z = 1.96
+
+
+photo_record = namedtuple('photo_record', ('path',) + photo_metadata._fields)
+# path      - полный путь к файлу снимка;
+# остальные поля - см. pstat_extract.photo_metadata
+
 
 def normalized_aperture(raperture):
     """Преобразует значение raperture (fractions.Fraction)
@@ -63,9 +74,40 @@ def normalized_focal_length(fl):
     return V_UNKNOWN if fl <= 0 else fl
 
 
+def merge_counters(dest, src, sign=1):
+    """Прибавление (sign=1) или вычитание (sign=-1) значений словаря src
+    к значениям словаря dest с теми же ключами. Значения - целые;
+    элементы dest, значения которых стали <= 0, удаляются."""
+
+    for k, v in src.items():
+        v = dest.get(k, 0) + sign * v
+
+        if v > 0:
+            dest[k] = v
+        elif k in dest:
+            del dest[k]
+
+
+def merge_aperture_stats(dest, src, sign=1):
+    """То же, что merge_counters(), для словарей, где ключи -
+    нормализованные значения диафрагмы, а значения - экземпляры
+    ApertureStatistics."""
+
+    for naperture, saobj in src.items():
+        aobj = dest.get(naperture)
+        if aobj is None:
+            aobj = ApertureStatistics(saobj.value)
+            dest[naperture] = aobj
+
+        aobj.numPhotos += sign * saobj.numPhotos
+
+        if aobj.numPhotos <= 0:
+            del dest[naperture]
+
+
 class ApertureStatistics():
     def __init__(self, raperture):
-        # aperture - значение типа fractions.Fraction
+        # aperture - значение типа fractions.Fraction или float
 
         self.value = float(raperture)
 
@@ -98,7 +140,7 @@ class FocalLengthStatistics():
         self.apertures = {}
 
     def add_photo(self, aperture):
-        # aperture - fractions.Fraction
+        # aperture - fractions.Fraction или float
         # возвращает нормализованное значение диафрагмы
 
         naperture = normalized_aperture(aperture)
@@ -125,17 +167,13 @@ class FocalLengthStatistics():
             self.apertures)
 
 
-class PhotoStatistics():
-    """Статистика по использованным фокусным расстояниям и диафрагмам.
+class AggregateStatistics():
+    """Счётчики статистики по фокусным расстояниям, диафрагмам, датам
+    и значениям ISO Speed - без списка файлов и сбора данных
+    (см. PhotoStatistics).
 
-    Порядок операций:
-    1. Создание экземпляра класса (или вызов метода clear() существующего
-       экземпляра).
-    2. Вызов метода scan_directory() (или несколько вызовов для разных
-       несовпадающих каталогов.
-    3. Вызов метода get_stat_table() для получения финального результата.
-
-    Также см. описания методов."""
+    Экземпляры класса хранят статистику по каталогам (см. DirStatNode),
+    их можно складывать и вычитать (merge_stats())."""
 
     def __init__(self):
         # ключи - фокусные расстояния, значения - экземпляры FocalLengthStatistics
@@ -170,6 +208,48 @@ class PhotoStatistics():
         # общее количество просмотренных файлов
         self.statTotalFiles = 0
 
+        # количество файлов, отобранных для обработки (по расширениям),
+        # и количество уже обработанных из них
+        self.statFoundFiles = 0
+        self.statProcessedFiles = 0
+
+        # True, если файлы обрабатывались в порядке случайной выборки;
+        # если при этом statProcessedFiles < statFoundFiles (сбор прерван) -
+        # значения в таблицах являются оценками (см. is_estimate(),
+        # estimate_count()); в COUNTER_FIELDS не входит
+        self.statSampled = False
+
+        # количество RAW-файлов, не отобранных для обработки, т.к. они
+        # образуют пары RAW+JPEG (кадр учитывается один раз - по JPEG,
+        # см. pstat_walk.DirWalker); в statFoundFiles не входят
+        self.statPairedFiles = 0
+
+        # количество файлов, не обработанных, т.к. они являются копиями
+        # других файлов (см. pstat_dedup); в statFoundFiles не входят
+        self.statDuplicateFiles = 0
+
+        # количество файлов, не отобранных для обработки, т.к. это
+        # жёсткие или символические ссылки на уже отобранные файлы
+        # (см. pstat_walk.DirWalker); в statFoundFiles не входят
+        self.statLinkedFiles = 0
+
+        # количество обработанных файлов, которые не удалось открыть
+        # или в которых нет EXIF
+        self.statFailedFiles = 0
+
+        # количество файлов, не обработанных из-за зависания или падения
+        # рабочего процесса, а также ранее помещённых в карантин
+        # (см. pstat_extract.Quarantine); входит в statFailedFiles
+        self.statQuarantinedFiles = 0
+
+        # суммарный размер обработанных файлов (только для файлов,
+        # размер которых известен по результатам поиска файлов)
+        self.statBytesRead = 0
+
+        # количество обработанных файлов по расширениям:
+        # ключи - расширения, значения - счётчики
+        self.statProcessedByExt = {}
+
     def clear(self):
         """Сброс статистики (перед повторным сбором)."""
 
@@ -187,49 +267,28 @@ class PhotoStatistics():
 
         self.statTotalFiles = 0
 
-    # тэги даты/времени создания снимка в порядке предпочтения
-    # (авось хоть какой обнаружится в файле)
-    __DT_TAGS = ('Exif.Photo.DateTimeDigitized',
-        'Exif.Image.DateTimeOriginal',
-        'Exif.Photo.DateTimeOriginal',
-        'Exif.Image.DateTime')
-
-    def __process_file_metadata(self, fpath):
-        """Извлечение метаданных из файла фотографии и учёт их в статистике."""
-
-        try:
-            gmd = GExiv2.Metadata(fpath)
-
-        except Exception as ex:
-            # файлы, которые не содержат EXIF или не открываются
-            # выгребалкой по любой другой причине - фотками не считаются.
-            # подробности мну в данный момент не колышут.
-            #print(ex)
-            return
-
-        if not gmd.has_exif():
-            # такие товарищи нам совсем не товарищи
-            # снимки без метаданных не учитываем ваще совсем
-            return
+        self.statFoundFiles = 0
+        self.statProcessedFiles = 0
+        self.statSampled = False
+        self.statPairedFiles = 0
+        self.statDuplicateFiles = 0
+        self.statLinkedFiles = 0
+        self.statFailedFiles = 0
+        self.statQuarantinedFiles = 0
+        self.statBytesRead = 0
+        self.statProcessedByExt.clear()
+
+    def add_photo_metadata(self, md):
+        """Учёт метаданных снимка в статистике.
+        md - экземпляр pstat_extract.photo_metadata."""
 
-        #
         self.statTotalPhotos += 1
 
-        # дробные значения ФР нам нафиг не нужны
-        focal = int(round(gmd.get_focal_length()))
-
-        aperture = gmd.get_exif_tag_rational('Exif.Photo.FNumber')
-        if not aperture:
-            aperture = gmd.get_exif_tag_rational('Exif.Image.FNumber')
-
-        if not aperture or float(aperture) < 0.5:
-            # считается, что диафрагмы < 0.7 не бывает, но оставим всё ж запас ради параноищи
-            # если вернуло кривое значение (например, <0)
-            # считаем это "неизвестным значением"
-            aperture = Fraction.from_float(V_UNKNOWN)
-
         # снимки с EXIF, но с нулевыми значениями ФР и диафрагмы могут быть, например,
         # с нечипованных древних объективов
+        focal = md.focal
+
+        aperture = md.aperture if md.aperture > 0.0 else float(V_UNKNOWN)
 
         # валим в статистику
         if focal in self.statFocals:
@@ -252,36 +311,19 @@ class PhotoStatistics():
 
         # статистика по ISO Speed
 
-        isoSpeed = gmd.get_iso_speed()
+        isoSpeed = md.iso
         if isoSpeed > 0:
             self.statByISOSpeedTotal += 1
 
             self.statByISOSpeed[isoSpeed] = self.statByISOSpeed.get(isoSpeed, 0) + 1
 
         # статистика по ISO Speed и выдержкам
-        #print(naperture / APERTURE_NORM_CF, isoSpeed)
         #TODO м.б. сделать статистику по ISO Speed и выдержкам
-        #print(gmd.get_exposure_time())
-
-        #
-        # определяем дату создания снимка для статистики по годам и месяцам
-        #
-        year = None
-        month = None
-
-        for dtn in self.__DT_TAGS:
-            tagv = gmd.get_tag_string(dtn)
-            if tagv:
-                try:
-                    pdate = datetime.datetime.strptime(tagv, '%Y:%m:%d %H:%M:%S').date()
-                except:
-                    continue
-
-                year = pdate.year
-                month = pdate.month
-                break
 
         # пихаем статистику по годам
+        year = md.year
+        month = md.month
+
         if year is None or month is None:
             # снимки без даты не учитываем
             return
@@ -296,72 +338,268 @@ class PhotoStatistics():
         else:
             self.statByYear[year] = {0:1, month:1}
 
-    def gather_photo_statistics(self, photodir, ftypes, stagedisp=None, progressdisp=None):
-        """Поиск файлов фотографий и учёт их метаданных.
+    def add_focal_aperture_count(self, focal, naperture, aperture, nphotos):
+        """Учёт сразу nphotos снимков с ФР focal и диафрагмой aperture
+        (naperture - нормализованное значение) - при построении
+        статистики по готовым счётчикам (см. pstat_snapshot,
+        PhotoStatistics.get_filtered_stats()).
+        Общие счётчики (statTotalPhotos и т.п.) не изменяются."""
 
-        Параметры:
-            photodir        - строка с путём к каталогу с фотографиями;
-            ftypes          - множество (set) допустимых расширений имен файлов
-            stagedisp       - функция или метод класса, получает один параметр -
-                              строку с названием стадии процесса;
-            progressdisp    - функция или метод класса, получает следующие параметры:
-                              1: экземпляр класса PhotoStatistics (т.е. self),
-                              2: float - значение прогресса;
-                                  при значении < 0 прогрессбар отображается
-                                  в режиме "пульсации";
-                              3: строка с сообщением о деталях процесса (м.б. пустой).
-                              Функция должна возвращать булевское значение:
-                                True - перейти к следующему файлу,
-                                False - прервать работу.
+        focobj = self.statFocals.get(focal)
+        if focobj is None:
+            focobj = FocalLengthStatistics(focal)
+            self.statFocals[focal] = focobj
 
-        Возвращает кортеж из двух элементов:
-        1. булевское значение - True, если сбор завершен (в т.ч. с ошибкой),
-           False, если сбор прерван пользователем;
-        2. None или пустая строка, если ошибок не было, или строка
-           с сообщением об ошибке."""
+        aobj = focobj.apertures.get(naperture)
+        if aobj is None:
+            aobj = ApertureStatistics(aperture)
+            focobj.apertures[naperture] = aobj
+
+        aobj.numPhotos += nphotos
+        focobj.totalPhotos += nphotos
+
+        # общая статистика по диафрагмам - сумма по всем ФР
+        aobj = self.statApertures.get(naperture)
+        if aobj is None:
+            aobj = ApertureStatistics(aperture)
+            self.statApertures[naperture] = aobj
+
+        aobj.numPhotos += nphotos
+
+    def add_file_result(self, md, quarantined, fext, size):
+        """Учёт результата обработки одного файла.
+
+        md          - экземпляр pstat_extract.photo_metadata или None,
+                      если метаданные получить не удалось;
+        quarantined - True, если файл не обработан из-за зависания
+                      или падения рабочего процесса (или уже был в карантине);
+        fext        - расширение файла (в нижнем регистре);
+        size        - размер файла (0, если неизвестен)."""
+
+        if md is not None:
+            self.add_photo_metadata(md)
+        else:
+            self.statFailedFiles += 1
+
+            if quarantined:
+                self.statQuarantinedFiles += 1
+
+        self.statProcessedFiles += 1
+        self.statBytesRead += size
+        self.statProcessedByExt[fext] = self.statProcessedByExt.get(fext, 0) + 1
+
+    def stream_photo_records(self, photodir, ftypes, progressdisp=None,
+            extractor=None, walker=None, throttle=None):
+        """Генератор, возвращающий метаданные снимков (экземпляры
+        photo_record) по мере просмотра каталогов и извлечения метаданных.
+
+        В отличие от PhotoStatistics.iter_photo_records(), список файлов,
+        индекс снимков и статистика по каталогам не создаются - в self
+        только накапливаются счётчики, т.е. расход памяти от количества
+        файлов не зависит. Поэтому сбор по выборке и поиск копий файлов
+        в этом режиме невозможны.
+
+        photodir, ftypes, extractor, walker, throttle - как у
+        PhotoStatistics.gather_photo_statistics();
+        progressdisp - None или функция с параметрами (экземпляр
+        статистики, -1, сообщение), которая должна вернуть False
+        для прерывания перебора.
+
+        Файлы, из которых не удалось извлечь метаданные, пропускаются.
+        В случае ошибки генерируется исключение OSError."""
+
+        photodir = os.path.normpath(photodir)
 
         if not os.path.exists(photodir):
-            return (True, 'Каталог "%s" не существует или недоступен' % photodir)
+            raise OSError('Каталог "%s" не существует или недоступен' % photodir)
 
         if not callable(progressdisp):
             progressdisp = lambda sobj, fraction, msg: True
 
-        if not callable(stagedisp):
-            stagedisp = lambda msg: None
+        if extractor is None:
+            extractor = MetadataExtractor()
 
-        allFiles = []
+        if walker is None:
+            walker = DirWalker()
 
-        stagedisp('Поиск файлов')
+        # файлы, отданные extractor'у и ещё не обработанные:
+        # ключи - порядковые номера файлов, значения - кортежи
+        # (путь, расширение, размер, время изменения)
+        pending = {}
+
+        def iter_items():
+            fileNo = 0
+
+            for dirpath, nfiles, files, npaired, nlinked in walker.walk(photodir, ftypes):
+                self.statTotalFiles += nfiles
+                self.statPairedFiles += npaired
+                self.statLinkedFiles += nlinked
+
+                for fname, fsize, fmtime in files:
+                    fpath = os.path.join(dirpath, fname)
+                    pending[fileNo] = (fpath, os.path.splitext(fname)[1].lower(), fsize, fmtime)
+                    self.statFoundFiles += 1
+
+                    yield (fileNo, fpath)
+                    fileNo += 1
+
+        if throttle is not None:
+            throttle.reset()
 
-        for root, dirs, files in os.walk(photodir):
-            for fname in files:
-                fpath = os.path.join(root, fname)
+            # ограничение - только для действительно читаемых файлов
+            extractor.pace = lambda items: throttle.paced(items, lambda fileNo: pending[fileNo][2],
+                lambda: progressdisp(self, -1,
+                    'Обработано файлов: %d (ограничение скорости)' % self.statProcessedFiles))
 
-                self.statTotalFiles += 1
+        extractor.fileStat = lambda fileNo: pending[fileNo][2:]
 
-                fext = os.path.splitext(fname)[1].lower()
+        try:
+            for r in extractor.process(iter_items()):
+                if r is not None:
+                    fileNo, md, status, seconds = r
+
+                    if throttle is not None and status in (extractor.STATUS_OK, extractor.STATUS_FAILED):
+                        throttle.add_latency(seconds)
+
+                    fpath, fext, fsize, fmtime = pending.pop(fileNo)
+                    quarantined = status not in (extractor.STATUS_OK, extractor.STATUS_FAILED)
 
-                if fext not in ftypes:
-                    continue
+                    self.add_file_result(md, quarantined, fext, fsize)
 
-                allFiles.append(fpath)
+                    if md is not None:
+                        yield photo_record(fpath, *md)
 
                 if not progressdisp(self, -1,
-                    'Всего файлов: %d, будет обработано: %d' % (self.statTotalFiles, len(allFiles))):
-                    return (False, None)
+                    'Найдено файлов: %d, обработано: %d' % (self.statFoundFiles, self.statProcessedFiles)):
+                    break
 
-        nFoundFiles = len(allFiles)
+        except ManifestError as ex:
+            raise OSError(str(ex))
 
-        if nFoundFiles:
-            stagedisp('Обработка метаданных')
+        finally:
+            extractor.pace = None
+            extractor.fileStat = None
 
-            for ixFile, fpath in enumerate(allFiles, 1):
-                self.__process_file_metadata(fpath)
+    # простые счётчики, которые складываются/вычитаются в merge_stats()
+    COUNTER_FIELDS = ('statTotalPhotos', 'statKnownFocals',
+        'statByISOSpeedTotal', 'statByYearTotal',
+        'statTotalFiles', 'statFoundFiles', 'statProcessedFiles',
+        'statFailedFiles', 'statQuarantinedFiles', 'statBytesRead',
+        'statPairedFiles', 'statDuplicateFiles', 'statLinkedFiles')
 
-                if not progressdisp(self, ixFile / nFoundFiles, 'Файл %d из %d' % (ixFile, nFoundFiles)):
-                    return (False, None)
+    def merge_stats(self, other, sign=1):
+        """Прибавление (при sign=1) или вычитание (при sign=-1)
+        счётчиков другого экземпляра AggregateStatistics.
+        Время выполнения зависит только от количества различных
+        значений ФР, диафрагм, дат и т.п., но не от количества снимков.
+        Обнулившиеся элементы словарей удаляются.
+        Признак statSampled при сложении объединяется, при вычитании
+        не меняется."""
 
-        return (True, None)
+        for name in self.COUNTER_FIELDS:
+            setattr(self, name, getattr(self, name) + sign * getattr(other, name))
+
+        if sign > 0:
+            self.statSampled |= other.statSampled
+
+        for focal, ofocobj in other.statFocals.items():
+            focobj = self.statFocals.get(focal)
+            if focobj is None:
+                focobj = FocalLengthStatistics(focal)
+                self.statFocals[focal] = focobj
+
+            focobj.totalPhotos += sign * ofocobj.totalPhotos
+
+            merge_aperture_stats(focobj.apertures, ofocobj.apertures, sign)
+
+            if focobj.totalPhotos <= 0:
+                del self.statFocals[focal]
+
+        merge_aperture_stats(self.statApertures, other.statApertures, sign)
+
+        for yearno, oyear in other.statByYear.items():
+            year = self.statByYear.get(yearno)
+            if year is None:
+                year = {}
+                self.statByYear[yearno] = year
+
+            merge_counters(year, oyear, sign)
+
+            if not year:
+                del self.statByYear[yearno]
+
+        merge_counters(self.statByISOSpeed, other.statByISOSpeed, sign)
+        merge_counters(self.statProcessedByExt, other.statProcessedByExt, sign)
+
+    def is_estimate(self):
+        """Возвращает True, если файлы обрабатывались в порядке случайной
+        выборки и обработаны не все найденные файлы, т.е. значения
+        счётчиков являются только оценками.
+        Прерванный обычный сбор статистики оценкой не считается."""
+
+        return self.statSampled and 0 < self.statProcessedFiles < self.statFoundFiles
+
+    def estimate_count(self, n):
+        """Оценка количества снимков во всём наборе файлов по количеству n
+        в обработанной выборке.
+
+        Возвращает кортеж из трёх целых - оценки и границ доверительного
+        интервала (см. CONFIDENCE_Z).
+        Интервал - интервал Уилсона (в отличие от нормального приближения
+        не вырождается в точку при n, равном нулю или объёму выборки)
+        с поправкой на конечность совокупности; для стратифицированной
+        выборки с пропорциональным размещением он получается с запасом."""
+
+        ns = self.statProcessedFiles
+        nt = self.statFoundFiles
+
+        if ns <= 0 or ns >= nt:
+            return (n, n, n)
+
+        p = n / ns
+
+        # эффективный объём выборки с учётом поправки на конечность совокупности
+        ne = ns * (nt - 1) / (nt - ns)
+
+        zz = CONFIDENCE_Z * CONFIDENCE_Z / ne
+        center = (p + zz / 2) / (1.0 + zz)
+        half = CONFIDENCE_Z * sqrt(p * (1.0 - p) / ne + zz / (4 * ne)) / (1.0 + zz)
+
+        # снимки и прочие файлы из выборки уже известны - границы
+        # не выходят за пределы, возможные при любых необработанных файлах
+        return (int(round(nt * p)),
+            max(n, int(floor(nt * max(0.0, center - half)))),
+            min(nt - ns + n, int(ceil(nt * min(1.0, center + half)))))
+
+    def count_str(self, n):
+        """Преобразование счётчика n в строку для отображения:
+        при полной статистике - просто число, при статистике по выборке -
+        оценка с доверительным интервалом."""
+
+        if not self.is_estimate():
+            return str(n)
+
+        return '~%d (%d–%d)' % self.estimate_count(n)
+
+    def get_sampling_str(self):
+        """Возвращает строку с пояснением о сборе статистики по выборке,
+        или пустую строку, если статистика полная."""
+
+        if not self.is_estimate():
+            return ''
+
+        return 'Оценка по случайной выборке: обработано %d из %d файлов (%s), доверительный интервал 95%%' % (self.statProcessedFiles,
+            self.statFoundFiles,
+            percents_str(self.statProcessedFiles, self.statFoundFiles))
+
+    def get_duplicates_str(self):
+        """Возвращает строку с пояснением о найденных копиях файлов,
+        или пустую строку, если копий нет или поиск копий не выполнялся."""
+
+        if not self.statDuplicateFiles:
+            return ''
+
+        return 'Копии файлов (%d) учтены один раз' % self.statDuplicateFiles
 
     class StatTable():
         """Вспомогательный класс для хранения сформированной таблицы
@@ -383,12 +621,31 @@ class PhotoStatistics():
 
         COL_SEPARATOR = '  '
 
-        def __init__(self, title):
+        def __init__(self, title, countstr=None, countcols=()):
+            """title     - заголовок таблицы;
+            countstr  - None или функция, преобразующая целое значение
+                        счётчика в строку (см. PhotoStatistics.count_str());
+            countcols - номера столбцов со значениями счётчиков,
+                        к которым применяется countstr."""
+
             self.title = title
             self.rows = []
 
+            self.countstr = countstr
+            self.countcols = countcols
+
+            # для таблиц, ячейки которых соответствуют группам снимков
+            # (см. get_stat_table_by_focals()) - ключи строк и столбцов:
+            # списки по числу строк и столбцов, где элементы - множества
+            # значений (напр. ФР), учтённых в строке (столбце), или None
+            # для заголовков и итогов (т.е. "любое значение")
+            self.rowKeys = []
+            self.colKeys = []
+
         def clear(self):
             self.rows.clear()
+            self.rowKeys.clear()
+            self.colKeys.clear()
 
         def __str__(self):
             """Форматирование статистики как текста,
@@ -405,7 +662,10 @@ class PhotoStatistics():
 
                 for row in self.rows:
                     for colix, col in enumerate(row):
-                        sv = str(col)
+                        if self.countstr is not None and isinstance(col, int) and colix in self.countcols:
+                            sv = self.countstr(col)
+                        else:
+                            sv = str(col)
                         svl = len(sv)
 
                         if svl > colWidths[colix]:
@@ -467,8 +727,11 @@ class PhotoStatistics():
         numCols = len(colHeaders)
         numDataCols = len(usedApertures)
 
-        table = self.StatTable('Статистика по фокусным расстояниям и значениям диафрагмы')
+        table = self.StatTable('Статистика по фокусным расстояниям и значениям диафрагмы',
+            self.__table_count_str(), range(1, numCols))
         table.rows.append(colHeaders)
+        table.colKeys = [None] + list(map(lambda nap: {nap}, usedApertures)) + [None]
+        table.rowKeys.append(None)
 
         #
         # фокусные расстояния - строки
@@ -513,6 +776,7 @@ class PhotoStatistics():
             row.append(focals.totalPhotos)
 
             table.rows.append(row)
+            table.rowKeys.append({focal})
 
         if otherFocals:
             rowOthers = [0] * (numDataCols)
@@ -532,8 +796,10 @@ class PhotoStatistics():
                         rowSummary[colix] += np
 
             table.rows.append([S_OTHER] + rowOthers + [totalOthers])
+            table.rowKeys.append(otherFocals)
 
         table.rows.append([S_TOTAL] + rowSummary + [sum(rowSummary)])
+        table.rowKeys.append(None)
 
         return table
 
@@ -541,7 +807,8 @@ class PhotoStatistics():
         """Получение таблицы статистики по годам.
         Возвращает экземпляр StatTable."""
 
-        table = self.StatTable('Количество снимков по годам и месяцам')
+        table = self.StatTable('Количество снимков по годам и месяцам',
+            self.__table_count_str(), (1,))
 
         for yearno, year in sorted(self.statByYear.items()):
             # номер года и кол-во снимков за год
@@ -564,18 +831,57 @@ class PhotoStatistics():
         return table
 
     def get_stat_table_by_iso(self):
-        table = self.StatTable('Количество снимков с учётом ISO Speed')
+        table = self.StatTable('Количество снимков с учётом ISO Speed',
+            self.__table_count_str(), (1,))
 
         for isoSpeed, nPhotos in sorted(self.statByISOSpeed.items()):
             table.rows.append([isoSpeed, nPhotos, percents_str(nPhotos, self.statByISOSpeedTotal)])
 
         return table
 
+    def __table_count_str(self):
+        # для StatTable: при статистике по выборке счётчики выводятся как оценки
+        return self.count_str if self.is_estimate() else None
+
+    def get_stat_data(self):
+        """Возвращает собранную статистику в виде словаря из простых
+        типов (для сериализации в JSON и т.п.).
+        Значения диафрагм - float, прочие значения - целые.
+        Неизвестные значения ФР и диафрагмы равны V_UNKNOWN."""
+
+        return {'totalFiles': self.statTotalFiles,
+            'foundFiles': self.statFoundFiles,
+            'processedFiles': self.statProcessedFiles,
+            'pairedFiles': self.statPairedFiles,
+            'duplicateFiles': self.statDuplicateFiles,
+            'linkedFiles': self.statLinkedFiles,
+            'totalPhotos': self.statTotalPhotos,
+            'estimate': self.is_estimate(),
+            'focals': [{'focal': focal,
+                        'total': fstat.totalPhotos,
+                        'apertures': [{'aperture': astat.value if nap != V_UNKNOWN else V_UNKNOWN,
+                                       'photos': astat.numPhotos} for nap, astat in sorted(fstat.apertures.items())]}
+                       for focal, fstat in sorted(self.statFocals.items())],
+            'years': [{'year': yearno,
+                       'total': year[0],
+                       'months': [{'month': month, 'photos': year[month]} for month in sorted(set(year.keys()) - {0})]}
+                      for yearno, year in sorted(self.statByYear.items())],
+            'yearsTotal': self.statByYearTotal,
+            'iso': [{'iso': isoSpeed, 'photos': nPhotos} for isoSpeed, nPhotos in sorted(self.statByISOSpeed.items())],
+            'isoTotal': self.statByISOSpeedTotal}
+
     def get_stat_tables_str(self):
-        return '\n\n'.join(map(str, (
-            self.get_stat_table_by_focals(),
+        tables = [self.get_stat_table_by_focals(),
             self.get_stat_table_by_year(),
-            self.get_stat_table_by_iso())))
+            self.get_stat_table_by_iso()]
+
+        if self.is_estimate():
+            tables.insert(0, self.get_sampling_str())
+
+        if self.statDuplicateFiles:
+            tables.insert(0, self.get_duplicates_str())
+
+        return '\n\n'.join(map(str, tables))
 
     def __repr__(self):
         return '%s(statTotalPhotos=%d, statFocals=%s, statApertures=%s, statKnownFocals=%d, statByYear=%s, statByYearTotal=%d, statByISOSpeed=%s, statByISOSpeedTotal=%d, statTotalFiles=%d)' % (self.__class__.__name__,
@@ -590,6 +896,698 @@ class PhotoStatistics():
             self.statTotalFiles)
 
 
+
+class DirStatNode():
+    """Узел дерева каталогов со статистикой по всем снимкам каталога
+    и его подкаталогов (см. PhotoStatistics.dirTree)."""
+
+    def __init__(self, path, parent=None):
+        # полный путь к каталогу (os.path.normpath)
+        self.path = path
+
+        # None (для корневого каталога) или экземпляр DirStatNode
+        self.parent = parent
+
+        # ключи - имена подкаталогов, значения - экземпляры DirStatNode
+        self.children = {}
+
+        # статистика по каталогу вместе с подкаталогами
+        self.stats = AggregateStatistics()
+
+    def get_name(self):
+        return os.path.basename(self.path) or self.path
+
+    def iter_nodes(self):
+        """Генератор, возвращающий сам узел и все вложенные узлы."""
+
+        stack = [self]
+
+        while stack:
+            node = stack.pop()
+            yield node
+
+            stack.extend(node.children.values())
+
+    def __repr__(self):
+        return '%s(path=%s, children=%d, photos=%d)' % (self.__class__.__name__,
+            self.path, len(self.children), self.stats.statTotalPhotos)
+
+
+class PhotoStatistics(AggregateStatistics):
+    """Статистика по использованным фокусным расстояниям и диафрагмам.
+
+    Порядок операций:
+    1. Создание экземпляра класса (или вызов метода clear() существующего
+       экземпляра).
+    2. Вызов метода gather_photo_statistics().
+    3. Вызов методов get_stat_table_*() для получения финального результата.
+    4. При необходимости - вызов rescan_subtree() для обновления
+       статистики по одному из подкаталогов.
+
+    Кроме общей статистики, собирается статистика по каждому каталогу
+    с учётом подкаталогов (см. dirTree, get_dir_node()).
+
+    Также см. описания методов."""
+
+    def __init__(self):
+        super().__init__()
+
+        # таблица путей файлов, отобранных для обработки
+        # (экземпляр PathTable); номера файлов в ней могут
+        # использоваться вместо полных путей
+        self.files = PathTable()
+
+        # "поколение" статистики - увеличивается при каждом изменении
+        # (сбросе и завершении сбора); может использоваться внешними
+        # потребителями для проверки актуальности данных
+        self.generation = 0
+
+        # дерево каталогов со статистикой: None или экземпляр DirStatNode
+        # для каталога, переданного gather_photo_statistics();
+        # содержит только каталоги, в которых (или в подкаталогах
+        # которых) есть файлы
+        self.dirTree = None
+
+        # ключи - пути каталогов (os.path.normpath), значения - экземпляры
+        # DirStatNode из dirTree
+        self.dirNodes = {}
+
+        # индекс "ячейка таблицы статистики - номера файлов в self.files"
+        # (экземпляр BucketIndex), см. get_bucket_file_ids()
+        self.index = BucketIndex()
+
+        # метаданные снимков по столбцам (экземпляр PhotoTable) -
+        # для пересчёта статистики по отобранным снимкам,
+        # см. get_filtered_stats()
+        self.photos = PhotoTable()
+
+    def clear(self):
+        """Сброс статистики (перед повторным сбором)."""
+
+        super().clear()
+
+        self.files.clear()
+        self.index.clear()
+        self.photos.clear()
+
+        self.dirTree = None
+        self.dirNodes.clear()
+
+        self.generation += 1
+
+    def get_stat_data(self):
+        d = super().get_stat_data()
+        d['generation'] = self.generation
+
+        return d
+
+    def get_dir_node(self, dirpath):
+        """Возвращает экземпляр DirStatNode для каталога dirpath
+        или None, если такого каталога в дереве нет."""
+
+        return self.dirNodes.get(os.path.normpath(dirpath))
+
+    def get_bucket_file_ids(self, kind, match=None, dirpath=None):
+        """Возвращает отсортированный массив номеров файлов (в self.files),
+        учтённых в ячейках таблиц статистики.
+
+        kind    - вид ячеек (pstat_index.BUCKET_*);
+        match   - None (все ячейки этого вида) или функция, получающая
+                  ключ ячейки (кортеж, см. pstat_index) и возвращающая
+                  True для нужных ячеек;
+        dirpath - None или путь каталога, которым (вместе с подкаталогами)
+                  следует ограничить выборку.
+
+        Для статистики, восстановленной из снимка (см. set_dir_tree()),
+        списка файлов нет - возвращается пустой массив."""
+
+        ids = self.index.get_file_ids(kind, match)
+
+        if dirpath is None or self.dirTree is None:
+            return ids
+
+        dirpath = os.path.normpath(dirpath)
+        if dirpath == self.dirTree.path:
+            return ids
+
+        subprefix = os.path.join(dirpath, '')
+
+        dirIds = {dirId for dirId, dpath in enumerate(self.files.dirs)
+            if dpath == dirpath or dpath.startswith(subprefix)}
+
+        return array('I', filter(lambda fileId: self.files.fileDirs[fileId] in dirIds, ids))
+
+    def __add_dir_node(self, dirpath):
+        """Возвращает узел дерева для каталога dirpath, при необходимости
+        создавая его и недостающие узлы родительских каталогов.
+        Каталог должен находиться внутри self.dirTree.path."""
+
+        node = self.dirNodes.get(dirpath)
+
+        if node is None:
+            parent = self.__add_dir_node(os.path.dirname(dirpath))
+
+            node = DirStatNode(dirpath, parent)
+            parent.children[os.path.basename(dirpath)] = node
+            self.dirNodes[dirpath] = node
+
+        return node
+
+    def __build_dir_tree(self, photodir, dirStats):
+        """Построение дерева каталогов.
+        dirStats - словарь, где ключи - пути каталогов, а значения -
+        экземпляры AggregateStatistics со статистикой по файлам,
+        находящимся непосредственно в этих каталогах.
+        Статистика суммируется снизу вверх - по одному сложению
+        на каталог."""
+
+        self.dirTree = DirStatNode(photodir)
+        self.dirNodes = {photodir: self.dirTree}
+
+        for dirpath, dstats in dirStats.items():
+            self.__add_dir_node(dirpath).stats.merge_stats(dstats)
+
+        # глубина каталога однозначно определяется количеством разделителей
+        # в пути, т.е. при обходе в порядке убывания глубины каждый узел
+        # прибавляется к родительскому после всех своих подкаталогов
+        for node in sorted(self.dirNodes.values(), key=lambda n: n.path.count(os.sep), reverse=True):
+            if node.parent is not None:
+                node.parent.stats.merge_stats(node.stats)
+
+    def get_filtered_stats(self, photoFilter, dirpath=None):
+        """Пересчёт статистики только по снимкам, удовлетворяющим
+        условию, без повторного просмотра файлов.
+
+        photoFilter - экземпляр pstat_filter.PhotoFilter;
+        dirpath     - None или путь каталога, которым (вместе
+                      с подкаталогами) следует ограничить отбор.
+
+        Возвращает экземпляр AggregateStatistics; при пустом условии -
+        уже собранную статистику (общую или каталога dirpath) без
+        пересчёта и копирования.
+        Для статистики, восстановленной из снимка (см. set_dir_tree()),
+        метаданных отдельных снимков нет - при непустом условии
+        результат будет пустым."""
+
+        node = self.get_dir_node(dirpath) if dirpath is not None else None
+        base = node.stats if node is not None and node is not self.dirTree else self
+
+        if photoFilter.is_empty():
+            return base
+
+        return self.__aggregate_photos(photoFilter.get_mask(self, dirpath), base)
+
+    def __aggregate_photos(self, mask, base):
+        """Подсчёт статистики по снимкам, отмеченным в mask
+        (см. pstat_filter.PhotoFilter.get_mask()), по столбцам self.photos.
+        base - статистика, из которой берутся счётчики обработанных
+        файлов (для оценок при сборе по выборке)."""
+
+        pt = self.photos
+        stats = AggregateStatistics()
+
+        def column(name):
+            return compress(getattr(pt, name), mask)
+
+        nselected = mask.count(1)
+
+        # каждый Counter - один проход по столбцам на стороне C
+        for (focal, naperture), nphotos in Counter(zip(column('focal'), column('naperture'))).items():
+            stats.add_focal_aperture_count(focal, naperture, pt.apertureValues[naperture], nphotos)
+
+        for (yearno, month), nphotos in Counter(zip(column('year'), column('month'))).items():
+            if yearno <= 0:
+                continue
+
+            year = stats.statByYear.setdefault(yearno, {0: 0})
+            year[month] = nphotos
+            year[0] += nphotos
+
+            stats.statByYearTotal += nphotos
+
+        for isoSpeed, nphotos in Counter(column('iso')).items():
+            if isoSpeed > 0:
+                stats.statByISOSpeed[isoSpeed] = nphotos
+                stats.statByISOSpeedTotal += nphotos
+
+        for code, nfiles in Counter(column('ext')).items():
+            stats.statProcessedByExt[pt.exts.values[code]] = nfiles
+
+        stats.statTotalPhotos = nselected
+        stats.statKnownFocals = nselected
+
+        # отношение обработанных файлов к найденным - как у исходной
+        # статистики, иначе оценки по выборке были бы неправильными
+        stats.statTotalFiles = base.statTotalFiles
+        stats.statFoundFiles = base.statFoundFiles
+        stats.statProcessedFiles = base.statProcessedFiles
+        stats.statSampled = base.statSampled
+        stats.statPairedFiles = base.statPairedFiles
+        stats.statDuplicateFiles = base.statDuplicateFiles
+        stats.statLinkedFiles = base.statLinkedFiles
+
+        return stats
+
+    def set_dir_tree(self, photodir, dirTotals):
+        """Замена всей статистики готовой статистикой по дереву каталогов
+        (напр. при восстановлении из файла - см. pstat_snapshot).
+
+        photodir    - путь к корневому каталогу;
+        dirTotals   - словарь, где ключи - пути каталогов (включая
+                      photodir), а значения - экземпляры AggregateStatistics
+                      со статистикой по каталогам с учётом подкаталогов.
+
+        Общая статистика берётся из статистики photodir.
+        Список файлов (self.files) остаётся пустым."""
+
+        self.clear()
+
+        photodir = os.path.normpath(photodir)
+
+        self.dirTree = DirStatNode(photodir)
+        self.dirNodes = {photodir: self.dirTree}
+
+        # родительские каталоги - раньше подкаталогов
+        for dirpath in sorted(dirTotals, key=lambda p: p.count(os.sep)):
+            self.__add_dir_node(dirpath).stats = dirTotals[dirpath]
+
+        self.merge_stats(self.dirTree.stats)
+
+    def rescan_subtree(self, subdir, ftypes, stagedisp=None, progressdisp=None,
+            sampling=False, extractor=None, walker=None):
+        """Повторный сбор статистики только по каталогу subdir (вместе
+        с подкаталогами), который должен находиться внутри каталога,
+        ранее переданного gather_photo_statistics().
+
+        Старая статистика по subdir вычитается из статистики всех
+        родительских каталогов (и общей), новая - прибавляется,
+        т.е. прочие каталоги заново не просматриваются.
+        Номера файлов в self.files после вызова меняются.
+
+        Параметры и возвращаемое значение - как у gather_photo_statistics().
+        Копии файлов (см. параметр dedup gather_photo_statistics())
+        при обновлении не ищутся.
+        При прерывании или ошибке статистика остаётся прежней."""
+
+        if self.dirTree is None:
+            return (True, 'Статистика ещё не собрана')
+
+        subdir = os.path.normpath(subdir)
+        rootdir = self.dirTree.path
+
+        if subdir != rootdir and not subdir.startswith(os.path.join(rootdir, '')):
+            return (True, 'Каталог "%s" находится вне каталога "%s"' % (subdir, rootdir))
+
+        substats = PhotoStatistics()
+
+        if os.path.isdir(subdir):
+            ok, em = substats.gather_photo_statistics(subdir, ftypes, stagedisp, progressdisp,
+                sampling, None, extractor, walker)
+            if em or not ok:
+                return (ok, em)
+
+        # если каталог удалён - его статистика просто вычитается
+        newNode = substats.dirTree
+        oldNode = self.dirNodes.get(subdir)
+
+        # вычитаем старое, прибавляем новое - по разу на каждый уровень вложенности
+        node = self.__add_dir_node(os.path.dirname(subdir)) if subdir != rootdir else None
+
+        while node is not None:
+            if oldNode is not None:
+                node.stats.merge_stats(oldNode.stats, -1)
+
+            if newNode is not None:
+                node.stats.merge_stats(newNode.stats)
+
+            node = node.parent
+
+        if oldNode is not None:
+            self.merge_stats(oldNode.stats, -1)
+
+        self.merge_stats(substats)
+
+        # заменяем поддерево
+        if oldNode is not None:
+            for node in oldNode.iter_nodes():
+                del self.dirNodes[node.path]
+
+        if subdir == rootdir:
+            self.dirTree = newNode if newNode is not None else DirStatNode(rootdir)
+            self.dirNodes[rootdir] = self.dirTree
+        else:
+            parent = self.dirNodes[os.path.dirname(subdir)]
+            name = os.path.basename(subdir)
+
+            if newNode is not None:
+                newNode.parent = parent
+                parent.children[name] = newNode
+            elif name in parent.children:
+                del parent.children[name]
+
+        self.dirNodes.update(substats.dirNodes)
+
+        # и список файлов
+        subprefix = os.path.join(subdir, '')
+
+        idMap = self.files.remove_dirs({dirId for dirId, dirpath in enumerate(self.files.dirs)
+            if dirpath == subdir or dirpath.startswith(subprefix)})
+
+        if idMap is not None:
+            self.index.remap(idMap)
+            self.photos.remap(idMap)
+
+        self.index.extend(substats.index, len(self.files))
+        self.index.finish()
+
+        self.photos.resize(len(self.files))
+        self.photos.extend(substats.photos)
+
+        self.files.extend(substats.files)
+
+        self.generation += 1
+
+        return (True, None)
+
+    def get_stratified_order(self):
+        """Возвращает массив номеров файлов из self.files в порядке
+        обработки для сбора статистики по выборке.
+
+        Файлы разбиваются на страты по каталогу и расширению, внутри
+        страты перемешиваются, после чего страты чередуются
+        пропорционально своему размеру. Таким образом любое начало
+        последовательности является стратифицированной случайной
+        выборкой, и при продолжении обработки оценки уточняются
+        вплоть до точных значений."""
+
+        strata = {}
+
+        for fileId in range(len(self.files)):
+            key = (self.files.get_dir_id(fileId),
+                os.path.splitext(self.files.get_name(fileId))[1].lower())
+
+            if key in strata:
+                strata[key].append(fileId)
+            else:
+                strata[key] = array('L', (fileId,))
+
+        rnd = random.random
+        keys = []
+
+        for stratum in strata.values():
+            random.shuffle(stratum)
+
+            ns = len(stratum)
+            for ix, fileId in enumerate(stratum):
+                # позиция файла в общей последовательности пропорциональна
+                # его позиции в страте; случайный сдвиг - чтобы страты
+                # одинакового размера не шли всегда в одном порядке
+                keys.append(((ix + rnd()) / ns, fileId))
+
+        keys.sort()
+
+        return array('L', map(lambda k: k[1], keys))
+
+    def gather_photo_statistics(self, photodir, ftypes, stagedisp=None, progressdisp=None,
+            sampling=False, profiler=None, extractor=None, walker=None, dedup=None, throttle=None):
+        """Поиск файлов фотографий и учёт их метаданных.
+
+        Параметры:
+            photodir        - строка с путём к каталогу с фотографиями;
+            ftypes          - множество (set) допустимых расширений имен файлов
+            stagedisp       - функция или метод класса, получает один параметр -
+                              строку с названием стадии процесса;
+            progressdisp    - функция или метод класса, получает следующие параметры:
+                              1: экземпляр класса PhotoStatistics (т.е. self),
+                              2: float - значение прогресса;
+                                  при значении < 0 прогрессбар отображается
+                                  в режиме "пульсации";
+                              3: строка с сообщением о деталях процесса (м.б. пустой).
+                              Функция должна возвращать булевское значение:
+                                True - перейти к следующему файлу,
+                                False - прервать работу.
+            sampling        - если True, файлы обрабатываются в порядке
+                              стратифицированной случайной выборки
+                              (см. get_stratified_order()); при прерывании
+                              обработки метаданных собранная статистика
+                              остаётся пригодной для оценки
+                              (см. is_estimate(), estimate_count()).
+            profiler        - None или экземпляр pstat_profile.ScanProfiler
+                              для сбора данных о времени выполнения стадий;
+                              отчёт формируется вызывающей стороной
+                              (ScanProfiler.get_report(self.files)).
+            extractor       - None (метаданные извлекаются в текущем процессе)
+                              или экземпляр pstat_extract.MetadataExtractor
+                              (или его потомка - напр. ExtractorPool);
+                              закрывается вызывающей стороной.
+            walker          - None (каталоги просматриваются в текущем потоке)
+                              или экземпляр pstat_walk.DirWalker (или
+                              pstat_manifest.ManifestWalker - список файлов
+                              берётся из манифеста);
+            dedup           - None или экземпляр pstat_dedup.DuplicateFinder
+                              для поиска копий файлов (копии не обрабатываются
+                              и в статистике не учитываются, см. statDuplicateFiles);
+                              отчёт формируется вызывающей стороной
+                              (DuplicateFinder.get_report(self.files));
+            throttle        - None или экземпляр pstat_throttle.ScanThrottle
+                              для ограничения скорости обработки файлов.
+
+        Возвращает кортеж из двух элементов:
+        1. булевское значение - True, если сбор завершен (в т.ч. с ошибкой),
+           False, если сбор прерван пользователем;
+        2. None или пустая строка, если ошибок не было, или строка
+           с сообщением об ошибке."""
+
+        records = self.__gather_records(photodir, ftypes, stagedisp, progressdisp,
+            sampling, profiler, extractor, walker, dedup, throttle)
+
+        # записи о снимках здесь не нужны, нужен только результат
+        while True:
+            try:
+                next(records)
+            except StopIteration as ex:
+                return ex.value
+
+    def iter_photo_records(self, photodir, ftypes, stagedisp=None, progressdisp=None,
+            sampling=False, profiler=None, extractor=None, walker=None, dedup=None, throttle=None):
+        """Генератор, возвращающий метаданные снимков по мере их
+        извлечения - в виде экземпляров photo_record.
+
+        Параметры - те же, что у gather_photo_statistics(); статистика
+        собирается так же, т.е. после окончания перебора доступна
+        как обычно (вместе со списком файлов, индексом снимков
+        и статистикой по каталогам - их объём пропорционален количеству
+        файлов). Первые записи возвращаются только после просмотра всех
+        каталогов (и поиска копий файлов).
+        Если статистика не нужна - см. stream_photo_records().
+
+        Файлы, из которых не удалось извлечь метаданные, пропускаются.
+        При прерывании сбора (progressdisp вернула False) перебор
+        заканчивается, в случае ошибки генерируется исключение OSError."""
+
+        ok, em = yield from self.__gather_records(photodir, ftypes, stagedisp, progressdisp,
+            sampling, profiler, extractor, walker, dedup, throttle)
+
+        if em:
+            raise OSError(em)
+
+    def __gather_records(self, photodir, ftypes, stagedisp, progressdisp,
+            sampling, profiler, extractor, walker, dedup, throttle):
+        # генератор для gather_photo_statistics() и iter_photo_records();
+        # возвращает (через StopIteration) то же, что и gather_photo_statistics()
+
+        if not os.path.exists(photodir):
+            return (True, 'Каталог "%s" не существует или недоступен' % photodir)
+
+        if not callable(progressdisp):
+            progressdisp = lambda sobj, fraction, msg: True
+
+        if not callable(stagedisp):
+            stagedisp = lambda msg: None
+
+        if extractor is None:
+            extractor = MetadataExtractor()
+
+        if walker is None:
+            walker = DirWalker()
+
+        extractor.profiler = profiler
+        try:
+            return (yield from self.__gather_photo_statistics(photodir, ftypes, stagedisp, progressdisp,
+                sampling, profiler, extractor, walker, dedup, throttle))
+        except ManifestError as ex:
+            return (True, str(ex))
+        finally:
+            extractor.profiler = None
+            extractor.pace = None
+            extractor.fileStat = None
+
+    def __gather_photo_statistics(self, photodir, ftypes, stagedisp, progressdisp,
+            sampling, prof, extractor, walker, dedup, throttle):
+        # пути каталогов в дереве статистики (см. dirNodes) должны совпадать
+        # с путями в self.files, потому нормализуем их сразу
+        photodir = os.path.normpath(photodir)
+
+        dirs = walker.walk(photodir, ftypes)
+
+        if prof:
+            progressdisp = prof.timed_call(progressdisp, prof.STAGE_CALLBACKS)
+            dirs = prof.timed_iter(dirs, prof.STAGE_WALK)
+
+        # статистика по файлам, находящимся непосредственно в каталогах:
+        # ключи - пути каталогов, значения - экземпляры AggregateStatistics
+        dirStats = {}
+        # то же, но ключи - номера каталогов в self.files
+        dirStatsById = {}
+
+        stagedisp('Поиск файлов')
+
+        for root, nfiles, files, npaired, nlinked in dirs:
+            if not nfiles:
+                continue
+
+            # каталог может возвращаться несколько раз (см. pstat_manifest)
+            dstats = dirStats.get(root)
+            if dstats is None:
+                dstats = AggregateStatistics()
+                dirStats[root] = dstats
+
+            dstats.statTotalFiles += nfiles
+            dstats.statPairedFiles += npaired
+            dstats.statLinkedFiles += nlinked
+
+            self.statTotalFiles += nfiles
+            self.statPairedFiles += npaired
+            self.statLinkedFiles += nlinked
+
+            # каталог добавляем в таблицу только при наличии в нём нужных файлов
+            if not files:
+                continue
+
+            dirId = self.files.add_dir(root)
+            dirStatsById[dirId] = dstats
+
+            for fname, fsize, fmtime in files:
+                self.files.add_file(dirId, fname, fsize, fmtime)
+                dstats.statFoundFiles += 1
+                self.statFoundFiles += 1
+
+                if not progressdisp(self, -1,
+                    'Всего файлов: %d, будет обработано: %d' % (self.statTotalFiles, len(self.files))):
+                    return (False, None)
+
+        self.photos.resize(len(self.files))
+
+        duplicates = None
+
+        if dedup is not None and len(self.files) > 1:
+            stagedisp('Поиск копий файлов')
+
+            def dedup_progress(ndone, ntotal):
+                return progressdisp(self, ndone / ntotal,
+                    'Проверено файлов: %d из %d' % (ndone, ntotal))
+
+            duplicates = dedup.find(self.files, dedup_progress)
+            if duplicates is None:
+                return (False, None)
+
+            for fileId in duplicates:
+                dstats = dirStatsById[self.files.get_dir_id(fileId)]
+                dstats.statFoundFiles -= 1
+                dstats.statDuplicateFiles += 1
+
+            self.statDuplicateFiles = len(duplicates)
+            self.statFoundFiles -= len(duplicates)
+
+        # копии файлов остаются в self.files (номера файлов не меняются),
+        # но не обрабатываются
+        nFoundFiles = self.statFoundFiles
+
+        # при прерывании обработки метаданных дерево каталогов всё равно
+        # строим - при сборе по выборке его статистика пригодна для оценки
+        completed = True
+
+        if nFoundFiles:
+            if sampling:
+                stagedisp('Обработка метаданных (по случайной выборке)')
+                fileIds = self.get_stratified_order()
+
+                self.statSampled = True
+                for dstats in dirStatsById.values():
+                    dstats.statSampled = True
+            else:
+                stagedisp('Обработка метаданных')
+                fileIds = None
+
+            if fileIds is None:
+                fileIds = range(len(self.files))
+
+            if duplicates:
+                fileIds = array('L', filter(lambda fileId: fileId not in duplicates, fileIds))
+
+            items = map(lambda fileId: (fileId, self.files.get_path(fileId)), fileIds)
+
+            extractor.fileStat = lambda fileId: (self.files.get_size(fileId), self.files.get_mtime(fileId))
+
+            if throttle is not None:
+                throttle.reset()
+
+                # ограничение - только для действительно читаемых файлов;
+                # во время ожидания обновляем прогресс (и проверяем,
+                # не прервана ли обработка)
+                extractor.pace = lambda items: throttle.paced(items, self.files.get_size,
+                    lambda: progressdisp(self, self.statProcessedFiles / nFoundFiles,
+                        'Файл %d из %d (ограничение скорости)' % (self.statProcessedFiles, nFoundFiles)))
+
+            for r in extractor.process(items):
+                if r is not None:
+                    fileId, md, status, seconds = r
+
+                    if throttle is not None and status in (extractor.STATUS_OK, extractor.STATUS_FAILED):
+                        throttle.add_latency(seconds)
+
+                    fext = os.path.splitext(self.files.get_name(fileId))[1].lower()
+                    quarantined = status not in (extractor.STATUS_OK, extractor.STATUS_FAILED)
+                    fsize = self.files.get_size(fileId)
+
+                    self.add_file_result(md, quarantined, fext, fsize)
+                    dirStatsById[self.files.get_dir_id(fileId)].add_file_result(md, quarantined, fext, fsize)
+
+                    if prof:
+                        prof.add_file(fileId, self.files.get_dir_id(fileId), fext, seconds)
+
+                    if md is not None:
+                        aperture = md.aperture if md.aperture > 0.0 else float(V_UNKNOWN)
+                        naperture = normalized_aperture(aperture)
+
+                        self.index.add_file(fileId, md.focal, naperture, md.year, md.month, md.iso)
+                        self.photos.set_row(fileId, md, naperture, aperture, fext)
+
+                        yield photo_record(self.files.get_path(fileId), *md)
+
+                # r is None - рабочие процессы ещё думают, а мы пока обновим прогресс
+                if not progressdisp(self, self.statProcessedFiles / nFoundFiles,
+                    'Файл %d из %d' % (self.statProcessedFiles, nFoundFiles)):
+                    completed = False
+                    break
+
+            if throttle is not None and throttle.aborted:
+                completed = False
+
+        stagedisp('Построение дерева каталогов')
+
+        self.index.finish()
+
+        self.__build_dir_tree(photodir, dirStats)
+
+        if not completed:
+            return (False, None)
+
+        self.generation += 1
+
+        return (True, None)
+
+
 def __test_scan_photos():
     from pstat_config import Configuration, get_config_file_name
 
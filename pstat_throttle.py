@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_throttle.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Ограничение скорости обработки файлов - для сбора статистики
+# "в фоне" на общем хранилище (NAS), которым в это же время пользуются
+# другие люди.
+#
+# Файлы передаются на обработку не чаще, чем позволяют два "ведра
+# с жетонами" (token bucket) - по количеству файлов и по объёму
+# в секунду. Если время обработки файла (в основном - ожидание
+# хранилища) растёт выше порога, т.е. хранилище и так загружено,
+# скорость временно снижается (вдвое за раз), а затем понемногу
+# восстанавливается до заданной.
+
+
+from time import monotonic, sleep
+
+
+class TokenBucket():
+    """Ведро с жетонами: rate жетонов в секунду, не более burst
+    в запасе. Жетоны можно брать "в долг" (напр. для файла, размер
+    которого больше burst) - тогда следующего ожидания будет
+    соответственно больше, т.е. средняя скорость сохраняется."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+
+        self.reset()
+
+    def reset(self):
+        self.tokens = self.burst
+        self.updated = monotonic()
+
+    def __refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_delay(self):
+        """Возвращает время в секундах, через которое жетоны
+        появятся (0 - уже есть)."""
+
+        self.__refill()
+
+        return 0.0 if self.tokens > 0 else -self.tokens / self.rate + 1e-3
+
+    def take(self, n):
+        self.__refill()
+        self.tokens -= n
+
+
+class ScanThrottle():
+    """Ограничение скорости передачи файлов на обработку.
+
+    Используется в PhotoStatistics.gather_photo_statistics() (параметр
+    throttle): paced() оборачивает последовательность файлов, которые
+    экземпляр pstat_extract.MetadataExtractor действительно читает (см.
+    MetadataExtractor.pace), т.е. файлы, метаданные которых взяты из баз
+    каталогизаторов или кэша, и файлы из карантина не учитываются;
+    время обработки каждого файла передаётся в add_latency().
+
+    Ограничение объёма - по суммарному размеру читаемых файлов, а не по
+    объёму фактически прочитанных данных: метаданные читаются только из
+    начала файла (и из мест, на которые ссылается EXIF), т.е. реальный
+    объём чтения обычно намного меньше, и ограничение - оценка сверху."""
+
+    # максимальная продолжительность одного ожидания в секундах -
+    # между ожиданиями вызывается функция tick (для обновления UI)
+    TICK = 0.2
+
+    # коэффициент сглаживания времени обработки файла
+    LATENCY_ALPHA = 0.2
+
+    # минимальный интервал между последовательными снижениями скорости
+    # (в секундах) - чтобы дать хранилищу отреагировать
+    BACKOFF_INTERVAL = 2.0
+
+    # минимальная доля от заданной скорости
+    MIN_FACTOR = 1.0 / 32
+
+    # прибавка к доле от заданной скорости за каждый файл, обработанный
+    # быстрее порога
+    RECOVERY_STEP = 0.01
+
+    def __init__(self, filesPerSec=0.0, bytesPerSec=0.0, latencyThreshold=0.0):
+        """filesPerSec      - максимальное количество файлов в секунду;
+        bytesPerSec         - максимальный объём файлов в байтах в секунду;
+        latencyThreshold    - порог времени обработки файла в секундах,
+                              при превышении которого скорость снижается.
+        Нулевые значения - без ограничения."""
+
+        self.filesPerSec = filesPerSec
+        self.bytesPerSec = bytesPerSec
+        self.latencyThreshold = latencyThreshold
+
+        # запас - на секунду работы (для файлов - не менее одного)
+        self.fileBucket = TokenBucket(filesPerSec, max(1.0, filesPerSec)) if filesPerSec > 0 else None
+        self.byteBucket = TokenBucket(bytesPerSec, bytesPerSec) if bytesPerSec > 0 else None
+
+        self.reset()
+
+    def reset(self):
+        """Сброс состояния (перед очередным сбором статистики)."""
+
+        # доля от заданной скорости (снижается при росте времени обработки)
+        self.factor = 1.0
+        self.__set_rates()
+
+        for bucket in (self.fileBucket, self.byteBucket):
+            if bucket is not None:
+                bucket.reset()
+
+        # сглаженное время обработки файла (None - ещё не известно)
+        self.latency = None
+        self.lastBackoff = 0.0
+
+        # обработка прервана через функцию tick (см. paced())
+        self.aborted = False
+
+        # статистика для отчёта
+        self.nWaits = 0
+        self.waitSeconds = 0.0
+        self.nBackoffs = 0
+        self.minFactor = 1.0
+
+    def __set_rates(self):
+        if self.fileBucket is not None:
+            self.fileBucket.rate = self.filesPerSec * self.factor
+
+        if self.byteBucket is not None:
+            self.byteBucket.rate = self.bytesPerSec * self.factor
+
+    def get_delay(self):
+        """Возвращает время в секундах, через которое можно передать
+        на обработку следующий файл."""
+
+        return max((bucket.get_delay() for bucket in (self.fileBucket, self.byteBucket) if bucket is not None),
+            default=0.0)
+
+    def consume(self, size):
+        """Учёт файла размером size байт, переданного на обработку."""
+
+        if self.fileBucket is not None:
+            self.fileBucket.take(1)
+
+        if self.byteBucket is not None:
+            self.byteBucket.take(size)
+
+    def add_latency(self, seconds):
+        """Учёт времени обработки очередного файла в секундах."""
+
+        if self.latencyThreshold <= 0:
+            return
+
+        self.latency = seconds if self.latency is None else self.latency + (seconds - self.latency) * self.LATENCY_ALPHA
+
+        if self.latency > self.latencyThreshold:
+            now = monotonic()
+
+            if now - self.lastBackoff >= self.BACKOFF_INTERVAL and self.factor > self.MIN_FACTOR:
+                self.factor = max(self.MIN_FACTOR, self.factor / 2)
+                self.minFactor = min(self.minFactor, self.factor)
+                self.lastBackoff = now
+                self.nBackoffs += 1
+
+                self.__set_rates()
+        elif self.factor < 1.0:
+            self.factor = min(1.0, self.factor + self.RECOVERY_STEP)
+            self.__set_rates()
+
+    def paced(self, items, sizeof, tick=None):
+        """Генератор, возвращающий элементы items не быстрее, чем
+        позволяют ограничения.
+
+        items   - итерируемый объект, возвращающий кортежи (fileId, путь)
+                  или None (см. pstat_extract.MetadataExtractor.process());
+                  None возвращается без ожидания и не учитывается;
+        sizeof  - функция, получающая fileId и возвращающая размер файла;
+        tick    - None или функция без параметров, вызываемая во время
+                  ожидания не реже раза в TICK секунд; если она вернёт
+                  False, перебор заканчивается, а self.aborted становится
+                  равным True."""
+
+        for item in items:
+            if item is None:
+                yield item
+                continue
+
+            while True:
+                delay = self.get_delay()
+                if delay <= 0:
+                    break
+
+                delay = min(delay, self.TICK)
+                sleep(delay)
+
+                self.nWaits += 1
+                self.waitSeconds += delay
+
+                if tick is not None and not tick():
+                    self.aborted = True
+                    return
+
+            self.consume(sizeof(item[0]))
+
+            yield item
+
+    def get_summary_str(self):
+        """Возвращает строку с итогами ограничения скорости."""
+
+        return 'Ограничение скорости: ожидание %.1f с, снижений скорости: %d (до %d%% от заданной)' % (self.waitSeconds,
+            self.nBackoffs, int(round(self.minFactor * 100)))
+
+
+def create_throttle(config):
+    """Создаёт экземпляр ScanThrottle, если ограничение скорости включено
+    в настройках config (экземпляр pstat_config.Configuration),
+    иначе возвращает None."""
+
+    if not config.cfgThrottle:
+        return None
+
+    return ScanThrottle(config.cfgThrottleFilesPerSec,
+        config.cfgThrottleMBytesPerSec * 1024 * 1024,
+        config.cfgThrottleLatency)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    throttle = ScanThrottle(50, 1024 * 1024, 0.01)
+
+    t0 = monotonic()
+    n = 0
+
+    for fileId, fpath in throttle.paced(((i, 'file%d' % i) for i in range(100)), lambda fileId: 32 * 1024):
+        # каждый десятый файл "тормозит"
+        throttle.add_latency(0.05 if fileId % 10 == 0 else 0.001)
+        n += 1
+
+    print('%d files, %.2f s' % (n, monotonic() - t0))
+    print(throttle.get_summary_str())
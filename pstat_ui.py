@@ -0,0 +1,1046 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_ui.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+from gtktools import *
+from gi.repository import Gtk, Gdk, GObject, Pango, GLib
+
+import sys
+import os.path
+
+from time import strftime, localtime, monotonic
+from array import array
+from threading import Thread, current_thread
+
+from pstat_config import get_snapshot_file_name, get_cache_directory
+from pstat_stat import *
+from pstat_common import *
+from pstat_about import *
+from pstat_extract import create_extractor, remember_tuned_workers
+from pstat_walk import create_walker
+from pstat_snapshot import StatSnapshot
+from pstat_index import BUCKET_FA, BUCKET_DATE, BUCKET_ISO
+from pstat_filelist import FileListDialog
+
+# модули, нужные только при сборе статистики, оценке и отборе снимков,
+# импортируются там, где используются - дабы не тормозить запуск программы
+
+
+class PhotoStatUI():
+    PAGES_COUNT = 3
+    PAGE_START, PAGE_PROGRESS, PAGE_RESULT = range(PAGES_COUNT)
+    PAGE_LAST = PAGE_RESULT
+
+    PROGRESS_DELAY = 1000 # дергаем прогрессбаром только через PROGRESS_DELAY файлов
+
+    # минимальный интервал между обновлениями сообщения о ходе оценки
+    # сбора статистики в секундах
+    ESTIMATE_PROGRESS_INTERVAL = 0.25
+
+    # интервал в секундах между обновлениями таблиц с оценками
+    # при сборе статистики по выборке
+    SAMPLING_VIEW_INTERVAL = 2.0
+
+    def wnd_destroy(self, widget, data=None):
+        self.stop_estimate()
+        self.stop_background_refresh()
+        Gtk.main_quit()
+
+    def __scan_progress(self, stats, fraction, message):
+        self.progressDelay -= 1
+        if self.progressDelay <= 0:
+            self.progressDelay = self.PROGRESS_DELAY
+
+            if fraction < 0.0:
+                self.progressBar.pulse()
+            else:
+                self.progressBar.set_fraction(fraction)
+
+            self.txtProgress.set_text(message)
+
+        if self.samplingScan and stats.is_estimate() \
+                and monotonic() - self.samplingViewTime >= self.SAMPLING_VIEW_INTERVAL:
+            self.__update_sampling_view()
+
+        flush_gtk_events()
+
+        return not self.stopScanning
+
+    def __update_sampling_view(self):
+        """Показ текущих оценок во время сбора статистики по выборке:
+        пока файлы обрабатываются, таблицы на странице результатов
+        периодически заполняются заново, кнопка *NextPage прекращает сбор.
+        Дерево каталогов строится только по окончании сбора."""
+
+        self.samplingViewTime = monotonic()
+
+        self.viewStats = self.stats
+        self.viewDirNode = None
+        self.update_stats_view()
+
+        if self.curPage == self.PAGE_PROGRESS:
+            self.pages.set_current_page(self.PAGE_RESULT)
+
+    def __scan_stage(self, msg):
+        self.txtProgressStage.set_text(msg)
+        flush_gtk_events()
+
+    def scan_photos(self, subdir=None):
+        """Сбор статистики.
+        subdir - None (полный сбор статистики по self.config.cfgPhotoRootDir)
+        или путь к каталогу, статистику по которому следует обновить
+        (см. PhotoStatistics.rescan_subtree())."""
+
+        # фоновое обновление статистики и оценка (если ещё идут) больше не нужны
+        self.stop_estimate()
+        self.stop_background_refresh()
+
+        from pstat_profile import ScanProfiler
+        from pstat_memprof import MemoryProfiler
+        from pstat_metrics import ScanMetrics
+        from pstat_dedup import create_duplicate_finder
+        from pstat_throttle import create_throttle
+
+        memprof = None
+
+        try:
+            nextPage = self.PAGE_RESULT
+            self.stopScanning = False
+            self.progressDelay = self.PROGRESS_DELAY
+
+            # оценки по мере сбора показываем только при полном сборе
+            self.samplingScan = subdir is None and self.config.cfgSamplingMode
+            self.samplingViewTime = monotonic()
+
+            if subdir is None:
+                self.stats.clear()
+                self.snapshotTime = None
+                self.snapshotStale = False
+
+                profiler = ScanProfiler() if self.config.cfgProfileScan else None
+                memprof = MemoryProfiler() if self.config.cfgMemProfile else None
+                dedup = create_duplicate_finder(self.config)
+                throttle = create_throttle(self.config)
+            else:
+                # номера файлов при обновлении каталога меняются,
+                # и отчёт профилировщика был бы некорректным
+                profiler = None
+                dedup = None
+                throttle = None
+
+            progressdisp = self.__scan_progress
+            stagedisp = self.__scan_stage
+
+            if memprof:
+                memprof.start()
+                stagedisp = memprof.wrap_stagedisp(stagedisp)
+
+            if self.config.cfgMetricsFile:
+                metrics = ScanMetrics(self.config.cfgMetricsFile)
+                metrics.scan_started(self.stats)
+                progressdisp = metrics.wrap_progress(progressdisp)
+            else:
+                metrics = None
+
+            extractor = create_extractor(self.config)
+            walker = create_walker(self.config)
+
+            try:
+                if subdir is None:
+                    ok, em = self.stats.gather_photo_statistics(self.config.cfgPhotoRootDir,
+                        self.config.get_scan_file_types(),
+                        stagedisp,
+                        progressdisp,
+                        self.config.cfgSamplingMode,
+                        profiler,
+                        extractor,
+                        walker,
+                        dedup,
+                        throttle)
+                else:
+                    ok, em = self.stats.rescan_subtree(subdir,
+                        self.config.get_scan_file_types(),
+                        self.__scan_stage,
+                        progressdisp,
+                        self.config.cfgSamplingMode,
+                        extractor,
+                        walker)
+            except Exception as ex:
+                dump_exception()
+                ok = True
+                em = str(ex)
+            finally:
+                extractor.close()
+
+            # настройки сохраняются при выходе из программы
+            remember_tuned_workers(self.config, extractor, False)
+
+            if metrics:
+                metrics.scan_finished()
+
+            if profiler:
+                print(profiler.get_report(self.stats.files), file=sys.stderr)
+
+            if dedup and dedup.groups:
+                print(dedup.get_report(self.stats.files), file=sys.stderr)
+
+            if throttle:
+                print(throttle.get_summary_str(), file=sys.stderr)
+
+            # в снимок сохраняем только полную статистику; статистику,
+            # восстановленную из снимка, после обновления одного каталога
+            # не сохраняем - иначе по времени сохранения снимка было бы
+            # уже не понять, что прочие каталоги могли устареть
+            if ok and not em and not self.stats.is_estimate() and self.snapshotTime is None:
+                self.save_snapshot(self.config.get_scan_file_types())
+
+            if not ok and not em and (subdir is not None or self.stats.is_estimate()):
+                # сбор по выборке прерван пользователем - показываем оценки;
+                # при прерывании обновления каталога остаётся прежняя статистика
+                ok = True
+
+            if em or not ok:
+                if subdir is None:
+                    nextPage = self.PAGE_START
+
+                if em:
+                    msg_dialog(self.window, APP_TITLE, em)
+
+        finally:
+            self.samplingScan = False
+
+            if memprof:
+                memprof.stage('Заполнение таблиц в окне')
+
+            self.update_dir_tree_view(subdir)
+            self.update_stats_view()
+
+            if memprof:
+                memprof.finish()
+                print(memprof.get_report(), file=sys.stderr)
+
+            # принудительно переключаем страницу морды
+            # (если страница та же - сигнал switch-page не придёт)
+            self.pages.set_current_page(nextPage)
+            self.setup_sensitive_widgets()
+
+    def select_next_page(self):
+        """Реакция на кнопку/пункт меню *NextPage - переход на следующую
+        стадию процесса в зависимости от текущей."""
+
+        if self.samplingScan:
+            # остановка сбора по выборке - страницу после остановки
+            # выбирает scan_photos()
+            self.stopScanning = True
+            return
+
+        if self.curPage == self.PAGE_START:
+            # запуск сбора данных
+            nextPage = self.PAGE_PROGRESS
+        elif self.curPage == self.PAGE_PROGRESS:
+            # остановка сбора данных, возврат на начальную страницу
+            self.stopScanning = True
+            nextPage = self.PAGE_START
+        else:
+            # возврат на начальную страницу
+            nextPage = self.PAGE_START
+
+        self.pages.set_current_page(nextPage)
+
+        if nextPage == self.PAGE_PROGRESS:
+            self.scan_photos()
+
+    def save_snapshot(self, ftypes):
+        e = self.snapshot.save(self.stats, ftypes)
+        if e:
+            # не критично - просто при следующем запуске статистику
+            # придётся собирать заново
+            print(e, file=sys.stderr)
+
+    def restore_snapshot(self):
+        """Восстановление статистики, сохранённой при предыдущем
+        сборе, если она собрана по тем же каталогу и типам файлов,
+        что указаны в настройках.
+        Возвращает True, если статистика восстановлена."""
+
+        e = self.snapshot.load()
+        if e:
+            print(e, file=sys.stderr)
+            return False
+
+        if not self.snapshot.matches(self.config.cfgPhotoRootDir, self.config.get_scan_file_types()):
+            return False
+
+        self.stats = self.snapshot.stats
+        self.snapshotTime = self.snapshot.timestamp
+        self.snapshotStale = self.snapshot.is_probably_stale()
+        # снимок в памяти больше не нужен
+        self.snapshot.stats = None
+
+        self.update_dir_tree_view()
+        self.update_stats_view()
+
+        return True
+
+    def start_background_refresh(self):
+        """Запуск полного сбора статистики в отдельном потоке - без
+        переключения на страницу прогресса. По завершении собранная
+        статистика заменяет отображаемую (см. __refresh_finished())."""
+
+        self.stopRefresh = False
+
+        self.refreshThread = Thread(target=self.__refresh_stats,
+            args=(self.config.cfgPhotoRootDir, self.config.get_scan_file_types()),
+            daemon=True)
+        self.refreshThread.start()
+
+        self.update_stats_view()
+
+    def stop_background_refresh(self):
+        if self.refreshThread is None:
+            return
+
+        self.stopRefresh = True
+        self.refreshThread.join()
+        self.refreshThread = None
+
+    def __refresh_stats(self, photodir, ftypes):
+        # выполняется в отдельном потоке - GTK отсюда трогать нельзя!
+        from pstat_dedup import create_duplicate_finder
+        from pstat_throttle import create_throttle
+
+        stats = PhotoStatistics()
+        extractor = create_extractor(self.config)
+
+        def progressdisp(statobj, fraction, message):
+            return not self.stopRefresh
+
+        try:
+            ok, em = stats.gather_photo_statistics(photodir, ftypes,
+                progressdisp=progressdisp,
+                extractor=extractor,
+                walker=create_walker(self.config),
+                dedup=create_duplicate_finder(self.config),
+                throttle=create_throttle(self.config))
+        except Exception as ex:
+            dump_exception()
+            ok = False
+            em = str(ex)
+        finally:
+            extractor.close()
+
+        remember_tuned_workers(self.config, extractor, False)
+
+        if em:
+            print(em, file=sys.stderr)
+
+        GLib.idle_add(self.__refresh_finished, current_thread(), stats, ftypes, ok and not em)
+
+    def __refresh_finished(self, thread, stats, ftypes, ok):
+        if thread is not self.refreshThread:
+            # обновление было остановлено
+            return False
+
+        self.refreshThread = None
+
+        if ok:
+            self.stats = stats
+            self.snapshotTime = None
+            self.snapshotStale = False
+
+            self.save_snapshot(ftypes)
+
+            self.update_dir_tree_view(self.viewDirNode.path if self.viewDirNode is not None else None)
+
+        self.update_stats_view()
+
+        return False
+
+    def start_estimate(self):
+        """Запуск оценки сбора статистики (см. pstat_estimate) в отдельном
+        потоке. Ход и результат оценки отображаются на первой странице."""
+
+        self.stopEstimate = False
+
+        self.estimateThread = Thread(target=self.__estimate,
+            args=(self.config.cfgPhotoRootDir, self.config.get_scan_file_types()),
+            daemon=True)
+        self.estimateThread.start()
+
+        self.btnEstimate.set_label('Прекратить оценку')
+        self.txtEstimate.set_text('Оценка...')
+
+    def stop_estimate(self):
+        if self.estimateThread is None:
+            return
+
+        self.stopEstimate = True
+        self.estimateThread.join()
+        self.estimateThread = None
+
+        self.btnEstimate.set_label('Оценить продолжительность сбора')
+        self.txtEstimate.set_text('')
+
+    def __estimate(self, photodir, ftypes):
+        # выполняется в отдельном потоке - GTK отсюда трогать нельзя!
+        from pstat_estimate import create_estimator
+
+        estimator = create_estimator(self.config)
+        extractor = create_extractor(self.config)
+        thread = current_thread()
+        lastProgress = [0.0]
+
+        def progress(fraction, message):
+            now = monotonic()
+            if now - lastProgress[0] >= self.ESTIMATE_PROGRESS_INTERVAL:
+                lastProgress[0] = now
+                GLib.idle_add(self.__estimate_progress, thread, message)
+
+            return not self.stopEstimate
+
+        try:
+            ok = estimator.estimate(photodir, ftypes, extractor, create_walker(self.config), progress)
+            report = estimator.get_report() if ok else None
+        except Exception as ex:
+            dump_exception()
+            report = 'Сбой при оценке - %s' % exception_to_str(ex)
+        finally:
+            extractor.close()
+
+        if report is not None:
+            GLib.idle_add(self.__estimate_finished, thread, report)
+
+    def __estimate_progress(self, thread, message):
+        if thread is self.estimateThread:
+            self.txtEstimate.set_text('Оценка... %s' % message)
+
+        return False
+
+    def __estimate_finished(self, thread, report):
+        if thread is not self.estimateThread:
+            # оценка была остановлена
+            return False
+
+        self.estimateThread = None
+
+        self.btnEstimate.set_label('Оценить продолжительность сбора')
+        self.txtEstimate.set_text(report)
+
+        return False
+
+    def update_dir_tree_view(self, selectPath=None):
+        """Заполнение дерева каталогов.
+        selectPath - None или путь каталога, который следует выбрать
+        (если его нет в дереве - выбирается корневой каталог)."""
+
+        self.dirTreeView.refresh_begin()
+
+        def add_nodes(parentItr, node):
+            itr = self.dirTreeView.store.append(parentItr,
+                (node.get_name(), node.stats.count_str(node.stats.statTotalPhotos), node.path))
+
+            for name in sorted(node.children):
+                add_nodes(itr, node.children[name])
+
+        if self.stats.dirTree is not None:
+            add_nodes(None, self.stats.dirTree)
+
+        self.dirTreeView.refresh_end()
+
+        self.viewStats = self.stats
+        self.viewDirNode = self.stats.dirTree
+
+        if self.viewDirNode is not None:
+            node = self.stats.get_dir_node(selectPath) if selectPath else None
+
+            if node is None:
+                node = self.viewDirNode
+
+            itr = self.dirTreeView.find_iter(2, node.path)
+            if itr is not None:
+                # выбор строки вызовет tvDirTree_cursor_changed()
+                self.dirTreeView.select_iter(itr)
+
+    def tvDirTree_cursor_changed(self, tv):
+        itr = self.dirTreeView.get_selected_iter()
+        node = self.stats.get_dir_node(self.dirTreeView.store.get_value(itr, 2)) if itr is not None else None
+
+        if node is None or node is self.viewDirNode or self.samplingScan:
+            return
+
+        self.viewDirNode = node
+        # для корневого каталога показываем общую статистику
+        # (совпадает со статистикой узла, но содержит ещё и список файлов)
+        self.viewStats = self.stats if node is self.stats.dirTree else node.stats
+
+        self.update_stats_view()
+
+    def btnRescanDir_clicked(self, btn):
+        if self.viewDirNode is None or self.samplingScan:
+            return
+
+        self.pages.set_current_page(self.PAGE_PROGRESS)
+        self.scan_photos(self.viewDirNode.path)
+
+    def update_stats_view(self):
+        """Обновление отображалки статистики"""
+
+        # чистим отображало от старых настроек и значений
+        self.statViewFA.refresh_begin()
+        # т.к. ниже будем создавать новый экземпляр Gtk.ListStore
+        self.statViewFA.store = None
+
+        while self.statViewFA.view.get_n_columns() > 0:
+            self.statViewFA.view.remove_column(self.statViewFA.view.get_column(0))
+
+        # это дерево только чистим - кол-во столбцов в нём не изменяется
+        self.statViewByYear.refresh_begin()
+
+        # тут тоже только чистим
+        self.statViewByISO.refresh_begin()
+
+        # статистика выбранного в дереве каталога (или общая),
+        # при заданном условии отбора - пересчитанная по отобранным снимкам
+        stats = self.viewStats
+
+        if self.photoFilter is not None and self.viewDirNode is not None:
+            stats = self.stats.get_filtered_stats(self.photoFilter, self.viewDirNode.path)
+
+        self.shownStats = stats
+
+        # таблицу статистики по годам получаем, но не используем -
+        # для Gtk.TreeStore нужны исходные данные из stats
+        statFA = stats.get_stat_table_by_focals()
+        # ключи строк и столбцов понадобятся для вывода списка файлов
+        self.statFATable = statFA
+        self.yearRowKeys.clear()
+        self.isoRowKeys.clear()
+
+        titleParts = []
+
+        if self.viewDirNode is not None and self.viewDirNode is not self.stats.dirTree:
+            titleParts.append('каталог %s' % os.path.relpath(self.viewDirNode.path, self.stats.dirTree.path))
+
+        if self.photoFilter is not None:
+            titleParts.append('отбор: %s' % self.photoFilter.expr)
+
+        samplingStr = stats.get_sampling_str()
+        if samplingStr:
+            titleParts.append(samplingStr)
+
+        duplicatesStr = stats.get_duplicates_str()
+        if duplicatesStr:
+            titleParts.append(duplicatesStr)
+
+        if self.snapshotTime is not None:
+            titleParts.append('сохранена %s' % strftime('%d.%m.%Y %H:%M', localtime(self.snapshotTime)))
+
+            if self.snapshotStale:
+                titleParts.append('возможно, устарела')
+
+        if self.refreshThread is not None:
+            titleParts.append('обновляется')
+
+        self.txtResultTitle.set_text('Статистика (%s):' % '; '.join(titleParts) if titleParts else 'Статистика:')
+
+        #
+        # статистика по фокусным/диафрагмам
+        #
+        if statFA.rows:
+            # создаем и засираем новую таблицу
+            # 1й столбец - заголовок
+            # следующие - пары из строки (для отображения)
+            # и целого (для прогрессбара)
+
+            lastcol = len(statFA.rows[0]) - 1
+
+            coltypes = [GObject.TYPE_STRING] + [GObject.TYPE_STRING, GObject.TYPE_INT] * lastcol
+
+            self.statViewFA.store = Gtk.ListStore(*coltypes)
+
+            self.statViewFA.view.append_column(Gtk.TreeViewColumn(statFA.rows[0][0], Gtk.CellRendererText(), text=0))
+
+            crpb = Gtk.CellRendererProgress()
+            crpb.set_property('text-xalign', 0.0)
+
+            for ixcol in range(lastcol):
+                dcol = 1 + (ixcol * 2)
+                col = Gtk.TreeViewColumn(statFA.rows[0][ixcol + 1], crpb, text=dcol, value=dcol + 1)
+                col.set_expand(True)
+                self.statViewFA.view.append_column(col)
+
+            # при сборе по выборке в ячейках показываем оценки
+            # (проценты для прогрессбаров от этого не меняются)
+            # заполняем данными
+            for rowix in range(1, len(statFA.rows)):
+                row = statFA.rows[rowix]
+
+                strow = [row[0]]
+                for col in row[1:]:
+                    # пара значений - строка для отображения
+                    strow.append(stats.count_str(col) if col > 0 else '')
+
+                    # и значение для прогрессбара
+                    p = 0 if stats.statTotalPhotos == 0 else col * 100 / stats.statTotalPhotos
+
+                    strow.append(p)
+
+                self.statViewFA.store.append(strow)
+
+        #
+        # статистика по годам
+        #
+        for yearno, year in sorted(stats.statByYear.items()):
+            # номер года и кол-во снимков за год
+            ytotal = year[0]
+
+            # здесь и далее: в строку преобразуем только те значения,
+            # которые не должны быть преобразованы в StatTable.__str__()
+            pcs = 100.0 * ytotal / stats.statByYearTotal
+            # здесь и далее: а какого хрена у Gtk.ProgressBar
+            # значение называется fraction, типа float в диапазоне 0..1,
+            # а у CellRendererProgress - value, int в диапазоне 0..100?
+            itr = self.statViewByYear.store.append(None,
+                (str(yearno), stats.count_str(ytotal), pcs, '%.1f%%' % pcs))
+            self.yearRowKeys[self.statViewByYear.store.get_string_from_iter(itr)] = (yearno, None)
+
+            # по месяцам, за исключением нулевого (суммы за год)
+            months = set(year.keys()) - {0}
+            for month in sorted(months):
+                np = year[month]
+                pcs = 100.0 * np / ytotal
+                mitr = self.statViewByYear.store.append(itr,
+                    (stats.MONTH_STR[month - 1], stats.count_str(np), pcs, '%.1f%%' % pcs))
+                self.yearRowKeys[self.statViewByYear.store.get_string_from_iter(mitr)] = (yearno, month)
+
+        #
+        # по значениям ISO Speed
+        #
+        for isoSpeed, nPhotos in sorted(stats.statByISOSpeed.items()):
+            self.statViewByISO.store.append((str(isoSpeed),
+                percents_str(nPhotos, stats.statByISOSpeedTotal),
+                stats.count_str(nPhotos),
+                100.0 * nPhotos / stats.statByISOSpeedTotal))
+            self.isoRowKeys.append(isoSpeed)
+        #
+        self.statViewByISO.refresh_end()
+        self.statViewByYear.refresh_end()
+        self.statViewByYear.view.expand_all()
+        self.statViewFA.refresh_end()
+
+    def show_bucket_files(self, kind, match, title):
+        """Вывод списка файлов, учтённых в ячейках таблицы статистики
+        (параметры kind и match - см. PhotoStatistics.get_bucket_file_ids())
+        с учётом выбранного в дереве каталога."""
+
+        if self.samplingScan:
+            # индекс снимков по ячейкам будет готов только по окончании сбора
+            return
+
+        if self.snapshotTime is not None:
+            msg_dialog(self.window, APP_TITLE,
+                'Статистика восстановлена из сохранённой копии, списков файлов в ней нет.\nДля просмотра файлов соберите статистику заново.',
+                Gtk.MessageType.INFO)
+            return
+
+        dirpath = self.viewDirNode.path if self.viewDirNode is not None else None
+
+        fileIds = self.stats.get_bucket_file_ids(kind, match, dirpath)
+
+        if self.photoFilter is not None:
+            mask = self.photoFilter.get_mask(self.stats, dirpath)
+            fileIds = array('I', filter(mask.__getitem__, fileIds))
+
+        if self.stats.is_estimate():
+            title = '%s (только обработанные файлы выборки)' % title
+
+        self.dlgFileList.run(title, list(self.stats.files.iter_paths(fileIds)))
+
+    def apply_filter(self):
+        """Применение условия отбора снимков из поля ввода."""
+
+        from pstat_filter import PhotoFilter, FilterError
+
+        if self.samplingScan:
+            return
+
+        expr = self.entFilter.get_text().strip()
+
+        if not expr:
+            self.photoFilter = None
+        else:
+            if self.snapshotTime is not None:
+                msg_dialog(self.window, APP_TITLE,
+                    'Статистика восстановлена из сохранённой копии, метаданных отдельных снимков в ней нет.\nДля отбора снимков соберите статистику заново.',
+                    Gtk.MessageType.INFO)
+                return
+
+            try:
+                self.photoFilter = PhotoFilter(expr)
+            except FilterError as ex:
+                msg_dialog(self.window, 'Отбор снимков', str(ex))
+                return
+
+        self.update_stats_view()
+
+    def entFilter_activate(self, entry):
+        self.apply_filter()
+
+    def entFilter_icon_press(self, entry, iconpos, event):
+        entry.set_text('')
+        self.apply_filter()
+
+    def btnFilterApply_clicked(self, btn):
+        self.apply_filter()
+
+    def tvFASummary_row_activated(self, tv, path, col):
+        if self.statFATable is None:
+            return
+
+        # в таблице есть строка заголовков, в TreeView - нет
+        rowix = path.get_indices()[0] + 1
+        colix = tv.get_columns().index(col)
+
+        rowKey = self.statFATable.rowKeys[rowix]
+        colKey = self.statFATable.colKeys[colix]
+
+        def match(key):
+            return (rowKey is None or key[0] in rowKey) and (colKey is None or key[1] in colKey)
+
+        titleParts = []
+        if rowKey is not None:
+            titleParts.append(self.statFATable.rows[rowix][0])
+        if colKey is not None:
+            titleParts.append(self.statFATable.rows[0][colix])
+
+        self.show_bucket_files(BUCKET_FA, match, ', '.join(titleParts) if titleParts else 'Все снимки')
+
+    def tvStatByYear_row_activated(self, tv, path, col):
+        yearno, month = self.yearRowKeys[path.to_string()]
+
+        if month is None:
+            self.show_bucket_files(BUCKET_DATE, lambda key: key[0] == yearno, str(yearno))
+        else:
+            self.show_bucket_files(BUCKET_DATE, lambda key: key == (yearno, month),
+                '%s %d' % (AggregateStatistics.MONTH_STR[month - 1], yearno))
+
+    def tvStatByISO_row_activated(self, tv, path, col):
+        isoSpeed = self.isoRowKeys[path.get_indices()[0]]
+
+        self.show_bucket_files(BUCKET_ISO, lambda key: key[0] == isoSpeed, 'ISO %d' % isoSpeed)
+
+    def __init__(self, config):
+        """Создание окна с виджетами.
+        config - экземпляр Configuration."""
+
+        resldr = get_resource_loader(get_cache_directory())
+        uibldr = resldr.load_gtk_builder('photostat.ui')
+
+        self.config = config
+        self.stopScanning = False
+        self.progressDelay = self.PROGRESS_DELAY
+        self.stats = PhotoStatistics()
+
+        # True во время полного сбора статистики по выборке,
+        # когда на странице результатов показываются текущие оценки
+        # (см. __update_sampling_view())
+        self.samplingScan = False
+        self.samplingViewTime = 0.0
+
+        # статистика, отображаемая на странице результатов: self.stats
+        # или статистика выбранного в дереве каталога (AggregateStatistics),
+        # и соответствующий ей узел дерева каталогов (DirStatNode или None)
+        self.viewStats = self.stats
+        self.viewDirNode = None
+
+        # последняя отображённая таблица по ФР/диафрагмам (StatTable)
+        # и ключи строк остальных таблиц ((год, месяц или None)
+        # по строке пути в TreeStore и значения ISO Speed по номерам
+        # строк) - для вывода списков файлов по ячейкам таблиц
+        self.statFATable = None
+        self.yearRowKeys = {}
+        self.isoRowKeys = []
+
+        # условие отбора снимков (экземпляр PhotoFilter) или None
+        # и статистика, отображаемая в данный момент (viewStats
+        # или пересчитанная по отобранным снимкам)
+        self.photoFilter = None
+        self.shownStats = self.stats
+
+        # статистика, сохранённая при предыдущем сборе;
+        # snapshotTime - время её сохранения, если self.stats
+        # восстановлена из снимка, иначе None;
+        # snapshotStale - признак того, что файлы, возможно,
+        # изменились после сохранения
+        self.snapshot = StatSnapshot(get_snapshot_file_name())
+        self.snapshotTime = None
+        self.snapshotStale = False
+
+        # поток фонового обновления статистики (или None)
+        self.refreshThread = None
+        self.stopRefresh = False
+
+        # поток оценки сбора статистики (или None)
+        self.estimateThread = None
+        self.stopEstimate = False
+
+        self.window, hdrbar = get_ui_widgets(uibldr,
+            'wndMain', 'hdrBar')
+
+        self.window.set_size_request(WIDGET_BASE_WIDTH * 80, WIDGET_BASE_HEIGHT * 40)
+
+        hdrbar.set_title(APP_TITLE)
+        hdrbar.set_subtitle('v%s' % APP_VERSION)
+
+        self.window.set_icon(resldr.load_pixbuf_icon_size('photostat.svg', Gtk.IconSize.DIALOG))
+
+        # делаем страницы визарда наполовину вручную - потому что Gtk.Assistant попросту уёбищен
+        self.pages = uibldr.get_object('pages')
+
+        #
+        # кнопки
+        #
+        self.btnNextPage, self.mnuNextPage, self.btnResultCopy, self.btnResultSave = get_ui_widgets(uibldr,
+            'btnNextPage', 'mnuNextPage', 'btnResultCopy', 'btnResultSave')
+
+        self.imgStart = Gtk.Image.new_from_icon_name('system-run-symbolic', Gtk.IconSize.BUTTON)
+        self.imgStop = Gtk.Image.new_from_icon_name('media-playback-stop-symbolic', Gtk.IconSize.BUTTON)
+        self.imgHome = Gtk.Image.new_from_icon_name('go-home-symbolic', Gtk.IconSize.BUTTON)
+
+        #
+        # Страница 1: выбор каталога и типов файлов
+        #
+
+        self.fcbtnPicDir, self.chkScanImageFiles, self.chkScanRAWFiles, self.chkSamplingMode = get_ui_widgets(uibldr,
+            'fcbtnPicDir', 'chkScanImageFiles', 'chkScanRAWFiles', 'chkSamplingMode')
+
+        self.chkScanImageFiles.set_active(self.config.cfgScanImageFiles)
+        self.chkScanRAWFiles.set_active(self.config.cfgScanRAWFiles)
+        self.chkSamplingMode.set_active(self.config.cfgSamplingMode)
+
+        self.chkRefreshOnStart = uibldr.get_object('chkRefreshOnStart')
+        self.chkRefreshOnStart.set_active(self.config.cfgRefreshOnStart)
+
+        self.fcbtnPicDir.select_filename(self.config.cfgPhotoRootDir)
+
+        self.btnEstimate, self.txtEstimate = get_ui_widgets(uibldr, 'btnEstimate', 'txtEstimate')
+
+        #
+        # Страница 2: сбор статистики
+        #
+
+        self.txtProgress, self.txtProgressStage, self.progressBar = get_ui_widgets(uibldr,
+            'txtProgress', 'txtProgressStage', 'progressBar')
+
+        #
+        # Страница 3: отображение статистики
+        #
+
+        self.txtResultTitle, self.entFilter = get_ui_widgets(uibldr, 'txtResultTitle', 'entFilter')
+
+        self.dirTreeView = TreeViewShell.new_from_uibuilder(uibldr, 'tvDirTree')
+
+        self.statViewFA = TreeViewShell.new_from_uibuilder(uibldr, 'tvFASummary')
+        self.statViewByYear = TreeViewShell.new_from_uibuilder(uibldr, 'tvStatByYear')
+        self.statViewByISO = TreeViewShell.new_from_uibuilder(uibldr, 'tvStatByISO')
+
+        # сохранение статистики
+
+        # т.к. Glade текущей версии (3.38.2) с какого-то перепугу
+        # не умеет создавать
+        # а) диалоги _сохранения_ (только открытия файлов и выбора каталога)
+        # б) не умеет пихать стандартные кнопки диалогов в ихий же HeaderBar
+        # создаём диалог тупо вручную
+
+        self.dlgSaveAs = Gtk.FileChooserDialog()
+        self.dlgSaveAs.set_title('Выбор файла для сохранения статистики')
+        self.dlgSaveAs.set_action(Gtk.FileChooserAction.SAVE)
+        self.dlgSaveAs.set_do_overwrite_confirmation(True)
+
+        self.dlgSaveAs.add_buttons('Отмена', Gtk.ResponseType.CANCEL,
+            'OK', Gtk.ResponseType.OK)
+        self.dlgSaveAs.set_default_response(Gtk.ResponseType.OK)
+
+        for fltname, fltpat in (('Текстовые файлы', '*.txt'), ('Все файлы', '*.*')):
+                fltr = Gtk.FileFilter()
+                fltr.set_name(fltname)
+                fltr.add_pattern(fltpat)
+                self.dlgSaveAs.add_filter(fltr)
+
+        self.dlgFileList = FileListDialog(self.window)
+        #
+        #
+        #
+        # если есть подходящая сохранённая статистика - сразу её показываем
+        restored = self.restore_snapshot()
+
+        self.curPage = self.PAGE_RESULT if restored else self.PAGE_START
+        self.pages.set_current_page(self.curPage)
+
+        self.window.show_all()
+
+        self.setup_sensitive_widgets()
+
+        uibldr.connect_signals(self)
+
+        if restored and self.config.cfgRefreshOnStart:
+            self.start_background_refresh()
+
+    def chkScanImageFiles_toggled(self, cbtn):
+        self.config.cfgScanImageFiles = cbtn.get_active()
+
+    def chkScanRAWFiles_toggled(self, cbtn):
+        self.config.cfgScanRAWFiles = cbtn.get_active()
+
+    def chkSamplingMode_toggled(self, cbtn):
+        self.config.cfgSamplingMode = cbtn.get_active()
+
+    def chkRefreshOnStart_toggled(self, cbtn):
+        self.config.cfgRefreshOnStart = cbtn.get_active()
+
+    def btnEstimate_clicked(self, btn):
+        if self.estimateThread is not None:
+            self.stop_estimate()
+        else:
+            self.start_estimate()
+
+    def btnAbout_clicked(self, btn):
+        AboutDialog(self.window).run()
+
+    def btnNextPage_clicked(self, btn):
+        self.select_next_page()
+
+    def btnResultCopy_clicked(self, btn):
+        self.copy_stat_to_clipboard()
+
+    def btnResultSave_clicked(self, btn):
+        self.save_stat_to_file()
+
+    def pages_switch_page(self, nb, page, pagenum):
+        self.curPage = pagenum
+        self.setup_sensitive_widgets()
+
+    def fcbtnPicDir_selection_changed(self, fc):
+        # выбран корневой каталог фотопомойки
+        self.config.cfgPhotoRootDir = self.fcbtnPicDir.get_filename()
+
+        # оценка - по прежнему каталогу
+        self.stop_estimate()
+        self.txtEstimate.set_text('')
+
+        self.setup_sensitive_widgets()
+
+    def setup_sensitive_widgets(self):
+        cadd = 'suggested-action'
+        cremove = 'destructive-action'
+
+        if self.curPage == self.PAGE_START:
+            bStart = bool(self.config.cfgPhotoRootDir)
+            bSave = False
+            img = self.imgStart
+            txt = 'Собрать статистику'
+        elif self.curPage == self.PAGE_PROGRESS or self.samplingScan:
+            bStart = True
+            bSave = False
+            img = self.imgStop
+            txt = 'Прекратить сбор статистики'
+            cadd, cremove = cremove, cadd
+        else:
+            # self.PAGE_RESULT
+            bStart = True
+            bSave = True
+            txt = 'Начать сначала'
+            img = self.imgHome
+
+        self.btnNextPage.set_sensitive(bStart)
+        self.btnEstimate.set_sensitive(bool(self.config.cfgPhotoRootDir))
+        self.btnNextPage.set_image(img)
+        self.mnuNextPage.set_label(txt)
+
+        sc = self.btnNextPage.get_style_context()
+        sc.remove_class(cremove)
+        sc.add_class(cadd)
+
+        self.btnResultCopy.set_sensitive(bSave)
+        self.btnResultSave.set_sensitive(bSave)
+
+    def save_stat_to_file(self):
+        self.dlgSaveAs.select_filename(self.config.cfgStatSaveFile)
+
+        self.dlgSaveAs.show()
+        r = self.dlgSaveAs.run()
+        self.dlgSaveAs.hide()
+
+        if r == Gtk.ResponseType.OK:
+            self.config.cfgStatSaveFile = self.dlgSaveAs.get_filename()
+            try:
+                with open(self.config.cfgStatSaveFile, 'w+') as f:
+                    f.write(self.shownStats.get_stat_tables_str())
+            except Exception as ex:
+                msg_dialog(self.window, 'Сохранение статистики в файл',
+                               'Не удалось сохранить файл.\n%s' % exception_to_str(ex))
+
+    def copy_stat_to_clipboard(self):
+        try:
+            cb = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
+            cb.clear()
+            cb.set_text(self.shownStats.get_stat_tables_str(), -1)
+            cb.store()
+        except Exception as ex:
+            msg_dialog(self.window, 'Копирование статистики в буфер обмена',
+                           'Сбой при операции с буфером обмена - %s' % exception_to_str(ex))
+
+    def main(self):
+        Gtk.main()
+
+
+def save_load_settings(config, save):
+    e = config.save() if save else config.load()
+
+    if e:
+        msg_dialog(None, '%s - %s настроек' % (APP_TITLE, 'сохранение' if save else'загрузка'),
+                       e, Gtk.MessageType.ERROR)
+        return False
+
+    return True
+
+
+def run_gui(config, photoRootDir=None):
+    """Запуск GUI.
+
+    config          - экземпляр Configuration;
+    photoRootDir    - None или путь к каталогу с фотографиями,
+                      заменяющий указанный в настройках.
+
+    Возвращает код завершения программы."""
+
+    if not save_load_settings(config, False):
+        return 1
+
+    if photoRootDir:
+        # сохранится в настройках - как и выбранный в GUI
+        config.cfgPhotoRootDir = os.path.abspath(photoRootDir)
+
+    PhotoStatUI(config).main()
+
+    if not save_load_settings(config, True):
+        return 1
+
+    return 0
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pstat_walk.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Поиск файлов в дереве каталогов.
+# На сетевых ФС (NFS, SMB) основное время уходит на ожидание ответа
+# сервера на каждый readdir/stat, поэтому каталоги читаются
+# одновременно несколькими потоками (GIL при ожидании ввода-вывода
+# отпускается). Тип элемента каталога берётся из os.DirEntry, т.е.
+# без отдельного вызова stat(); stat() вызывается только для
+# отобранных файлов (ради размера) - и тоже в рабочих потоках.
+#
+# Пары RAW+JPEG (один и тот же кадр, записанный камерой в двух форматах)
+# определяются здесь же, по именам файлов без расширения и времени
+# изменения: обрабатывается только один файл пары (JPEG - его метаданные
+# читаются быстрее), и кадр учитывается в статистике один раз.
+#
+# Файлы с несколькими жёсткими ссылками (напр. деревья резервных копий
+# rsnapshot) и файлы, на которые указывают символические ссылки,
+# отбираются по одному разу на (st_dev, st_ino), т.е. на физический файл.
+
+
+import os, os.path
+from fnmatch import fnmatch
+from collections import deque
+from threading import Thread, Condition, Lock
+from queue import SimpleQueue
+
+
+# максимальная разница времени изменения файлов пары RAW+JPEG (в секундах):
+# камера записывает оба файла почти одновременно, а JPEG, сделанный
+# из RAW позже (при обработке), парой не считается
+PAIR_MTIME_TOLERANCE = 60.0
+
+# расширения файлов, метаданные которых читаются быстрее всего -
+# при наличии в паре обрабатывается именно такой файл
+CHEAP_PAIR_EXTS = {'.jpg', '.jpeg'}
+
+
+def is_excluded_dir(patterns, name, relpath):
+    """Возвращает True, если каталог с именем name и путём relpath
+    (относительно начального каталога обхода) соответствует одному
+    из шаблонов patterns (см. DirWalker)."""
+
+    for pattern in patterns:
+        if fnmatch(relpath if os.sep in pattern else name, pattern):
+            return True
+
+    return False
+
+
+def remove_paired_raws(files, mtimes, rawExts):
+    """Поиск пар RAW+JPEG среди файлов одного каталога.
+
+    files   - список кортежей (имя файла, размер, время изменения);
+    mtimes  - список значений времени изменения файлов (None - неизвестно);
+    rawExts - множество расширений RAW-файлов (в нижнем регистре).
+
+    Возвращает кортеж из двух элементов: список files без RAW-файлов,
+    входящих в пары RAW+JPEG, и количество убранных файлов."""
+
+    # ключи - имена файлов без расширения в нижнем регистре,
+    # значения - списки индексов в files
+    stems = {}
+
+    for ix, (fname, size, mtime) in enumerate(files):
+        stems.setdefault(os.path.splitext(fname)[0].lower(), []).append(ix)
+
+    paired = set()
+
+    for ixs in stems.values():
+        if len(ixs) < 2:
+            continue
+
+        raws = []
+        others = []
+
+        for ix in ixs:
+            if os.path.splitext(files[ix][0])[1].lower() in rawExts:
+                raws.append(ix)
+            else:
+                others.append(ix)
+
+        if not raws or not others:
+            continue
+
+        # файл, из которого будут прочитаны метаданные кадра
+        ixmain = min(others, key=lambda ix: os.path.splitext(files[ix][0])[1].lower() not in CHEAP_PAIR_EXTS)
+        mtmain = mtimes[ixmain]
+
+        if mtmain is None:
+            continue
+
+        for ix in raws:
+            if mtimes[ix] is not None and abs(mtimes[ix] - mtmain) <= PAIR_MTIME_TOLERANCE:
+                paired.add(ix)
+
+    if not paired:
+        return (files, 0)
+
+    return ([f for ix, f in enumerate(files) if ix not in paired], len(paired))
+
+
+class DirWalker():
+    """Обход дерева каталогов с отбором файлов по расширениям.
+
+    Каталоги, имена которых соответствуют шаблонам из excludeDirs
+    (в формате fnmatch, напр. '.thumbnails', '@eaDir', 'export*'),
+    пропускаются вместе с подкаталогами, т.е. вообще не читаются.
+    Шаблон, содержащий разделитель каталогов, сравнивается с путём
+    каталога относительно начального каталога обхода.
+
+    Символические ссылки на каталоги по умолчанию не обходятся (как
+    и у os.walk()); при followLinks=True обходятся, при этом каталог,
+    уже пройденный под другим путём (в т.ч. ссылка на родительский
+    каталог), повторно не читается.
+
+    Файл, уже отобранный под другим именем (жёсткая ссылка или
+    символическая ссылка на файл), повторно не отбирается; какое
+    из жёстких ссылок будет отобрано, при многопоточном обходе
+    не определено. Символическая ссылка на файл, который и так
+    будет отобран при обходе (см. is_walked_file()), не отбирается
+    никогда; для прочих ссылок, как и для жёстких ссылок, отбирается
+    первое встреченное имя. Номера inode запоминаются только для
+    файлов со ссылками, т.е. расход памяти от количества обычных
+    файлов не зависит.
+
+    Если задано множество расширений RAW-файлов pairRawExts, из файлов
+    каталога с одинаковыми именами (без учёта расширения и регистра),
+    среди которых есть RAW и не-RAW файлы с близким временем изменения
+    (см. PAIR_MTIME_TOLERANCE), RAW-файлы не отбираются - метаданные
+    кадра читаются из не-RAW файла.
+
+    Каталоги распределяются между потоками с "воровством работы":
+    у каждого потока своя очередь (deque), найденные подкаталоги
+    помещаются в конец своей очереди и оттуда же забираются (т.е.
+    поток идёт вглубь), а освободившийся поток забирает каталог
+    из начала очереди другого потока (т.е. самое крупное
+    необработанное поддерево)."""
+
+    def __init__(self, nthreads=1, excludeDirs=(), pairRawExts=None, followLinks=False):
+        """nthreads     - количество потоков; при значении <= 1 каталоги
+                          читаются в вызывающем потоке;
+        excludeDirs     - последовательность шаблонов имён пропускаемых
+                          каталогов;
+        pairRawExts     - None или множество расширений RAW-файлов
+                          (в нижнем регистре) для поиска пар RAW+JPEG;
+        followLinks     - обходить ли каталоги, на которые указывают
+                          символические ссылки."""
+
+        self.nthreads = nthreads
+        self.excludeDirs = tuple(excludeDirs)
+        self.pairRawExts = pairRawExts
+        self.followLinks = followLinks
+
+        # множества кортежей (st_dev, st_ino) уже пройденных каталогов
+        # (только при followLinks) и уже отобранных файлов со ссылками;
+        # сбрасываются в начале каждого обхода
+        self.seenDirs = set()
+        self.seenFiles = set()
+        self.seenLock = Lock()
+
+        # начальный каталог обхода без символических ссылок в пути
+        # (для is_walked_file()); устанавливается reset()
+        self.realTop = None
+
+    def first_visit(self, seen, st):
+        """Добавляет (st_dev, st_ino) из st (os.stat_result) в множество
+        seen. Возвращает False, если там это значение уже было.
+        Если номер inode не известен (напр. в Windows), возвращает True."""
+
+        if not st.st_ino:
+            return True
+
+        key = (st.st_dev, st.st_ino)
+
+        with self.seenLock:
+            if key in seen:
+                return False
+
+            seen.add(key)
+
+        return True
+
+    def reset(self, top):
+        """Подготовка к обходу дерева каталогов top - сброс множеств
+        уже пройденных каталогов и отобранных файлов. Вызывается walk();
+        при чтении каталогов через list_dir() без walk() (напр.
+        в pstat_estimate) должна вызываться вызывающей стороной."""
+
+        self.seenDirs.clear()
+        self.seenFiles.clear()
+
+        self.realTop = os.path.realpath(top)
+
+        if self.followLinks:
+            try:
+                self.first_visit(self.seenDirs, os.stat(top))
+            except OSError:
+                pass
+
+    def is_excluded(self, name, relpath):
+        return is_excluded_dir(self.excludeDirs, name, relpath)
+
+    def is_walked_file(self, fpath, ftypes):
+        """Возвращает True, если символическая ссылка fpath указывает на файл,
+        который будет (или уже был) отобран при обходе под собственным
+        именем: файл с расширением из ftypes находится внутри начального
+        каталога обхода, и ни один из каталогов на пути к нему
+        не пропускается (см. excludeDirs)."""
+
+        target = os.path.realpath(fpath)
+
+        if os.path.splitext(target)[1].lower() not in ftypes:
+            return False
+
+        try:
+            relpath = os.path.relpath(os.path.dirname(target), self.realTop)
+        except ValueError:
+            # напр. другой диск в Windows
+            return False
+
+        if relpath == os.curdir:
+            return True
+
+        parts = relpath.split(os.sep)
+        if parts[0] == os.pardir:
+            return False
+
+        if self.excludeDirs:
+            for ix in range(len(parts)):
+                if self.is_excluded(parts[ix], os.path.join(*parts[:ix + 1])):
+                    return False
+
+        return True
+
+    def list_dir(self, dirpath, top, ftypes):
+        """Чтение одного каталога.
+
+        Возвращает кортеж из пяти элементов:
+        1. список путей подкаталогов (без пропускаемых и уже пройденных);
+        2. количество прочих элементов каталога (файлов);
+        3. список кортежей (имя файла, размер, время изменения
+           в наносекундах) для файлов с расширениями из ftypes;
+           неизвестные размер и время - 0;
+        4. количество RAW-файлов, не отобранных как часть пар RAW+JPEG;
+        5. количество файлов, не отобранных, т.к. они уже отобраны
+           под другим именем (ссылки).
+        Ошибки чтения каталога игнорируются (как и у os.walk())."""
+
+        subdirs = []
+        nfiles = 0
+        files = []
+        nlinked = 0
+        # время изменения отобранных файлов (для поиска пар)
+        mtimes = []
+
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    try:
+                        isdir = entry.is_dir(follow_symlinks=self.followLinks)
+                    except OSError:
+                        isdir = False
+
+                    if isdir:
+                        if self.excludeDirs and self.is_excluded(entry.name, os.path.relpath(entry.path, top)):
+                            continue
+
+                        if self.followLinks:
+                            # защита от циклов и повторного обхода
+                            # каталогов, доступных по нескольким путям
+                            try:
+                                if not self.first_visit(self.seenDirs, entry.stat()):
+                                    continue
+                            except OSError:
+                                continue
+
+                        subdirs.append(entry.path)
+                        continue
+
+                    nfiles += 1
+
+                    if os.path.splitext(entry.name)[1].lower() not in ftypes:
+                        continue
+
+                    try:
+                        st = entry.stat()
+                        size = st.st_size
+                        mtime = st.st_mtime_ns
+
+                        islink = entry.is_symlink()
+
+                        # файл, на который указывает ссылка, может встретиться
+                        # и позже - потому проверяем не только inode
+                        if islink and self.is_walked_file(entry.path, ftypes) \
+                                or (st.st_nlink > 1 or islink) and not self.first_visit(self.seenFiles, st):
+                            nlinked += 1
+                            continue
+                    except OSError:
+                        size = 0
+                        mtime = 0
+
+                    files.append((entry.name, size, mtime))
+                    mtimes.append(mtime / 1e9 if mtime else None)
+
+        except OSError:
+            pass
+
+        npaired = 0
+
+        if self.pairRawExts and len(files) > 1:
+            files, npaired = remove_paired_raws(files, mtimes, self.pairRawExts)
+
+        return (subdirs, nfiles, files, npaired, nlinked)
+
+    def walk(self, top, ftypes):
+        """Генератор, возвращающий для каждого каталога дерева
+        кортежи из пяти элементов:
+        1. путь к каталогу;
+        2. общее количество файлов в каталоге;
+        3. список кортежей (имя файла, размер, время изменения
+           в наносекундах) для файлов с расширениями из ftypes
+           (множества расширений в нижнем регистре); неизвестные
+           размер и время - 0 (время из os.DirEntry.stat() избавляет
+           от повторного os.stat() при проверке актуальности кэшей
+           метаданных, см. MetadataExtractor.fileStat);
+        4. количество RAW-файлов, не отобранных как часть пар RAW+JPEG;
+        5. количество файлов, не отобранных, т.к. они уже отобраны
+           под другим именем (жёсткие и символические ссылки).
+
+        При многопоточном обходе каталоги возвращаются в произвольном
+        порядке. Если генератор закрыт до окончания обхода (напр.
+        при прерывании сбора статистики), рабочие потоки завершаются."""
+
+        self.reset(top)
+
+        if self.nthreads <= 1:
+            return self.__walk_serial(top, ftypes)
+        else:
+            return self.__walk_parallel(top, ftypes)
+
+    def __walk_serial(self, top, ftypes):
+        stack = [top]
+
+        while stack:
+            dirpath = stack.pop()
+            subdirs, nfiles, files, npaired, nlinked = self.list_dir(dirpath, top, ftypes)
+
+            # в обратном порядке - чтобы каталоги шли в порядке листинга
+            subdirs.reverse()
+            stack.extend(subdirs)
+
+            yield (dirpath, nfiles, files, npaired, nlinked)
+
+    def __walk_parallel(self, top, ftypes):
+        queues = [deque() for ix in range(self.nthreads)]
+        queues[0].append(top)
+
+        results = SimpleQueue()
+
+        cond = Condition()
+        # pending - кол-во каталогов, которые находятся в очередях
+        # или обрабатываются в данный момент; stop - флаг прерывания
+        state = {'pending': 1, 'stop': False}
+
+        def get_work(ix):
+            # сначала - из своей очереди (с конца)
+            try:
+                return queues[ix].pop()
+            except IndexError:
+                pass
+
+            # потом - воруем у соседей (с начала)
+            for jx in range(1, self.nthreads):
+                try:
+                    return queues[(ix + jx) % self.nthreads].popleft()
+                except IndexError:
+                    pass
+
+            return None
+
+        def worker(ix):
+            try:
+                while True:
+                    dirpath = get_work(ix)
+
+                    if dirpath is None:
+                        with cond:
+                            if state['stop'] or state['pending'] == 0:
+                                return
+
+                            # каталоги могут появиться в очередях позже -
+                            # их добавляют потоки, ещё читающие каталоги
+                            cond.wait(0.05)
+
+                        continue
+
+                    subdirs, nfiles, files, npaired, nlinked = self.list_dir(dirpath, top, ftypes)
+
+                    results.put((dirpath, nfiles, files, npaired, nlinked))
+
+                    with cond:
+                        # подкаталоги добавляются в очередь одновременно
+                        # с увеличением счётчика, иначе соседний поток мог бы
+                        # успеть обработать подкаталог и обнулить счётчик раньше
+                        queues[ix].extend(subdirs)
+                        state['pending'] += len(subdirs) - 1
+
+                        if subdirs or state['pending'] == 0:
+                            cond.notify_all()
+
+                        if state['stop']:
+                            return
+            finally:
+                # признак завершения потока
+                results.put(None)
+
+        threads = [Thread(target=worker, args=(ix,), daemon=True) for ix in range(self.nthreads)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            nrunning = len(threads)
+
+            while nrunning:
+                r = results.get()
+
+                if r is None:
+                    nrunning -= 1
+                else:
+                    yield r
+        finally:
+            with cond:
+                state['stop'] = True
+                cond.notify_all()
+
+            for thread in threads:
+                thread.join()
+
+
+def create_walker(config):
+    """Создаёт экземпляр DirWalker (или pstat_manifest.ManifestWalker,
+    если задан файл манифеста) в соответствии с настройками
+    config (экземпляр pstat_config.Configuration)."""
+
+    # пары RAW+JPEG имеет смысл искать, только если обрабатываются оба типа файлов
+    pairRawExts = config.cfgRAWFileExtensions if config.cfgPairRawJpeg and config.cfgScanRAWFiles and config.cfgScanImageFiles else None
+
+    if config.cfgManifestFile:
+        from pstat_manifest import ManifestWalker
+
+        return ManifestWalker(config.cfgManifestFile, config.cfgExcludeDirs, pairRawExts)
+
+    return DirWalker(config.cfgWalkThreads, config.cfgExcludeDirs, pairRawExts, config.cfgFollowSymlinks)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    import sys
+    from time import perf_counter
+
+    top = sys.argv[1] if len(sys.argv) > 1 else '.'
+
+    for nthreads in (1, 8):
+        t0 = perf_counter()
+        ndirs = nfiles = npairs = nlinks = 0
+
+        for dirpath, n, files, npaired, nlinked in DirWalker(nthreads, ('.git', '__pycache__'), {'.nef'}, True).walk(top, {'.jpg', '.nef'}):
+            ndirs += 1
+            nfiles += n
+            npairs += npaired
+            nlinks += nlinked
+
+        print('threads: %d, dirs: %d, files: %d, RAW+JPEG pairs: %d, links: %d, %.3f s' % (nthreads, ndirs, nfiles, npairs, nlinks, perf_counter() - t0))
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" test_exif.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Проверка встроенного разборщика EXIF (pstat_exif) и выбора разборщика
+# в pstat_extract.extract_metadata() на маленьких синтетических
+# файлах JPEG и TIFF.
+
+
+import os
+import io
+import struct
+import tempfile
+import unittest
+from fractions import Fraction
+from unittest import mock
+
+import pstat_extract
+from pstat_exif import read_exif, ExifFormatError, ExifMetadata, TAG_EXIF_IFD_POINTER, \
+    TYPE_ASCII, TYPE_SHORT, TYPE_LONG, TYPE_RATIONAL
+from pstat_sniff import sniff_header, SNIFF_SIZE, CT_JPEG, CT_TIFF
+
+
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_EXPOSURE = 0x829A
+TAG_FNUMBER = 0x829D
+TAG_ISO_RATINGS = 0x8827
+TAG_ISO_SPEED = 0x8833
+TAG_DATE_ORIGINAL = 0x9003
+TAG_FOCAL = 0x920A
+
+
+def build_ifd(entries, offset, bo):
+    """Возвращает IFD, который будет находиться по смещению offset.
+    entries - список кортежей (тэг, тип, значение); значения RATIONAL -
+    кортежи (числитель, знаменатель); не помещающиеся в запись значения
+    размещаются сразу после IFD."""
+
+    dataOffset = offset + 2 + len(entries) * 12 + 4
+
+    ifd = struct.pack(bo + 'H', len(entries))
+    data = b''
+
+    for tag, vtype, value in sorted(entries):
+        if vtype == TYPE_ASCII:
+            raw = value.encode('ascii') + b'\x00'
+        elif vtype == TYPE_SHORT:
+            raw = struct.pack(bo + 'H', value)
+        elif vtype == TYPE_LONG:
+            raw = struct.pack(bo + 'L', value)
+        else:
+            raw = struct.pack(bo + 'LL', *value)
+
+        count = len(raw) if vtype == TYPE_ASCII else 1
+
+        if len(raw) <= 4:
+            field = raw.ljust(4, b'\x00')
+        else:
+            field = struct.pack(bo + 'L', dataOffset + len(data))
+            data += raw + b'\x00' * (len(raw) & 1)
+
+        ifd += struct.pack(bo + 'HHL', tag, vtype, count) + field
+
+    return ifd + struct.pack(bo + 'L', 0) + data
+
+
+def build_tiff(imageTags, photoTags, bo='<'):
+    """Возвращает структуру TIFF с IFD0 (imageTags) и, если photoTags
+    не пусто, Exif IFD (photoTags)."""
+
+    header = (b'II' if bo == '<' else b'MM') + struct.pack(bo + 'HL', 42, 8)
+
+    if not photoTags:
+        return header + build_ifd(imageTags, 8, bo)
+
+    # размер IFD0 от значения указателя не зависит
+    ifd0 = build_ifd(imageTags + [(TAG_EXIF_IFD_POINTER, TYPE_LONG, 0)], 8, bo)
+    exifOffset = 8 + len(ifd0)
+    ifd0 = build_ifd(imageTags + [(TAG_EXIF_IFD_POINTER, TYPE_LONG, exifOffset)], 8, bo)
+
+    return header + ifd0 + build_ifd(photoTags, exifOffset, bo)
+
+
+def build_jpeg(tiff=None):
+    """Возвращает JPEG (без изображения) с сегментом APP1 с EXIF,
+    если tiff не None."""
+
+    data = b'\xff\xd8'
+    # APP0 (JFIF) - EXIF обычно не первый сегмент
+    data += b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+
+    if tiff is not None:
+        payload = b'Exif\x00\x00' + tiff
+        data += b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+    return data + b'\xff\xda\x00\x02' + b'\x00' * 16 + b'\xff\xd9'
+
+
+IMAGE_TAGS = [(TAG_MAKE, TYPE_ASCII, 'NIKON CORPORATION'),
+    (TAG_MODEL, TYPE_ASCII, 'NIKON D750')]
+
+PHOTO_TAGS = [(TAG_EXPOSURE, TYPE_RATIONAL, (1, 250)),
+    (TAG_FNUMBER, TYPE_RATIONAL, (28, 10)),
+    (TAG_ISO_RATINGS, TYPE_SHORT, 400),
+    (TAG_DATE_ORIGINAL, TYPE_ASCII, '2021:05:03 10:00:00'),
+    (TAG_FOCAL, TYPE_RATIONAL, (500, 10))]
+
+
+def parse(data):
+    head = data[:SNIFF_SIZE]
+
+    return read_exif(io.BytesIO(data), sniff_header(head), head)
+
+
+def replace_tag(tags, tag, vtype, value):
+    return [t for t in tags if t[0] != tag] + ([(tag, vtype, value)] if vtype else [])
+
+
+class ExifParserTest(unittest.TestCase):
+    def check_full(self, md):
+        self.assertIsNotNone(md)
+        self.assertTrue(md.has_exif())
+        self.assertTrue(md.is_complete())
+        self.assertEqual(md.get_focal_length(), 50.0)
+        self.assertEqual(md.get_exif_tag_rational('Exif.Photo.FNumber'), Fraction(28, 10))
+        self.assertEqual(md.get_exif_tag_rational('Exif.Photo.ExposureTime'), Fraction(1, 250))
+        self.assertEqual(md.get_iso_speed(), 400)
+        self.assertEqual(md.get_tag_string('Exif.Image.Model'), 'NIKON D750')
+        self.assertEqual(md.get_tag_string('Exif.Photo.DateTimeOriginal'), '2021:05:03 10:00:00')
+
+    def test_tiff_little_endian(self):
+        data = build_tiff(IMAGE_TAGS, PHOTO_TAGS, '<')
+
+        self.assertEqual(sniff_header(data[:SNIFF_SIZE]), CT_TIFF)
+        self.check_full(parse(data))
+
+    def test_tiff_big_endian(self):
+        data = build_tiff(IMAGE_TAGS, PHOTO_TAGS, '>')
+
+        self.assertEqual(sniff_header(data[:SNIFF_SIZE]), CT_TIFF)
+        self.check_full(parse(data))
+
+    def test_jpeg(self):
+        data = build_jpeg(build_tiff(IMAGE_TAGS, PHOTO_TAGS, '>'))
+
+        self.assertEqual(sniff_header(data[:SNIFF_SIZE]), CT_JPEG)
+        self.check_full(parse(data))
+
+    def test_jpeg_without_exif(self):
+        self.assertIsNone(parse(build_jpeg()))
+
+    def test_no_known_tags(self):
+        # разобран, но нужных тэгов нет
+        self.assertIsNone(parse(build_tiff([(0x0100, TYPE_LONG, 640)], [])))
+
+    def test_broken_jpeg(self):
+        data = build_jpeg(build_tiff(IMAGE_TAGS, PHOTO_TAGS))
+        # портим маркер второго сегмента
+        data = data[:20] + b'\x00' + data[21:]
+
+        with self.assertRaises(ExifFormatError):
+            parse(data)
+
+    def test_broken_tiff(self):
+        data = build_tiff(IMAGE_TAGS, PHOTO_TAGS)
+
+        with self.assertRaises(ExifFormatError):
+            parse(data[:4] + struct.pack('<L', 100000) + data[8:])
+
+    def test_missing_iso_is_incomplete(self):
+        md = parse(build_tiff(IMAGE_TAGS, replace_tag(PHOTO_TAGS, TAG_ISO_RATINGS, None, None)))
+
+        self.assertEqual(md.get_iso_speed(), 0)
+        self.assertFalse(md.is_complete())
+
+    def test_missing_focal_is_incomplete(self):
+        md = parse(build_tiff(IMAGE_TAGS, replace_tag(PHOTO_TAGS, TAG_FOCAL, None, None)))
+
+        self.assertEqual(md.get_focal_length(), -1.0)
+        self.assertFalse(md.is_complete())
+
+    def test_iso_overflow(self):
+        tags = replace_tag(PHOTO_TAGS, TAG_ISO_RATINGS, TYPE_SHORT, 65535)
+
+        md = parse(build_tiff(IMAGE_TAGS, tags))
+        self.assertFalse(md.is_complete())
+
+        md = parse(build_tiff(IMAGE_TAGS, tags + [(TAG_ISO_SPEED, TYPE_LONG, 102400)]))
+        self.assertEqual(md.get_iso_speed(), 102400)
+        self.assertTrue(md.is_complete())
+
+
+class FakeGExiv2():
+    """Замена модуля GExiv2: Metadata() возвращает заранее заданные
+    метаданные (или генерирует исключение, если они None)."""
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.opened = []
+
+    def Metadata(self, fpath):
+        self.opened.append(fpath)
+
+        if self.tags is None:
+            raise RuntimeError('unsupported format')
+
+        return ExifMetadata(self.tags)
+
+
+class ExtractMetadataTest(unittest.TestCase):
+    GEXIV2_TAGS = {'Exif.Photo.FocalLength': Fraction(85),
+        'Exif.Photo.FNumber': Fraction(18, 10),
+        'Exif.Photo.ISOSpeedRatings': 3200}
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def extract(self, data, gexiv2Tags=GEXIV2_TAGS):
+        fpath = os.path.join(self.tmpdir.name, 'photo')
+
+        with open(fpath, 'wb') as f:
+            f.write(data)
+
+        gexiv2 = FakeGExiv2(gexiv2Tags)
+
+        with mock.patch.object(pstat_extract, 'get_gexiv2', return_value=gexiv2):
+            return (pstat_extract.extract_metadata(fpath), len(gexiv2.opened))
+
+    def test_complete_exif_is_read_by_builtin_parser(self):
+        md, nopened = self.extract(build_jpeg(build_tiff(IMAGE_TAGS, PHOTO_TAGS)))
+
+        self.assertEqual(nopened, 0)
+        self.assertEqual((md.focal, md.aperture, md.iso, md.year, md.month), (50, 2.8, 400, 2021, 5))
+        self.assertEqual(md.camera, 'NIKON D750')
+
+    def test_missing_iso_falls_back_to_gexiv2(self):
+        md, nopened = self.extract(build_tiff(IMAGE_TAGS, replace_tag(PHOTO_TAGS, TAG_ISO_RATINGS, None, None)))
+
+        self.assertEqual(nopened, 1)
+        self.assertEqual((md.focal, md.iso), (85, 3200))
+
+    def test_no_known_tags_falls_back_to_gexiv2(self):
+        md, nopened = self.extract(build_tiff([(0x0100, TYPE_LONG, 640)], []))
+
+        self.assertEqual(nopened, 1)
+        self.assertIsNotNone(md)
+
+    def test_jpeg_without_exif_falls_back_to_gexiv2(self):
+        md, nopened = self.extract(build_jpeg(), None)
+
+        self.assertEqual(nopened, 1)
+        self.assertIsNone(md)
+
+    def test_broken_file_falls_back_to_gexiv2(self):
+        data = build_jpeg(build_tiff(IMAGE_TAGS, PHOTO_TAGS))
+        md, nopened = self.extract(data[:20] + b'\x00' + data[21:])
+
+        self.assertEqual(nopened, 1)
+        self.assertEqual(md.iso, 3200)
+
+    def test_unknown_signature_is_rejected(self):
+        md, nopened = self.extract(b'not a photo at all, just some text\n')
+
+        self.assertEqual(nopened, 0)
+        self.assertIsNone(md)
+
+
+if __name__ == '__main__':
+    unittest.main()
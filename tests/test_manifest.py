@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" test_manifest.py
+
+    This file is part of PhotoStat.
+
+    PhotoStat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoStat is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoStat.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+# Проверка разбора манифестов (pstat_manifest) во всех форматах,
+# описанных в README.
+
+
+import os
+import io
+import gzip
+import bz2
+import lzma
+import struct
+import tempfile
+import unittest
+
+from pstat_manifest import ManifestReader, ManifestWalker, MLOCATE_MAGIC
+
+
+MTIME = 1620000000.5
+
+FTYPES = {'.jpg', '.nef'}
+
+
+def build_mlocate(root, dirs):
+    """Возвращает содержимое mlocate.db; dirs - список кортежей
+    (путь каталога, [(имя, признак каталога), ...])."""
+
+    conf = b'prune_bind_mounts\0\0'
+
+    data = MLOCATE_MAGIC + struct.pack('>IBB2x', len(conf), 0, 1) + root + b'\0' + conf
+
+    for dirpath, entries in dirs:
+        data += struct.pack('>QL4x', 1620000000, 0) + dirpath + b'\0'
+
+        for name, isdir in entries:
+            data += bytes((1 if isdir else 0,)) + name + b'\0'
+
+        data += b'\x02'
+
+    return data
+
+
+def read_entries(data):
+    return list(ManifestReader(io.BytesIO(data)).entries())
+
+
+class ManifestReaderTest(unittest.TestCase):
+    def test_find_print(self):
+        self.assertEqual(read_entries(b'/photos/a\n/photos/a/x.jpg\n'),
+            [(b'/photos/a', 0, None, None), (b'/photos/a/x.jpg', 0, None, None)])
+
+    def test_find_print0(self):
+        self.assertEqual(read_entries(b'/photos/a/x y.jpg\0/photos/a/z\n.jpg\0'),
+            [(b'/photos/a/x y.jpg', 0, None, None), (b'/photos/a/z\n.jpg', 0, None, None)])
+
+    def test_find_printf_readme(self):
+        # find . -printf '%y\t%s\t%T@\t%p\n'
+        self.assertEqual(read_entries(b'd\t4096\t1620000000.1234567890\t./a\n'
+            b'f\t12345\t1620000000.5000000000\t./a/x.jpg\n'),
+            [(b'./a', 4096, 1620000000.123456789, 'd'), (b'./a/x.jpg', 12345, MTIME, 'f')])
+
+    def test_find_printf_mtime_only(self):
+        # find -printf '%T@\t%p\n'
+        self.assertEqual(read_entries(b'1620000000.5\t/photos/a/x.jpg\n'),
+            [(b'/photos/a/x.jpg', 0, MTIME, None)])
+
+    def test_find_printf_any_order(self):
+        expected = [(b'/photos/a/x.jpg', 12345, MTIME, 'f')]
+
+        self.assertEqual(read_entries(b'f\t1620000000.5\t12345\t/photos/a/x.jpg\n'), expected)
+        self.assertEqual(read_entries(b'12345\tf\t1620000000.5\t/photos/a/x.jpg\n'), expected)
+        self.assertEqual(read_entries(b'f\t1620000000.5\t/photos/a/x.jpg\n'),
+            [(b'/photos/a/x.jpg', 0, MTIME, 'f')])
+
+    def test_find_printf_tab_in_path(self):
+        self.assertEqual(read_entries(b'f\t12345\t/photos/a\tb/1\t2.jpg\n'),
+            [(b'/photos/a\tb/1\t2.jpg', 12345, None, 'f')])
+
+    def test_rsync_list_only(self):
+        entries = read_entries(b'drwxr-xr-x          4,096 2021/05/03 00:00:00 a\n'
+            b'-rw-r--r--      1,234,567 2021/05/03 00:00:00 a/x.jpg\n')
+
+        self.assertEqual([(fpath, size, ftype) for fpath, size, mtime, ftype in entries],
+            [(b'a', 4096, 'd'), (b'a/x.jpg', 1234567, 'f')])
+        self.assertIsNotNone(entries[1][2])
+
+    def test_mlocate(self):
+        data = build_mlocate(b'/photos', [(b'/photos', [(b'a', True)]),
+            (b'/photos/a', [(b'x.jpg', False), (b'y.nef', False)])])
+
+        self.assertEqual(read_entries(data), [(b'/photos/a', 0, None, 'd'),
+            (b'/photos/a/x.jpg', 0, None, 'f'), (b'/photos/a/y.nef', 0, None, 'f')])
+
+    def test_unparsable_records_are_skipped(self):
+        self.assertEqual(read_entries(b'f\t12345\t\n'
+            b'-rw-r--r--              , 2021/05/03 00:00:00 a/bad.jpg\n'
+            b'f\t12345\t1620000000.5\t/photos/a/x.jpg\n'),
+            [(b'/photos/a/x.jpg', 12345, MTIME, 'f')])
+
+
+class ManifestWalkerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def walk(self, data, opener=open, top='/photos', **kwargs):
+        fname = os.path.join(self.tmpdir.name, 'manifest')
+
+        with opener(fname, 'wb') as f:
+            f.write(data)
+
+        return [(dirpath, nfiles, sorted(files), npaired) for dirpath, nfiles, files, npaired, nlinked
+            in ManifestWalker(fname, **kwargs).walk(top, FTYPES)]
+
+    def test_find_print_dirs(self):
+        # каталоги распознаются по следующей строке
+        self.assertEqual(self.walk(b'/photos\n/photos/a\n/photos/a/x.jpg\n/photos/a/notes.txt\n/other/y.jpg\n'),
+            [('/photos/a', 2, [('x.jpg', 0, 0)], 0)])
+
+    def test_relative_paths(self):
+        self.assertEqual(self.walk(b'f\t12345\t1620000000.5\t./a/x.jpg\nf\t1\t1620000000.5\t../b/y.jpg\n'),
+            [('/photos/a', 1, [('x.jpg', 12345, 0)], 0)])
+
+    def test_compressed(self):
+        data = b'f\t12345\t1620000000.5\t/photos/a/x.jpg\n'
+        expected = [('/photos/a', 1, [('x.jpg', 12345, 0)], 0)]
+
+        for opener in (gzip.open, bz2.open, lzma.open):
+            self.assertEqual(self.walk(data, opener), expected)
+
+    def test_pairs_by_mtime(self):
+        data = (b'1620000000.5\t/photos/a/x.jpg\n1620000010.5\t/photos/a/x.nef\n'
+            b'1620000000.5\t/photos/a/y.jpg\n1620090000.5\t/photos/a/y.nef\n')
+
+        self.assertEqual(self.walk(data, pairRawExts={'.nef'}),
+            [('/photos/a', 4, [('x.jpg', 0, 0), ('y.jpg', 0, 0), ('y.nef', 0, 0)], 1)])
+
+    def test_excluded_dirs(self):
+        self.assertEqual(self.walk(b'/photos/a/x.jpg\n/photos/.trash/b/y.jpg\n', excludeDirs=('.trash',)),
+            [('/photos/a', 1, [('x.jpg', 0, 0)], 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()